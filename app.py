@@ -2,11 +2,17 @@ import os
 import sys
 import io
 import json
+import base64
+import time
 import sqlite3
-import csv
+import threading
+import queue
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
 import re
-from flask import Flask, request, jsonify, render_template, send_file, redirect, send_from_directory, session, url_for
+from flask import Flask, Response, request, jsonify, render_template, send_file, redirect, send_from_directory, session, url_for, g, has_request_context, stream_with_context
+import click
 try:
     from reportlab.lib.units import mm
     from reportlab.pdfgen import canvas
@@ -21,6 +27,21 @@ try:
 except Exception:
     def num2words(n): return str(n)
 from werkzeug.utils import secure_filename
+from mysql_pool import PoolMySQL, ConexionPeticion
+from instrumentacion_sql import EstadisticasPeticion, MedidorSQL, ConexionMedida, ConexionSQLiteMedida
+from migraciones import RegistroMigraciones, asegurar_indices
+from esquema import CatalogoEsquema
+from auditoria_sql import auditar
+from indice_productos import IndiceProductos
+from busqueda import IndiceNombres, normalizar, similitud
+from cache_http import VersionesDatos
+from compresion import CompresorRespuestas
+from catalogo_csv import CatalogoCSV
+import importacion
+import exportacion
+from conflictos import InventarioExistente
+from trabajos import GestorTrabajos
+from inventario_repo import CodigoDuplicado, MySQLInventoryRepository, SQLiteInventoryRepository
 try:
     import pandas as pd
     PANDAS_AVAILABLE = True
@@ -46,27 +67,100 @@ UPLOAD_FOLDER = os.path.join(APP_DIR, "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH, timeout=10)
+# Instrumentación de SQL: sentencias y tiempo por petición (cabecera Server-Timing)
+# y log de consultas lentas por encima de APP_SLOW_QUERY_MS
+def _stats_sql_actual():
+    if not has_request_context():
+        return None
+    stats = g.get("_sql_stats")
+    if stats is None:
+        stats = EstadisticasPeticion()
+        g._sql_stats = stats
+    return stats
+
+def _contexto_sql():
+    return f"{request.method} {request.path}" if has_request_context() else "fuera de petición"
+
+medidor_sql = MedidorSQL(
+    _stats_sql_actual,
+    umbral_ms=float(os.getenv("APP_SLOW_QUERY_MS", "200")),
+    ruta_log=os.getenv("APP_SLOW_QUERY_LOG", os.path.join(APP_DIR, "consultas_lentas.log")),
+    contexto=_contexto_sql,
+)
+
+# Conexiones SQLite. La app corre con app.run (servidor con hilos de Werkzeug,
+# un hilo nuevo por petición), así que una conexión por hilo sería una por
+# petición. Las peticiones toman una conexión ya configurada de una cola
+# acotada y la devuelven en el teardown; si no hay libre se abre otra y, al
+# devolverla con la cola llena, se cierra. Los hilos de fondo (trabajos,
+# recargas de índices) no tienen petición y usan una conexión propia del hilo.
+# Vale igual con servidores de pool de hilos (waitress, gunicorn gthread);
+# con varios procesos cada uno tiene su cola
+_sqlite_local = threading.local()
+_sqlite_libres = queue.LifoQueue(maxsize=int(os.getenv("APP_SQLITE_POOL_MAX", "8")))
+
+def _abrir_sqlite():
+    # check_same_thread=False: la conexión pasa de un hilo a otro por la cola, usada por uno a la vez
+    conn = sqlite3.connect(DB_PATH, timeout=10, cached_statements=512, factory=ConexionSQLiteMedida,
+                           check_same_thread=False)
+    conn.medidor = medidor_sql
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-16000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=10000")
+    return conn
+
+def get_db():
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is None:
+        prestada = has_request_context()
+        try:
+            conn = _sqlite_libres.get_nowait() if prestada else _abrir_sqlite()
+        except queue.Empty:
+            conn = _abrir_sqlite()
+        _sqlite_local.conn = conn
+        _sqlite_local.prestada = prestada
+        _sqlite_local.en_transaccion = False
     return conn
 
+@contextmanager
+def transaccion():
+    """
+    Agrupa varias sentencias SQLite en un solo commit.
+    Dentro del bloque, execute() no confirma; una transacción anidada se une a la externa
+    """
+    conn = get_db()
+    if _sqlite_local.en_transaccion:
+        yield conn
+        return
+    _sqlite_local.en_transaccion = True
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _sqlite_local.en_transaccion = False
+
 def query_all(sql, params=()):
-    with get_db() as conn:
-        cur = conn.execute(sql, params)
-        return [dict(r) for r in cur.fetchall()]
+    cur = get_db().execute(sql, params)
+    return [dict(r) for r in cur.fetchall()]
 
 def query_one(sql, params=()):
-    with get_db() as conn:
-        cur = conn.execute(sql, params)
-        row = cur.fetchone()
-        return dict(row) if row else None
+    cur = get_db().execute(sql, params)
+    row = cur.fetchone()
+    return dict(row) if row else None
 
 def execute(sql, params=()):
-    with get_db() as conn:
-        cur = conn.execute(sql, params)
+    conn = get_db()
+    cur = conn.execute(sql, params)
+    if not _sqlite_local.en_transaccion:
         conn.commit()
-        return cur.lastrowid
+    return cur.lastrowid
 
 def calcular_totales_detalle(items):
     exento = 0.0
@@ -170,7 +264,7 @@ def generar_pdf_factura(factura_id, cliente_nombre, items, totales, efectivo=Non
 
     if conectar_mysql is not None:
         try:
-            connm = conectar_mysql()
+            connm = get_mysql()
             curm = connm.cursor()
             # Intentar buscar CAI activo del tipo requerido
             curm.execute("SELECT cai, establecimiento, punto_emision, tipo_doc, numero_documento, rango_i, rango_f, f_limite FROM info_cai WHERE activo=1 AND tipo=%s ORDER BY id DESC LIMIT 1", (tipo_req,))
@@ -484,126 +578,223 @@ except Exception:
     MYSQL_USER = None
     MYSQL_DB = None
 SKIP_MYSQL_INIT = (os.getenv("APP_SKIP_MYSQL_INIT") == "1")
-def _asegurar_tabla_categorias_local():
-    try:
-        with get_db() as conn:
-            conn.execute("CREATE TABLE IF NOT EXISTS categorias (id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT UNIQUE NOT NULL)")
-    except Exception:
-        pass
-def _asegurar_tabla_inventario_barras_local():
-    try:
-        with get_db() as conn:
-            conn.execute("CREATE TABLE IF NOT EXISTS inventario_barras (id INTEGER PRIMARY KEY AUTOINCREMENT, producto_id INTEGER NOT NULL, barra TEXT UNIQUE NOT NULL)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_inventario_barras_producto ON inventario_barras (producto_id)")
-    except Exception:
-        pass
-def _asegurar_tabla_info_cai_local():
-    try:
-        with get_db() as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS info_cai (
-                    autorizacion INTEGER PRIMARY KEY AUTOINCREMENT,
-                    cai TEXT NOT NULL,
-                    fecha_solicitud TEXT,
-                    rango_i INTEGER,
-                    rango_f INTEGER,
-                    f_limite TEXT,
-                    establecimiento INTEGER,
-                    punto_emision INTEGER,
-                    tipo_doc INTEGER,
-                    numero_documento INTEGER,
-                    activo INTEGER DEFAULT 1,
-                    tipo TEXT DEFAULT 'G'
-                )
-            """)
-            try:
-                conn.execute("ALTER TABLE info_cai ADD COLUMN activo INTEGER DEFAULT 1")
-            except Exception:
-                pass
-            try:
-                conn.execute("ALTER TABLE info_cai ADD COLUMN tipo TEXT DEFAULT 'G'")
-            except Exception:
-                pass
-    except Exception:
-        pass
-def _asegurar_tabla_info_cai_mysql():
-    if conectar_mysql is None:
+
+# Pool de conexiones MySQL: una conexión por petición, devuelta en el teardown
+_mysql_pool = None
+if conectar_mysql is not None:
+    _mysql_pool = PoolMySQL(
+        lambda: ConexionMedida(conectar_mysql(), medidor_sql),
+        minimo=int(os.getenv("APP_MYSQL_POOL_MIN", "1")),
+        maximo=int(os.getenv("APP_MYSQL_POOL_MAX", "8")),
+        espera=float(os.getenv("APP_MYSQL_POOL_TIMEOUT", "5")),
+        reciclar=float(os.getenv("APP_MYSQL_POOL_RECYCLE", "1800")),
+    )
+
+def get_mysql():
+    # Fuera de una petición se presta una conexión suelta (close() la devuelve)
+    if not has_request_context():
+        return _mysql_pool.obtener()
+    conn = g.get("_mysql_conn")
+    if conn is None:
+        conn = ConexionPeticion(_mysql_pool.obtener())
+        g._mysql_conn = conn
+    return conn
+
+@app.after_request
+def _cabecera_server_timing(resp):
+    stats = g.get("_sql_stats")
+    if stats is not None and stats.consultas:
+        previo = resp.headers.get("Server-Timing")
+        resp.headers["Server-Timing"] = f"{previo}, {stats.server_timing()}" if previo else stats.server_timing()
+        medidor_sql.registrar_peticion(stats)
+    return resp
+
+# Compresión gzip/brotli de respuestas de texto (APP_COMPRESION_MIN bytes como mínimo)
+compresor_respuestas = CompresorRespuestas(minimo=int(os.getenv("APP_COMPRESION_MIN", "1024")))
+app.after_request(compresor_respuestas.comprimir)
+
+@app.teardown_appcontext
+def _devolver_mysql(exc):
+    conn = g.pop("_mysql_conn", None)
+    if conn is not None:
+        conn.devolver()
+
+@app.teardown_appcontext
+def _cerrar_transaccion_sqlite(exc):
+    # No dejar transacciones abiertas; la conexión prestada a la petición vuelve a la cola
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is None:
         return
-    try:
-        connm = conectar_mysql()
-        cur = connm.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS info_cai (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                cai VARCHAR(255) NOT NULL,
-                fecha_solicitud VARCHAR(32),
-                rango_i INT,
-                rango_f INT,
-                f_limite VARCHAR(32),
-                establecimiento INT,
-                punto_emision INT,
-                tipo_doc INT,
-                numero_documento INT,
-                activo TINYINT DEFAULT 1,
-                tipo CHAR(1) DEFAULT 'G'
-            )
-        """)
+    sana = True
+    if conn.in_transaction:
         try:
-            cur.execute("SHOW COLUMNS FROM info_cai")
-            cols = [r[0].lower() for r in cur.fetchall()]
-            
-            if 'rango_inicial' in cols and 'rango_i' not in cols:
-                try: cur.execute("ALTER TABLE info_cai CHANGE rango_inicial rango_i INT")
-                except: pass
-            if 'rango_final' in cols and 'rango_f' not in cols:
-                try: cur.execute("ALTER TABLE info_cai CHANGE rango_final rango_f INT")
-                except: pass
-            if 'fecha_limite' in cols and 'f_limite' not in cols:
-                try: cur.execute("ALTER TABLE info_cai CHANGE fecha_limite f_limite VARCHAR(32)")
-                except: pass
-                
-            # Refresh cols
-            cur.execute("SHOW COLUMNS FROM info_cai")
-            cols = [r[0].lower() for r in cur.fetchall()]
-            
-            if 'fecha_solicitud' not in cols:
-                try: cur.execute("ALTER TABLE info_cai ADD COLUMN fecha_solicitud VARCHAR(32)")
-                except: pass
-            if 'establecimiento' not in cols:
-                try: cur.execute("ALTER TABLE info_cai ADD COLUMN establecimiento INT")
-                except: pass
-            if 'punto_emision' not in cols:
-                try: cur.execute("ALTER TABLE info_cai ADD COLUMN punto_emision INT")
-                except: pass
-            if 'tipo_doc' not in cols:
-                try: cur.execute("ALTER TABLE info_cai ADD COLUMN tipo_doc INT")
-                except: pass
-            if 'numero_documento' not in cols:
-                try: cur.execute("ALTER TABLE info_cai ADD COLUMN numero_documento INT")
-                except: pass
-            if 'tipo' not in cols:
-                try: cur.execute("ALTER TABLE info_cai ADD COLUMN tipo CHAR(1) DEFAULT 'G'")
-                except: pass
+            conn.rollback()
         except Exception:
-            pass
-        connm.commit()
-        connm.close()
+            sana = False
+    if not getattr(_sqlite_local, "prestada", False):
+        return
+    _sqlite_local.conn = None
+    _sqlite_local.prestada = False
+    try:
+        if not sana:
+            raise queue.Full
+        _sqlite_libres.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+if _mysql_pool is not None and not SKIP_MYSQL_INIT:
+    try:
+        _mysql_pool.precargar()
     except Exception:
-        try:
-            connm.close()
-        except Exception:
-            pass
+        pass
 def _tabla_cai(tipo: str) -> str:
     t = (tipo or "G").strip().upper()
     return "info_cai_general" if t == "G" else "info_cai_exenta"
-def _asegurar_tablas_cai_separadas_mysql():
-    if conectar_mysql is None:
-        return
-    try:
-        connm = conectar_mysql()
-        cur = connm.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS info_cai_general (
+
+# --------- Migraciones de esquema ---------
+# Se aplican una vez al arrancar (o con `flask --app app migrar`); las rutas no ejecutan DDL
+migraciones_sqlite = RegistroMigraciones("sqlite")
+migraciones_mysql = RegistroMigraciones("mysql")
+# Columnas de cada tabla, leídas una vez por proceso y olvidadas al migrar
+esquema_sqlite = CatalogoEsquema("sqlite")
+esquema_mysql = CatalogoEsquema("mysql")
+migraciones_sqlite.al_aplicar(esquema_sqlite.invalidar)
+migraciones_mysql.al_aplicar(esquema_mysql.invalidar)
+
+@migraciones_sqlite.migracion(1, "categorias")
+def _migracion_sqlite_categorias(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS categorias (id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT UNIQUE NOT NULL)")
+
+@migraciones_sqlite.migracion(2, "inventario_barras")
+def _migracion_sqlite_inventario_barras(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS inventario_barras (id INTEGER PRIMARY KEY AUTOINCREMENT, producto_id INTEGER NOT NULL, barra TEXT UNIQUE NOT NULL)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_inventario_barras_producto ON inventario_barras (producto_id)")
+
+@migraciones_sqlite.migracion(3, "info_cai")
+def _migracion_sqlite_info_cai(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS info_cai (
+            autorizacion INTEGER PRIMARY KEY AUTOINCREMENT,
+            cai TEXT NOT NULL,
+            fecha_solicitud TEXT,
+            rango_i INTEGER,
+            rango_f INTEGER,
+            f_limite TEXT,
+            establecimiento INTEGER,
+            punto_emision INTEGER,
+            tipo_doc INTEGER,
+            numero_documento INTEGER,
+            activo INTEGER DEFAULT 1,
+            tipo TEXT DEFAULT 'G'
+        )
+    """)
+    cur.execute("PRAGMA table_info(info_cai)")
+    cols = [r[1].lower() for r in cur.fetchall()]
+    if 'activo' not in cols:
+        cur.execute("ALTER TABLE info_cai ADD COLUMN activo INTEGER DEFAULT 1")
+    if 'tipo' not in cols:
+        cur.execute("ALTER TABLE info_cai ADD COLUMN tipo TEXT DEFAULT 'G'")
+
+@migraciones_sqlite.migracion(4, "compania y clientes")
+def _migracion_sqlite_compania_clientes(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS compania (
+          nombre_cia TEXT NOT NULL,
+          direccion1 TEXT,
+          direccion2 TEXT,
+          rtn_cia TEXT,
+          correo TEXT,
+          telefono TEXT
+        )
+    """)
+    cur.execute("CREATE TABLE IF NOT EXISTS clientes (id_cliente INTEGER PRIMARY KEY AUTOINCREMENT, rtn TEXT, nombre TEXT NOT NULL)")
+
+@migraciones_sqlite.migracion(5, "ventas y logs_anulaciones")
+def _migracion_sqlite_anulaciones(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS ventas (id_venta INTEGER PRIMARY KEY AUTOINCREMENT, numero_factura TEXT, estado TEXT, fecha TEXT)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS logs_anulaciones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_venta INTEGER,
+            numero_factura TEXT,
+            usuario TEXT,
+            fecha_anulacion TEXT,
+            motivo TEXT,
+            datos_json TEXT
+        )
+    """)
+
+@migraciones_sqlite.migracion(6, "inventario.activo")
+def _migracion_sqlite_inventario_activo(cur):
+    cur.execute("PRAGMA table_info(inventario)")
+    cols = [r[1].lower() for r in cur.fetchall()]
+    if 'activo' not in cols:
+        cur.execute("ALTER TABLE inventario ADD COLUMN activo INTEGER NOT NULL DEFAULT 1")
+
+@migraciones_sqlite.migracion(7, "inventario_cambios")
+def _migracion_sqlite_inventario_cambios(cur):
+    # Una fila por producto modificado; la versión es la que sincronizan los terminales
+    cur.execute("CREATE TABLE IF NOT EXISTS inventario_cambios (version INTEGER PRIMARY KEY AUTOINCREMENT, producto_id INTEGER NOT NULL, momento TEXT DEFAULT CURRENT_TIMESTAMP)")
+
+@migraciones_sqlite.migracion(8, "trabajos")
+def _migracion_sqlite_trabajos(cur):
+    # Estado de los trabajos en segundo plano (siempre en SQLite, aunque el inventario esté en MySQL)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id TEXT PRIMARY KEY, tipo TEXT NOT NULL, estado TEXT NOT NULL,
+            total INTEGER, hechas INTEGER DEFAULT 0, errores INTEGER DEFAULT 0,
+            resultado TEXT, mensaje TEXT, cancelar INTEGER DEFAULT 0,
+            creado TEXT, actualizado TEXT
+        )
+    """)
+
+@migraciones_mysql.migracion(1, "info_cai")
+def _migracion_mysql_info_cai(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS info_cai (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            cai VARCHAR(255) NOT NULL,
+            fecha_solicitud VARCHAR(32),
+            rango_i INT,
+            rango_f INT,
+            f_limite VARCHAR(32),
+            establecimiento INT,
+            punto_emision INT,
+            tipo_doc INT,
+            numero_documento INT,
+            activo TINYINT DEFAULT 1,
+            tipo CHAR(1) DEFAULT 'G'
+        )
+    """)
+    cur.execute("SHOW COLUMNS FROM info_cai")
+    cols = [r[0].lower() for r in cur.fetchall()]
+    if 'rango_inicial' in cols and 'rango_i' not in cols:
+        cur.execute("ALTER TABLE info_cai CHANGE rango_inicial rango_i INT")
+        cols.append('rango_i')
+    if 'rango_final' in cols and 'rango_f' not in cols:
+        cur.execute("ALTER TABLE info_cai CHANGE rango_final rango_f INT")
+        cols.append('rango_f')
+    if 'fecha_limite' in cols and 'f_limite' not in cols:
+        cur.execute("ALTER TABLE info_cai CHANGE fecha_limite f_limite VARCHAR(32)")
+        cols.append('f_limite')
+    if 'fecha_solicitud' not in cols:
+        cur.execute("ALTER TABLE info_cai ADD COLUMN fecha_solicitud VARCHAR(32)")
+    if 'establecimiento' not in cols:
+        cur.execute("ALTER TABLE info_cai ADD COLUMN establecimiento INT")
+    if 'punto_emision' not in cols:
+        cur.execute("ALTER TABLE info_cai ADD COLUMN punto_emision INT")
+    if 'tipo_doc' not in cols:
+        cur.execute("ALTER TABLE info_cai ADD COLUMN tipo_doc INT")
+    if 'numero_documento' not in cols:
+        cur.execute("ALTER TABLE info_cai ADD COLUMN numero_documento INT")
+    if 'tipo' not in cols:
+        cur.execute("ALTER TABLE info_cai ADD COLUMN tipo CHAR(1) DEFAULT 'G'")
+
+@migraciones_mysql.migracion(2, "info_cai_general / info_cai_exenta")
+def _migracion_mysql_cai_separadas(cur):
+    for tbl in ("info_cai_general", "info_cai_exenta"):
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {tbl} (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 cai VARCHAR(255) NOT NULL,
                 fecha_solicitud VARCHAR(32),
@@ -617,112 +808,237 @@ def _asegurar_tablas_cai_separadas_mysql():
                 activo TINYINT DEFAULT 1
             )
         """)
+    cur.execute("SELECT COUNT(*) FROM info_cai_general")
+    cnt_g = int(cur.fetchone()[0] or 0)
+    cur.execute("SELECT COUNT(*) FROM info_cai_exenta")
+    cnt_e = int(cur.fetchone()[0] or 0)
+    # Migrar datos antiguos si las tablas nuevas están vacías
+    if cnt_g == 0:
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS info_cai_exenta (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                cai VARCHAR(255) NOT NULL,
-                fecha_solicitud VARCHAR(32),
-                rango_i INT,
-                rango_f INT,
-                f_limite VARCHAR(32),
-                establecimiento INT,
-                punto_emision INT,
-                tipo_doc INT,
-                numero_documento INT,
-                activo TINYINT DEFAULT 1
-            )
+            INSERT INTO info_cai_general (cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo)
+            SELECT cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo
+            FROM info_cai WHERE tipo='G'
         """)
-        try:
-            cur.execute("SELECT COUNT(*) FROM info_cai_general")
-            cnt_g = int(cur.fetchone()[0] or 0)
-        except Exception:
-            cnt_g = 0
-        try:
-            cur.execute("SELECT COUNT(*) FROM info_cai_exenta")
-            cnt_e = int(cur.fetchone()[0] or 0)
-        except Exception:
-            cnt_e = 0
-        # Migrar datos antiguos si existen y las tablas nuevas están vacías
-        if cnt_g == 0 or cnt_e == 0:
-            try:
-                cur.execute("SHOW TABLES LIKE 'info_cai'")
-                has_old = cur.fetchone()
-                if has_old:
-                    if cnt_g == 0:
-                        cur.execute("""
-                            INSERT INTO info_cai_general (cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo)
-                            SELECT cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo
-                            FROM info_cai WHERE tipo='G'
-                        """)
-                    if cnt_e == 0:
-                        cur.execute("""
-                            INSERT INTO info_cai_exenta (cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo)
-                            SELECT cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo
-                            FROM info_cai WHERE tipo='E'
-                        """)
-            except Exception:
-                pass
-        connm.commit()
-        connm.close()
-    except Exception:
-        try:
-            connm.close()
-        except Exception:
-            pass
-def _asegurar_tabla_cierres_caja_mysql():
-    if conectar_mysql is None:
-        return
-    try:
-        connm = conectar_mysql()
-        cur = connm.cursor()
+    if cnt_e == 0:
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS cierres_caja (
-                id_cierre INT AUTO_INCREMENT PRIMARY KEY,
-                fecha_inicio DATETIME,
-                fecha_fin DATETIME NULL,
-                monto_apertura DECIMAL(10,2) DEFAULT 0,
-                monto_cierre DECIMAL(10,2) DEFAULT 0,
-                usuario VARCHAR(255)
-            )
+            INSERT INTO info_cai_exenta (cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo)
+            SELECT cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo
+            FROM info_cai WHERE tipo='E'
         """)
+
+@migraciones_mysql.migracion(3, "cierres_caja")
+def _migracion_mysql_cierres_caja(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cierres_caja (
+            id_cierre INT AUTO_INCREMENT PRIMARY KEY,
+            fecha_inicio DATETIME,
+            fecha_fin DATETIME NULL,
+            monto_apertura DECIMAL(10,2) DEFAULT 0,
+            monto_cierre DECIMAL(10,2) DEFAULT 0,
+            usuario VARCHAR(255)
+        )
+    """)
+    cur.execute("SHOW COLUMNS FROM cierres_caja")
+    cols = [r[0].lower() for r in cur.fetchall()]
+    for col, ddl in (
+        ("fecha_inicio", "DATETIME"),
+        ("fecha_fin", "DATETIME NULL"),
+        ("monto_apertura", "DECIMAL(10,2) DEFAULT 0"),
+        ("monto_cierre", "DECIMAL(10,2) DEFAULT 0"),
+        ("usuario", "VARCHAR(255)"),
+    ):
+        if col not in cols:
+            cur.execute(f"ALTER TABLE cierres_caja ADD COLUMN {col} {ddl}")
+
+@migraciones_mysql.migracion(4, "usuarios")
+def _migracion_mysql_usuarios(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS usuarios (usuario VARCHAR(64) PRIMARY KEY, nombre VARCHAR(255) NOT NULL, contrasena VARCHAR(255) NOT NULL, rol VARCHAR(32) NOT NULL, activo TINYINT(1) NOT NULL DEFAULT 1)")
+    cur.execute("SHOW COLUMNS FROM usuarios")
+    cols = [r[0].lower() for r in cur.fetchall() if r and len(r) > 0]
+    # Renombrar columnas comunes si existen
+    for viejo, nuevo, ddl in (
+        ("password", "contrasena", "VARCHAR(255) NOT NULL"),
+        ("username", "usuario", "VARCHAR(64) NOT NULL"),
+        ("user", "usuario", "VARCHAR(64) NOT NULL"),
+        ("role", "rol", "VARCHAR(32) NOT NULL"),
+        ("name", "nombre", "VARCHAR(255) NOT NULL"),
+    ):
+        if viejo in cols and nuevo not in cols:
+            cur.execute(f"ALTER TABLE usuarios CHANGE COLUMN {viejo} {nuevo} {ddl}")
+            cols = [c for c in cols if c != viejo] + [nuevo]
+    # Agregar columnas faltantes con valores por defecto seguros
+    if 'contrasena' not in cols:
+        cur.execute("ALTER TABLE usuarios ADD COLUMN contrasena VARCHAR(255) NOT NULL DEFAULT ''")
+    if 'rol' not in cols:
+        cur.execute("ALTER TABLE usuarios ADD COLUMN rol VARCHAR(32) NOT NULL DEFAULT 'cajero'")
+    if 'activo' not in cols:
+        cur.execute("ALTER TABLE usuarios ADD COLUMN activo TINYINT(1) NOT NULL DEFAULT 1")
+
+@migraciones_mysql.migracion(5, "pedidos")
+def _migracion_mysql_pedidos(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS pedidos (
+            id_pedido INT AUTO_INCREMENT PRIMARY KEY,
+            numero_pedido VARCHAR(64),
+            fecha DATETIME,
+            cliente VARCHAR(255),
+            rtn_cliente VARCHAR(64),
+            total DECIMAL(10,2),
+            estado VARCHAR(32) DEFAULT 'pendiente',
+            usuario VARCHAR(255)
+        ) ENGINE=InnoDB
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS pedidos_detalle (
+            id_detalle INT AUTO_INCREMENT PRIMARY KEY,
+            id_pedido INT,
+            numero_pedido VARCHAR(64),
+            id VARCHAR(50),
+            nombre_articulo VARCHAR(255),
+            valor_articulo DECIMAL(10,2),
+            cantidad DECIMAL(10,2),
+            subtotal DECIMAL(10,2),
+            gravado15 DECIMAL(10,2),
+            gravado18 DECIMAL(10,2),
+            totalexento DECIMAL(10,2),
+            isv15 DECIMAL(10,2),
+            isv18 DECIMAL(10,2),
+            grantotal DECIMAL(10,2),
+            INDEX idx_numero_pedido (numero_pedido),
+            INDEX idx_id_pedido (id_pedido)
+        ) ENGINE=InnoDB
+    """)
+
+@migraciones_mysql.migracion(6, "logs_anulaciones")
+def _migracion_mysql_logs_anulaciones(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS logs_anulaciones (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            id_venta INT,
+            numero_factura VARCHAR(64),
+            usuario VARCHAR(255),
+            fecha_anulacion VARCHAR(19),
+            motivo TEXT,
+            datos_json TEXT
+        )
+    """)
+
+@migraciones_mysql.migracion(7, "inventario_cambios")
+def _migracion_mysql_inventario_cambios(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS inventario_cambios (version BIGINT AUTO_INCREMENT PRIMARY KEY, producto_id INT NOT NULL, momento TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+
+# Índices para los caminos de acceso frecuentes: (tabla, nombre, columnas).
+# Los de tablas o columnas que no existan en un motor se omiten
+INDICES = (
+    ("inventario", "idx_inventario_barra", ("barra",)),
+    ("inventario", "idx_inventario_activo_categoria", ("activo", "id_categoria")),
+    ("inventario_barras", "idx_inventario_barras_barra", ("barra",)),
+    ("inventario_barras", "idx_inventario_barras_producto", ("producto_id",)),
+    ("ventas", "idx_ventas_numero_factura", ("numero_factura",)),
+    ("ventas_detalle", "idx_ventas_detalle_id_venta", ("id_venta",)),
+    ("pedidos", "idx_pedidos_numero_pedido", ("numero_pedido",)),
+    ("pedidos", "idx_pedidos_estado", ("estado",)),
+    ("cierres_caja", "idx_cierres_caja_fecha_inicio", ("fecha_inicio",)),
+    ("inventario_cambios", "idx_inventario_cambios_producto", ("producto_id",)),
+)
+
+def inicializar_esquema(mysql=True):
+    """Aplica las migraciones pendientes y los índices: SQLite siempre, MySQL si está disponible"""
+    conn = get_db()
+    resultado = {"sqlite": migraciones_sqlite.aplicar(conn), "mysql": []}
+    asegurar_indices(conn, "sqlite", INDICES, esquema_sqlite)
+    if mysql and conectar_mysql is not None:
+        # Tablas base del proyecto principal (versionadas por el módulo db)
+        for asegurar in (asegurar_tablas_mysql, asegurar_tabla_ventas_mysql, asegurar_tabla_sar_ventas_mysql):
+            if asegurar is not None:
+                try:
+                    asegurar()
+                except Exception:
+                    pass
+        esquema_mysql.invalidar()
+        connm = get_mysql()
         try:
-            cur.execute("ALTER TABLE cierres_caja ADD COLUMN fecha_inicio DATETIME")
-        except Exception:
-            pass
-        try:
-            cur.execute("ALTER TABLE cierres_caja ADD COLUMN fecha_fin DATETIME NULL")
-        except Exception:
-            pass
-        try:
-            cur.execute("ALTER TABLE cierres_caja ADD COLUMN monto_apertura DECIMAL(10,2) DEFAULT 0")
-        except Exception:
-            pass
-        try:
-            cur.execute("ALTER TABLE cierres_caja ADD COLUMN monto_cierre DECIMAL(10,2) DEFAULT 0")
-        except Exception:
-            pass
-        try:
-            cur.execute("ALTER TABLE cierres_caja ADD COLUMN usuario VARCHAR(255)")
-        except Exception:
-            pass
-        connm.commit()
-        connm.close()
-    except Exception:
-        try:
+            resultado["mysql"] = migraciones_mysql.aplicar(connm)
+            asegurar_indices(connm, "mysql", INDICES, esquema_mysql)
+        finally:
             connm.close()
-        except Exception:
-            pass
-if not SKIP_MYSQL_INIT:
+    return resultado
+
+@app.cli.command("migrar")
+def cli_migrar():
+    """Aplica las migraciones de esquema pendientes (MySQL y SQLite)"""
+    resultado = inicializar_esquema()
+    for motor, aplicadas in resultado.items():
+        if not aplicadas:
+            print(f"{motor}: esquema al día")
+        for version, descripcion in aplicadas:
+            print(f"{motor}: migración {version} aplicada ({descripcion})")
+
+@app.cli.command("auditar-sql")
+@click.option("--motor", type=click.Choice(["mysql", "sqlite"]), default=None, help="Por defecto MySQL si está disponible")
+def cli_auditar_sql(motor):
+    """Ejecuta EXPLAIN sobre las consultas del código y señala recorridos completos de tabla"""
+    motor = motor or ("mysql" if conectar_mysql is not None else "sqlite")
+    conn = get_mysql() if motor == "mysql" else get_db()
+    rutas = [os.path.join(APP_DIR, n) for n in ("app.py", "inventario_repo.py")]
+    # Las consultas armadas en tiempo de ejecución, con un repositorio del motor auditado
+    if inventario.motor == motor:
+        repo = inventario
+    elif motor == "mysql":
+        repo = MySQLInventoryRepository(get_mysql, esquema_mysql)
+    else:
+        repo = SQLiteInventoryRepository(get_db, esquema_sqlite, transaccion)
     try:
-        if asegurar_tablas_mysql is not None:
-            asegurar_tablas_mysql()
-    except Exception:
-        pass
-_asegurar_tabla_categorias_local()
-_asegurar_tabla_inventario_barras_local()
-_asegurar_tabla_info_cai_local()
-if not SKIP_MYSQL_INIT:
-    _asegurar_tabla_info_cai_mysql()
+        resultados = auditar(conn, motor, rutas, repo.consultas_muestra(conn=conn))
+    finally:
+        if motor == "mysql":
+            conn.close()
+    con_escaneo = [r for r in resultados if r["escaneos"]]
+    for r in resultados:
+        if r["error"]:
+            print(f"? {os.path.basename(r['archivo'])}:{r['linea']} {r['error']}")
+    for r in con_escaneo:
+        print(f"! {os.path.basename(r['archivo'])}:{r['linea']} {'; '.join(r['escaneos'])}")
+        print(f"    {r['sql'][:160]}")
+    print(f"{len(resultados)} consultas revisadas, {len(con_escaneo)} con recorrido completo")
+    if con_escaneo:
+        raise SystemExit(1)
+
+try:
+    inicializar_esquema(mysql=not SKIP_MYSQL_INIT)
+except Exception as e:
+    print(f"No se pudieron aplicar las migraciones: {e}", flush=True)
+
+# Repositorio de inventario: el backend se elige una vez al arrancar
+if conectar_mysql is not None:
+    inventario = MySQLInventoryRepository(get_mysql, esquema_mysql)
+else:
+    inventario = SQLiteInventoryRepository(get_db, esquema_sqlite, transaccion)
+
+# Catálogo del proveedor en CSV, interpretado una vez y releído cuando cambia el archivo
+# (en memoria, o en un SQLite junto al CSV a partir de APP_CSV_SIDECAR_BYTES)
+catalogo_csv = CatalogoCSV(
+    [os.path.join(PARENT_DIR, "productos.csv"), os.path.join(PARENT_DIR, "productos")],
+    umbral_sidecar=int(os.getenv("APP_CSV_SIDECAR_BYTES", str(5 * 1024 * 1024))),
+)
+
+# Trabajos en segundo plano (importaciones grandes); estado y progreso en SQLite
+trabajos = GestorTrabajos(transaccion, max_hilos=int(os.getenv("APP_TRABAJOS_HILOS", "2")))
+
+# Versiones de los datos de lectura frecuente (ETag / 304)
+versiones_datos = VersionesDatos(ventana=float(os.getenv("APP_ETAG_VENTANA", "60")))
+inventario.suscribir(lambda evento, datos: versiones_datos.incrementar("productos"))
+
+# Índice en memoria de códigos escaneados; se mantiene con los avisos del repositorio
+indice_productos = IndiceProductos(inventario, ttl=float(os.getenv("APP_INDICE_TTL", "300")))
+# Índice de búsqueda por nombre (tokens y trigramas), mismo ciclo de vida
+buscador_nombres = IndiceNombres(inventario, ttl=float(os.getenv("APP_INDICE_TTL", "300")))
+if conectar_mysql is None or not SKIP_MYSQL_INIT:
+    for _indice, _nombre in ((indice_productos, "productos"), (buscador_nombres, "nombres")):
+        try:
+            _indice.cargar()
+        except Exception as e:
+            print(f"No se pudo cargar el índice de {_nombre}: {e}", flush=True)
 
 def _hash_password(password: str) -> str:
     try:
@@ -742,94 +1058,6 @@ def _verify_password(hashed: str, password: str) -> bool:
     except Exception:
         return str(hashed) == password
 
-def _asegurar_tabla_usuarios_mysql():
-    if conectar_mysql is None:
-        return
-    connm = None
-    try:
-        connm = conectar_mysql()
-        cur = connm.cursor()
-        cur.execute("CREATE TABLE IF NOT EXISTS usuarios (usuario VARCHAR(64) PRIMARY KEY, nombre VARCHAR(255) NOT NULL, contrasena VARCHAR(255) NOT NULL, rol VARCHAR(32) NOT NULL, activo TINYINT(1) NOT NULL DEFAULT 1)")
-        try:
-            cur.execute("SHOW COLUMNS FROM usuarios")
-            cols = [r[0].lower() for r in cur.fetchall() if r and len(r) > 0]
-        except Exception:
-            cols = []
-        # Renombrar columnas comunes si existen
-        try:
-            if 'password' in cols and 'contrasena' not in cols:
-                cur.execute("ALTER TABLE usuarios CHANGE COLUMN password contrasena VARCHAR(255) NOT NULL")
-        except Exception:
-            pass
-        try:
-            cur.execute("SHOW COLUMNS FROM usuarios")
-            cols = [r[0].lower() for r in cur.fetchall() if r and len(r) > 0]
-        except Exception:
-            cols = []
-        try:
-            if 'username' in cols and 'usuario' not in cols:
-                cur.execute("ALTER TABLE usuarios CHANGE COLUMN username usuario VARCHAR(64) NOT NULL")
-        except Exception:
-            pass
-        try:
-            cur.execute("SHOW COLUMNS FROM usuarios")
-            cols = [r[0].lower() for r in cur.fetchall() if r and len(r) > 0]
-        except Exception:
-            cols = []
-        try:
-            if 'user' in cols and 'usuario' not in cols:
-                cur.execute("ALTER TABLE usuarios CHANGE COLUMN user usuario VARCHAR(64) NOT NULL")
-        except Exception:
-            pass
-        try:
-            cur.execute("SHOW COLUMNS FROM usuarios")
-            cols = [r[0].lower() for r in cur.fetchall() if r and len(r) > 0]
-        except Exception:
-            cols = []
-        try:
-            if 'role' in cols and 'rol' not in cols:
-                cur.execute("ALTER TABLE usuarios CHANGE COLUMN role rol VARCHAR(32) NOT NULL")
-        except Exception:
-            pass
-        try:
-            cur.execute("SHOW COLUMNS FROM usuarios")
-            cols = [r[0].lower() for r in cur.fetchall() if r and len(r) > 0]
-        except Exception:
-            cols = []
-        try:
-            if 'name' in cols and 'nombre' not in cols:
-                cur.execute("ALTER TABLE usuarios CHANGE COLUMN name nombre VARCHAR(255) NOT NULL")
-        except Exception:
-            pass
-        try:
-            cur.execute("SHOW COLUMNS FROM usuarios")
-            cols = [r[0].lower() for r in cur.fetchall() if r and len(r) > 0]
-        except Exception:
-            cols = []
-        # Agregar columnas faltantes con valores por defecto seguros
-        try:
-            if 'contrasena' not in cols:
-                cur.execute("ALTER TABLE usuarios ADD COLUMN contrasena VARCHAR(255) NOT NULL DEFAULT ''")
-        except Exception:
-            pass
-        try:
-            if 'rol' not in cols:
-                cur.execute("ALTER TABLE usuarios ADD COLUMN rol VARCHAR(32) NOT NULL DEFAULT 'cajero'")
-        except Exception:
-            pass
-        try:
-            if 'activo' not in cols:
-                cur.execute("ALTER TABLE usuarios ADD COLUMN activo TINYINT(1) NOT NULL DEFAULT 1")
-        except Exception:
-            pass
-        connm.commit()
-    finally:
-        try:
-            if connm:
-                connm.close()
-        except Exception:
-            pass
-
 @app.get("/login")
 def login_view():
     msg = request.args.get("msg")
@@ -845,9 +1073,8 @@ def login_post():
     if conectar_mysql is None:
         return render_template("login.html", msg="MySQL no disponible", msg_type="danger")
     try:
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
-        _asegurar_tabla_usuarios_mysql()
         try:
             cur.execute("SELECT COUNT(*) FROM usuarios")
             cnt = int(cur.fetchone()[0] or 0)
@@ -1036,8 +1263,7 @@ def configuracion_cai():
         else:
             try:
                 print("DEBUG: Connecting to MySQL...")
-                _asegurar_tablas_cai_separadas_mysql()
-                connm = conectar_mysql()
+                connm = get_mysql()
                 cur = connm.cursor()
                 try:
                     tbl = _tabla_cai(tipo_cai)
@@ -1100,8 +1326,7 @@ def configuracion_cai():
     historial = []
     if conectar_mysql is not None:
         try:
-            _asegurar_tablas_cai_separadas_mysql()
-            connm = conectar_mysql()
+            connm = get_mysql()
             cur = connm.cursor()
             tbl_sel = _tabla_cai(tipo_seleccionado)
             cur.execute(f"SELECT cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo FROM {tbl_sel} WHERE activo=1 ORDER BY id DESC LIMIT 1")
@@ -1179,8 +1404,7 @@ def configuracion_cai_importar_pdf():
         parsed = _parse_autorizacion_pdf(ruta)
         if conectar_mysql is not None:
             try:
-                _asegurar_tablas_cai_separadas_mysql()
-                connm = conectar_mysql()
+                connm = get_mysql()
                 cur = connm.cursor()
                 tbl_sel = _tabla_cai(tipo_seleccionado)
                 cur.execute(f"SELECT cai, fecha_solicitud, rango_i, rango_f, f_limite, establecimiento, punto_emision, tipo_doc, numero_documento, activo FROM {tbl_sel} ORDER BY activo DESC, id DESC LIMIT 10")
@@ -1246,8 +1470,7 @@ def configuracion_cai_inactivar():
         msg = "MySQL no disponible"
     else:
         try:
-            _asegurar_tablas_cai_separadas_mysql()
-            connm = conectar_mysql()
+            connm = get_mysql()
             cur = connm.cursor()
             tbl = _tabla_cai(tipo_cai)
             cur.execute(
@@ -1278,8 +1501,7 @@ def configuracion_cai_eliminar():
         msg = "MySQL no disponible"
     else:
         try:
-            _asegurar_tablas_cai_separadas_mysql()
-            connm = conectar_mysql()
+            connm = get_mysql()
             cur = connm.cursor()
             tbl = _tabla_cai(tipo_cai)
             cur.execute(
@@ -1307,8 +1529,7 @@ def configuracion_cai_activar():
     tipo_cai = request.form.get("tipo") or "G"
     if conectar_mysql is not None:
         try:
-            _asegurar_tablas_cai_separadas_mysql()
-            connm = conectar_mysql()
+            connm = get_mysql()
             cur = connm.cursor()
             tbl = _tabla_cai(tipo_cai)
             cur.execute(f"UPDATE {tbl} SET activo=0")
@@ -1353,19 +1574,6 @@ def configuracion_compania():
             msg = "Datos de la empresa guardados"
         except Exception as e:
             msg = f"No se pudo guardar: {e}"
-    try:
-        execute("""
-            CREATE TABLE IF NOT EXISTS compania (
-              nombre_cia TEXT NOT NULL,
-              direccion1 TEXT,
-              direccion2 TEXT,
-              rtn_cia TEXT,
-              correo TEXT,
-              telefono TEXT
-            )
-        """)
-    except Exception:
-        pass
     actual = query_one("SELECT nombre_cia, direccion1, direccion2, rtn_cia, correo, telefono FROM compania LIMIT 1")
     return render_template("gestion_compania.html", actual=actual, msg=msg)
 
@@ -1377,7 +1585,7 @@ def api_mysql_health():
     if conectar_mysql is None:
         return jsonify({"ok": False, "available": False, "error": "driver"}), 503
     try:
-        conn = conectar_mysql()
+        conn = get_mysql()
         cur = conn.cursor()
         cur.execute("SELECT DATABASE()")
         dbname = cur.fetchone()[0]
@@ -1406,12 +1614,16 @@ def api_mysql_health():
         })
     except Exception as e:
         return jsonify({"ok": False, "available": True, "error": str(e)}), 500
+@app.get("/api/mysql/pool")
+def api_mysql_pool():
+    if _mysql_pool is None:
+        return jsonify({"available": False}), 503
+    return jsonify(_mysql_pool.estadisticas())
 @app.post("/api/mysql/ensure")
 def api_mysql_ensure():
     try:
-        if asegurar_tablas_mysql is not None:
-            asegurar_tablas_mysql()
-        return jsonify({"ok": True})
+        resultado = inicializar_esquema()
+        return jsonify({"ok": True, "migraciones": {m: [v for v, _ in a] for m, a in resultado.items()}})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 @app.post("/api/mysql/cleanup-duplicados-barra")
@@ -1419,74 +1631,24 @@ def api_mysql_cleanup_duplicados_barra():
     if conectar_mysql is None:
         return jsonify({"ok": False, "error": "MySQL no disponible"}), 503
     try:
-        conn = conectar_mysql()
+        conn = get_mysql()
         cur = conn.cursor()
         cur.execute("DELETE t1 FROM inventario t1 JOIN inventario t2 ON t1.barra = t2.barra AND t1.id > t2.id")
         eliminados = cur.rowcount
         conn.commit()
         conn.close()
+        if eliminados:
+            inventario.avisar_cambios()
         return jsonify({"ok": True, "eliminados": int(eliminados)})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
-def _asegurar_tablas_pedidos_mysql():
-    if conectar_mysql is None:
-        return
-    connm = None
-    try:
-        connm = conectar_mysql()
-        cur = connm.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS pedidos (
-                id_pedido INT AUTO_INCREMENT PRIMARY KEY,
-                numero_pedido VARCHAR(64),
-                fecha DATETIME,
-                cliente VARCHAR(255),
-                rtn_cliente VARCHAR(64),
-                total DECIMAL(10,2),
-                estado VARCHAR(32) DEFAULT 'pendiente',
-                usuario VARCHAR(255)
-            ) ENGINE=InnoDB
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS pedidos_detalle (
-                id_detalle INT AUTO_INCREMENT PRIMARY KEY,
-                id_pedido INT,
-                numero_pedido VARCHAR(64),
-                id VARCHAR(50),
-                nombre_articulo VARCHAR(255),
-                valor_articulo DECIMAL(10,2),
-                cantidad DECIMAL(10,2),
-                subtotal DECIMAL(10,2),
-                gravado15 DECIMAL(10,2),
-                gravado18 DECIMAL(10,2),
-                totalexento DECIMAL(10,2),
-                isv15 DECIMAL(10,2),
-                isv18 DECIMAL(10,2),
-                grantotal DECIMAL(10,2),
-                INDEX idx_numero_pedido (numero_pedido),
-                INDEX idx_id_pedido (id_pedido)
-            ) ENGINE=InnoDB
-        """)
-        connm.commit()
-    except Exception:
-        try:
-            connm.rollback()
-        except Exception:
-            pass
-    finally:
-        try:
-            connm.close()
-        except Exception:
-            pass
-
 @app.get("/api/pedidos/next")
 def api_pedidos_next():
     if conectar_mysql is None:
         return jsonify({"error":"MySQL no disponible"}), 503
     try:
-        _asegurar_tablas_pedidos_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("SELECT COALESCE(MAX(id_pedido),0)+1 FROM pedidos")
         nxt = int(cur.fetchone()[0] or 1)
@@ -1509,8 +1671,7 @@ def api_registrar_pedido():
     if conectar_mysql is None:
         return jsonify({"error":"MySQL no disponible"}), 503
     try:
-        _asegurar_tablas_pedidos_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         totales = calcular_totales_detalle(items)
         cliente_nombre = (data.get("cliente_nombre") or "CONSUMIDOR FINAL")
@@ -1562,7 +1723,6 @@ def api_pedidos_list():
     if conectar_mysql is None:
         return jsonify({"error":"MySQL no disponible"}), 503
     try:
-        _asegurar_tablas_pedidos_mysql()
         q = (request.args.get("q") or "").strip()
         estado = (request.args.get("estado") or "").strip()
         limit = 100
@@ -1572,7 +1732,7 @@ def api_pedidos_list():
                 limit = l
         except Exception:
             pass
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         base = "SELECT id_pedido, numero_pedido, fecha, cliente, rtn_cliente, total, estado FROM pedidos WHERE 1=1"
         params = []
@@ -1610,8 +1770,7 @@ def api_pedido_get(numero):
     if conectar_mysql is None:
         return jsonify({"error":"MySQL no disponible"}), 503
     try:
-        _asegurar_tablas_pedidos_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("SELECT id_pedido, numero_pedido, fecha, cliente, rtn_cliente, total, estado FROM pedidos WHERE numero_pedido=%s", (numero,))
         h = cur.fetchone()
@@ -1675,8 +1834,7 @@ def api_pedido_delete(numero):
     if conectar_mysql is None:
         return jsonify({"error":"MySQL no disponible"}), 503
     try:
-        _asegurar_tablas_pedidos_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("SELECT id_pedido FROM pedidos WHERE numero_pedido=%s", (numero,))
         r = cur.fetchone()
@@ -1709,8 +1867,7 @@ def api_pedido_cambiar_estado(numero):
     if conectar_mysql is None:
         return jsonify({"error":"MySQL no disponible"}), 503
     try:
-        _asegurar_tablas_pedidos_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("SELECT id_pedido, estado FROM pedidos WHERE numero_pedido=%s", (numero,))
         r = cur.fetchone()
@@ -1747,8 +1904,7 @@ def api_pedido_actualizar(numero):
     if conectar_mysql is None:
         return jsonify({"error":"MySQL no disponible"}), 503
     try:
-        _asegurar_tablas_pedidos_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("SELECT id_pedido FROM pedidos WHERE numero_pedido=%s", (numero,))
         r = cur.fetchone()
@@ -1813,53 +1969,18 @@ def editar_producto_view():
     producto = None
     pid = request.args.get("id")
     codigo = request.args.get("codigo")
-    # Preferir MySQL
-    if conectar_mysql is not None:
-        try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            if pid:
-                cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE id = %s", (pid,))
-            else:
-                cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE barra = %s", (codigo,))
-            r = cur.fetchone()
-            connm.close()
-            if r:
-                producto = {
-                    "id": int(r[0]) if r[0] is not None else None,
-                    "codigo": str(r[1] or ""),
-                    "nombre": r[2] or "",
-                    "precio": float(r[3]) if r[3] is not None else None,
-                    "id_isv": int(r[4]) if r[4] is not None else 1,
-                    "stock": int(r[5]) if r[5] is not None else 0,
-                    "pesable": int(r[6]) if len(r) > 6 and r[6] is not None else 0,
-                    "id_categoria": int(r[7]) if len(r) > 7 and r[7] is not None else None
-                }
-        except Exception:
-            producto = None
-    # Fallback SQLite
-    if producto is None and (pid or codigo):
-        row = None
+    try:
         if pid:
-            row = query_one("SELECT id, barra, nombre, precio, id_isv, stock, id_categoria FROM inventario WHERE id = ?", (pid,))
-        else:
-            row = query_one("SELECT id, barra, nombre, precio, id_isv, stock, id_categoria FROM inventario WHERE barra = ?", (codigo,))
-        if row:
-            producto = {
-                "id": row.get("id"),
-                "codigo": row.get("barra") or "",
-                "nombre": row.get("nombre") or "",
-                "precio": row.get("precio"),
-                "id_isv": row.get("id_isv") or 1,
-                "stock": row.get("stock") or 0,
-                "pesable": 0,
-                "id_categoria": row.get("id_categoria")
-            }
+            producto = inventario.get_by_id(int(pid))
+        elif codigo:
+            producto = inventario.get_by_code(codigo, solo_activos=False)
+    except Exception:
+        producto = None
+    if producto:
+        producto["nombre"] = producto["nombre"] or ""
+        producto["id_isv"] = producto["id_isv"] or 1
+        producto["stock"] = producto["stock"] or 0
+        producto["pesable"] = producto["pesable"] or 0
     return render_template("agregar_producto.html", modo="editar", producto=producto)
 
 @app.route("/agregar-producto-scanner")
@@ -1876,10 +1997,6 @@ def productos_view():
 
 @app.route("/clientes")
 def clientes_view():
-    try:
-        execute("CREATE TABLE IF NOT EXISTS clientes (id_cliente INTEGER PRIMARY KEY AUTOINCREMENT, rtn TEXT, nombre TEXT NOT NULL)")
-    except Exception:
-        pass
     return render_template("clientes.html")
 
 @app.route("/ventas")
@@ -2072,6 +2189,7 @@ def servir_icono(filename):
 # --------- API ---------
 
 @app.get("/api/clientes")
+@versiones_datos.con_etag("clientes")
 def api_clientes():
     data = query_all("SELECT id_cliente, rtn, nombre FROM clientes ORDER BY nombre")
     return jsonify(data)
@@ -2083,69 +2201,23 @@ def api_clientes_crear():
     rtn = (data.get("rtn") or "").strip()
     if not nombre:
         return jsonify({"error":"Nombre requerido"}), 400
-    try:
-        execute("CREATE TABLE IF NOT EXISTS clientes (id_cliente INTEGER PRIMARY KEY AUTOINCREMENT, rtn TEXT, nombre TEXT NOT NULL)")
-    except Exception:
-        pass
     try:
         new_id = execute("INSERT INTO clientes (rtn, nombre) VALUES (?, ?)", (rtn if rtn else None, nombre))
+        versiones_datos.incrementar("clientes")
         return jsonify({"ok": True, "id_cliente": int(new_id)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.post("/api/productos/<int:pid>/activar")
 def api_activar_producto(pid):
-    if conectar_mysql is not None:
-        try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            codigo = request.args.get("codigo") or request.args.get("barra")
-            cur.execute("UPDATE inventario SET activo = 1 WHERE id = %s", (pid,))
-            afectados = cur.rowcount
-            if afectados == 0 and codigo:
-                try:
-                    cur.execute("UPDATE inventario SET activo = 1 WHERE barra = %s", (codigo,))
-                    afectados = cur.rowcount
-                except Exception:
-                    pass
-            connm.commit()
-            connm.close()
-            if afectados > 0:
-                return jsonify({"ok": True})
-            else:
-                return jsonify({"error": "Producto no encontrado"}), 404
-        except Exception as e:
-            return jsonify({"error": f"Error activando en MySQL: {str(e)}"}), 500
+    codigo = request.args.get("codigo") or request.args.get("barra")
     try:
-        codigo = request.args.get("codigo") or request.args.get("barra")
-        with get_db() as conn:
-            cur = conn.cursor()
-            try:
-                cur.execute("PRAGMA table_info(inventario)")
-                cols = [r[1].lower() for r in cur.fetchall()]
-                if 'activo' not in cols:
-                    cur.execute("ALTER TABLE inventario ADD COLUMN activo INTEGER NOT NULL DEFAULT 1")
-            except Exception:
-                pass
-            cur.execute("UPDATE inventario SET activo = 1 WHERE id = ?", (pid,))
-            afectados = cur.rowcount
-            if afectados == 0 and codigo:
-                try:
-                    cur.execute("UPDATE inventario SET activo = 1 WHERE barra = ?", (codigo,))
-                    afectados = cur.rowcount
-                except Exception:
-                    pass
-            conn.commit()
-            if afectados > 0:
-                return jsonify({"ok": True})
-            return jsonify({"error": "Producto no encontrado"}), 404
+        afectados = inventario.set_activo(pid, True, codigo=codigo)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": f"Error activando producto: {str(e)}"}), 500
+    if afectados > 0:
+        return jsonify({"ok": True})
+    return jsonify({"error": "Producto no encontrado"}), 404
 
 @app.put("/api/clientes/<int:cid>")
 def api_clientes_actualizar(cid):
@@ -2156,6 +2228,7 @@ def api_clientes_actualizar(cid):
         return jsonify({"error":"Nombre requerido"}), 400
     try:
         execute("UPDATE clientes SET nombre = ?, rtn = ? WHERE id_cliente = ?", (nombre, rtn if rtn else None, cid))
+        versiones_datos.incrementar("clientes")
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -2164,25 +2237,26 @@ def api_clientes_actualizar(cid):
 def api_clientes_eliminar(cid):
     try:
         execute("DELETE FROM clientes WHERE id_cliente = ?", (cid,))
+        versiones_datos.incrementar("clientes")
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _categorias_por_codigo(connm) -> bool:
+    """True si la tabla categorias de MySQL usa cod_categoria en lugar de id"""
+    cols = esquema_mysql.columnas(connm, "categorias")
+    return "cod_categoria" in cols and "id" not in cols
+
 @app.get("/api/categorias")
+@versiones_datos.con_etag("categorias")
 def api_categorias():
     if conectar_mysql is not None:
         try:
-            connm = conectar_mysql()
+            connm = get_mysql()
             cur = connm.cursor()
-            rows = None
-            try:
-                cur.execute("SELECT cod_categoria, nombre FROM categorias ORDER BY nombre")
-                rows = cur.fetchall()
-                data = [{"id": int(r[0]), "nombre": r[1]} for r in rows]
-            except Exception:
-                cur.execute("SELECT id, nombre FROM categorias ORDER BY nombre")
-                rows = cur.fetchall()
-                data = [{"id": int(r[0]), "nombre": r[1]} for r in rows]
+            col_id = "cod_categoria" if _categorias_por_codigo(connm) else "id"
+            cur.execute(f"SELECT {col_id}, nombre FROM categorias ORDER BY nombre")
+            data = [{"id": int(r[0]), "nombre": r[1]} for r in cur.fetchall()]
             connm.close()
             return jsonify(data)
         except Exception:
@@ -2197,14 +2271,10 @@ def api_categorias_create():
         return jsonify({"error": "Nombre requerido"}), 400
     if conectar_mysql is not None:
         try:
-            connm = conectar_mysql()
+            connm = get_mysql()
             cur = connm.cursor()
-            try:
-                cur.execute("SHOW COLUMNS FROM categorias")
-                cols = [r[0].lower() for r in cur.fetchall()]
-            except Exception:
-                cols = []
-            if "cod_categoria" in cols and "id" not in cols:
+            por_codigo = _categorias_por_codigo(connm)
+            if por_codigo:
                 try:
                     cur.execute("SELECT MAX(cod_categoria) FROM categorias")
                     mx = cur.fetchone()[0]
@@ -2215,8 +2285,9 @@ def api_categorias_create():
             else:
                 cur.execute("INSERT INTO categorias (nombre) VALUES (%s)", (nombre,))
             connm.commit()
+            versiones_datos.incrementar("categorias")
             try:
-                if "cod_categoria" in cols and "id" not in cols:
+                if por_codigo:
                     cur.execute("SELECT cod_categoria FROM categorias WHERE nombre=%s", (nombre,))
                     new_id = int(cur.fetchone()[0])
                 else:
@@ -2230,6 +2301,7 @@ def api_categorias_create():
             return jsonify({"error": str(e)}), 500
     try:
         new_id = execute("INSERT INTO categorias (nombre) VALUES (?)", (nombre,))
+        versiones_datos.incrementar("categorias")
         return jsonify({"ok": True, "id": new_id, "nombre": nombre})
     except sqlite3.IntegrityError:
         return jsonify({"error": "La categoría ya existe"}), 409
@@ -2244,29 +2316,63 @@ def api_categorias_update(cid):
         return jsonify({"error": "Nombre requerido"}), 400
     if conectar_mysql is not None:
         try:
-            connm = conectar_mysql()
+            connm = get_mysql()
             cur = connm.cursor()
-            try:
-                cur.execute("SHOW COLUMNS FROM categorias")
-                cols = [r[0].lower() for r in cur.fetchall()]
-            except Exception:
-                cols = []
-            if "cod_categoria" in cols and "id" not in cols:
+            if _categorias_por_codigo(connm):
                 cur.execute("UPDATE categorias SET nombre=%s WHERE cod_categoria=%s", (nombre, cid))
             else:
                 cur.execute("UPDATE categorias SET nombre=%s WHERE id=%s", (nombre, cid))
             connm.commit()
+            versiones_datos.incrementar("categorias")
             connm.close()
             return jsonify({"ok": True, "id": cid, "nombre": nombre})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
     try:
         execute("UPDATE categorias SET nombre=? WHERE id=?", (nombre, cid))
+        versiones_datos.incrementar("categorias")
         return jsonify({"ok": True, "id": cid, "nombre": nombre})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _codificar_cursor(posicion: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(posicion, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decodificar_cursor(cursor: str) -> dict:
+    """Cursor opaco de /api/productos: {"id": último id} o {"pos": posición en el ranking}"""
+    datos = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8"))
+    if not isinstance(datos, dict) or not all(isinstance(datos.get(k, 0), int) for k in ("id", "pos")):
+        raise ValueError("cursor inválido")
+    return datos
+
+def _buscar_productos(q, estado, cat_id, limit, offset, cursor=None, total="exacto"):
+    """
+    Devuelve (filas, total, siguiente cursor). Con texto usa el índice de
+    nombres (ordenado por relevancia) y lee solo la página pedida por id; sin
+    texto, o con el índice sin cargar, va al repositorio paginando por id
+    """
+    cursor = cursor or {}
+    ids = buscador_nombres.buscar(q, estado, cat_id) if q and "id" not in cursor else None
+    if ids is None or (not ids and offset == 0 and estado != "activos"):
+        if "pos" in cursor:
+            offset = cursor["pos"]
+        data, total_count = inventario.search(q, estado, cat_id, limit, offset, despues_de=cursor.get("id"), total=total)
+        siguiente = {"id": data[-1]["id"]} if len(data) == limit else None
+        return data, total_count, siguiente
+    if not ids:
+        # Nada por nombre: puede ser una barra alterna o un id (000123)
+        producto = indice_productos.obtener(q) if offset == 0 and not cursor else None
+        if producto and (cat_id is None or producto.get("id_categoria") == cat_id):
+            return [producto], 1, None
+        return [], 0, None
+    inicio = cursor.get("pos", offset)
+    pagina = ids[inicio:inicio + limit]
+    filas = {p["id"]: p for p, _ in inventario.todos(pagina)} if pagina else {}
+    siguiente = {"pos": inicio + limit} if inicio + limit < len(ids) else None
+    return [filas[pid] for pid in pagina if pid in filas], len(ids), siguiente
+
 @app.get("/api/productos")
+@versiones_datos.con_etag("productos")
 def api_productos():
     limit = 200
     offset = 0
@@ -2287,170 +2393,285 @@ def api_productos():
             offset = o
     except Exception:
         pass
-    where_sql = " WHERE 1=1 "
-    if estado == "activos":
-        where_sql += " AND (activo IS NULL OR activo = 1) "
-    elif estado == "inactivos":
-        where_sql += " AND activo = 0 "
-    params = []
-    if q:
-        where_sql += " AND (nombre LIKE %s OR barra = %s) "
-        params.extend([f"%{q}%", q])
-    if cat_id is not None:
-        where_sql += " AND id_categoria = %s "
-        params.append(cat_id)
-    if conectar_mysql is None:
-        return jsonify({"error": "MySQL no disponible"}), 503
-    # Preferir MySQL
-    if conectar_mysql is not None:
+    # Paginación por clave: ?cursor= con el valor de X-Next-Cursor de la página anterior
+    cursor = None
+    if request.args.get("cursor"):
         try:
-            connm = conectar_mysql()
-            cur = connm.cursor()
-
-            # Count total
-            count_sql = f"SELECT COUNT(*) FROM inventario{where_sql}"
-            cur.execute(count_sql, tuple(params))
-            total_count = cur.fetchone()[0]
-
-            sql = f"SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario{where_sql} LIMIT %s OFFSET %s"
-            cur.execute(sql, (*params, limit, offset) if params else (limit, offset))
-            rows = cur.fetchall()
-
-            if q and (not rows or len(rows) == 0):
-                try:
-                    cur.execute("SELECT producto_id FROM inventario_barras WHERE barra = %s", (q,))
-                    pidrow = cur.fetchone()
-                    if pidrow:
-                        if estado == "activos":
-                            if cat_id is not None:
-                                cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE (activo IS NULL OR activo = 1) AND id = %s AND id_categoria = %s LIMIT %s OFFSET %s", (int(pidrow[0]), cat_id, limit, offset))
-                            else:
-                                cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE (activo IS NULL OR activo = 1) AND id = %s LIMIT %s OFFSET %s", (int(pidrow[0]), limit, offset))
-                        elif estado == "inactivos":
-                            if cat_id is not None:
-                                cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE activo = 0 AND id = %s AND id_categoria = %s LIMIT %s OFFSET %s", (int(pidrow[0]), cat_id, limit, offset))
-                            else:
-                                cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE activo = 0 AND id = %s LIMIT %s OFFSET %s", (int(pidrow[0]), limit, offset))
-                        else:
-                            if cat_id is not None:
-                                cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE id = %s AND id_categoria = %s LIMIT %s OFFSET %s", (int(pidrow[0]), cat_id, limit, offset))
-                            else:
-                                cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE id = %s LIMIT %s OFFSET %s", (int(pidrow[0]), limit, offset))
-                        rows = cur.fetchall()
-                        if rows:
-                            total_count = 1
-                except Exception:
-                    pass
-            connm.close()
-            data = []
-            for r in rows:
-                data.append({
-                    "id": int(r[0]) if r[0] is not None else None,
-                    "codigo": str(r[1] or ""),
-                    "nombre": r[2],
-                    "precio": float(r[3]) if r[3] is not None else None,
-                    "id_isv": int(r[4]) if r[4] is not None else None,
-                    "stock": int(r[5]) if r[5] is not None else None,
-                    "pesable": int(r[6]) if len(r) > 6 and r[6] is not None else None,
-                    "id_categoria": int(r[7]) if len(r) > 7 and r[7] is not None else None
-                })
-            res = jsonify(data)
-            res.headers["X-Total-Count"] = str(total_count)
-            return res
+            cursor = _decodificar_cursor(request.args["cursor"])
+        except Exception:
+            return jsonify({"error": "Cursor inválido"}), 400
+    # total=exacto (por defecto, cacheado hasta la próxima escritura), estimado o no
+    total = (request.args.get("total") or "exacto").strip().lower()
+    if total not in ("exacto", "estimado", "no"):
+        total = "exacto"
+    try:
+        data, total_count, siguiente = _buscar_productos(q, estado, cat_id, limit, offset, cursor, total)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    res = jsonify(data)
+    if total_count is not None:
+        res.headers["X-Total-Count"] = str(total_count)
+    if siguiente:
+        res.headers["X-Next-Cursor"] = _codificar_cursor(siguiente)
+    return res
+
+AUTOCOMPLETAR_CAMPOS = ("id", "codigo", "nombre", "precio", "stock")
+
+@app.get("/api/productos/autocomplete")
+def api_productos_autocomplete():
+    """Sugerencias del buscador del POS: solo los campos que usa la lista desplegable"""
+    q = (request.args.get("q") or "").strip()
+    try:
+        limite = min(max(int(request.args.get("limit", 10)), 1), 50)
+    except Exception:
+        limite = 10
+    if not q:
+        return jsonify([])
+    ids = buscador_nombres.autocompletar(q, limite)
+    if ids is not None:
+        productos = [indice_productos.ficha(pid) for pid in ids]
+    else:
+        # Índices aún sin cargar
+        try:
+            productos, _, _ = _buscar_productos(q, "activos", None, limite, 0, total="no")
         except Exception as e:
             return jsonify({"error": str(e)}), 500
-    return jsonify([])
+    return jsonify([{c: p[c] for c in AUTOCOMPLETAR_CAMPOS} for p in productos if p])
 
 @app.get("/api/producto/<codigo>")
 def api_producto(codigo):
-    # Busca por barra (código) preferentemente; 6 dígitos se consideran código único
-    if conectar_mysql is not None:
+    # Busca por barra principal, luego barra alterna y, si el código tiene 6 dígitos, por id (000123 -> 123)
+    producto = indice_productos.obtener(codigo)
+    if producto is None:
         try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            codigo_str = str(codigo).strip()
-            # 1) Buscar por barra exacta
-            cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE (activo IS NULL OR activo = 1) AND barra = %s", (codigo_str,))
-            r = cur.fetchone()
-            if not r:
-                try:
-                    cur.execute("SELECT producto_id FROM inventario_barras WHERE barra = %s", (codigo_str,))
-                    rr = cur.fetchone()
-                    if rr:
-                        cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE (activo IS NULL OR activo = 1) AND id = %s", (int(rr[0]),))
-                        r = cur.fetchone()
-                except Exception:
-                    pass
-            # 2) Buscar por id si el código es de 6 dígitos (000123 -> id=123)
-            if not r and codigo_str.isdigit() and len(codigo_str) == 6:
-                try:
-                    cur.execute("SELECT id, barra, nombre, precio, id_isv, stock, pesable, id_categoria FROM inventario WHERE (activo IS NULL OR activo = 1) AND id = %s", (int(codigo_str),))
-                    r = cur.fetchone()
-                except Exception:
-                    r = None
-            connm.close()
-            if r:
-                return jsonify({
-                    "id": int(r[0]) if r[0] is not None else None,
-                    "codigo": str(r[1] or ""),
-                    "nombre": r[2],
-                    "precio": float(r[3]) if r[3] is not None else None,
-                    "id_isv": int(r[4]) if r[4] is not None else None,
-                    "stock": int(r[5]) if r[5] is not None else None,
-                    "pesable": int(r[6]) if len(r) > 6 and r[6] is not None else None,
-                    "id_categoria": int(r[7]) if len(r) > 7 and r[7] is not None else None
-                })
+            producto = inventario.get_by_code(codigo)
         except Exception:
-            pass
-    # Fallback SQLite
-    codigo_str = str(codigo).strip()
-    # 1) Buscar por barra exacta con detección de columnas opcionales
+            producto = None
+    if producto:
+        return jsonify(producto)
+    return jsonify({"error":"Producto no encontrado"}), 404
+
+# --------- Catálogo para terminales (copia local + deltas) ---------
+CATALOGO_COLUMNAS = ("id", "barra", "alternas", "nombre", "precio", "id_isv", "stock", "pesable", "id_categoria")
+CATALOGO_COMPACTAR_CADA = 3600.0
+_catalogo_compactado = [0.0]
+
+def _filas_catalogo(productos, alternas):
+    """Filas compactas (listas en el orden de CATALOGO_COLUMNAS) de los productos activos"""
+    alternas_de = {}
+    for pid, barra in alternas:
+        alternas_de.setdefault(pid, []).append(barra)
+    filas = []
+    for p in productos:
+        otras = [b for b in alternas_de.get(p["id"], []) if b != p["codigo"]]
+        filas.append([p["id"], p["codigo"], otras, p["nombre"], p["precio"], p["id_isv"],
+                      p["stock"], p["pesable"], p["id_categoria"]])
+    return filas
+
+def _json_compacto(datos):
+    """JSON sin espacios; la compresión la pone el after_request"""
+    cuerpo = json.dumps(datos, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return app.response_class(cuerpo, mimetype="application/json")
+
+@app.get("/api/catalogo/snapshot")
+def api_catalogo_snapshot():
+    """
+    Todo el inventario activo para la copia local de un terminal:
+    {"version", "columnas", "filas"}. Luego basta con /api/catalogo/delta?since=version
+    """
     try:
-        with get_db() as conn:
-            cur = conn.execute("PRAGMA table_info(inventario)")
-            cols = [r[1].lower() for r in cur.fetchall()]
-            has_activo = ("activo" in cols)
-            has_id_categoria = ("id_categoria" in cols)
-            select_cols = "id AS id, barra AS codigo, nombre, precio, id_isv" + (", id_categoria" if has_id_categoria else "")
-            where_activo = " AND (activo IS NULL OR activo = 1)" if has_activo else ""
-            # barra
-            sql = f"SELECT {select_cols} FROM inventario WHERE 1=1{where_activo} AND barra=?"
-            cur = conn.execute(sql, (codigo_str,))
-            r = cur.fetchone()
-            row = dict(r) if r else None
-            # fallback inventario_barras
-            if not row:
-                try:
-                    cur = conn.execute("SELECT producto_id FROM inventario_barras WHERE barra = ?", (codigo_str,))
-                    rr = cur.fetchone()
-                    if rr:
-                        pid = int(rr[0])
-                        sql2 = f"SELECT {select_cols} FROM inventario WHERE 1=1{where_activo} AND id=?"
-                        cur = conn.execute(sql2, (pid,))
-                        r2 = cur.fetchone()
-                        row = dict(r2) if r2 else None
-                except Exception:
-                    row = None
-            # Buscar por id si el código es de 6 dígitos (000123 -> id=123)
-            if not row and codigo_str.isdigit() and len(codigo_str) == 6:
-                try:
-                    pid6 = int(codigo_str)
-                    sql3 = f"SELECT {select_cols} FROM inventario WHERE 1=1{where_activo} AND id=?"
-                    cur = conn.execute(sql3, (pid6,))
-                    r3 = cur.fetchone()
-                    row = dict(r3) if r3 else None
-                except Exception:
-                    row = None
+        # La versión se lee antes que las filas: lo que cambie entre medias llega en el próximo delta
+        version = inventario.version_catalogo()
+        productos = [p for p, activo in inventario.todos() if activo]
+        filas = _filas_catalogo(productos, inventario.alternas())
+        if time.monotonic() - _catalogo_compactado[0] > CATALOGO_COMPACTAR_CADA:
+            _catalogo_compactado[0] = time.monotonic()
+            inventario.compactar_cambios()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return _json_compacto({"version": version, "columnas": CATALOGO_COLUMNAS, "filas": filas})
+
+@app.get("/api/catalogo/delta")
+def api_catalogo_delta():
+    """
+    Cambios posteriores a `since`: {"version", "columnas", "filas", "eliminados"}.
+    Responde 410 si el terminal debe volver a pedir el snapshot
+    """
+    try:
+        since = int(request.args.get("since", ""))
     except Exception:
-        row = None
-    if row:
-        return jsonify(row)
-    return jsonify({"error":"Producto no encontrado"}), 404
+        return jsonify({"error": "Parámetro 'since' requerido"}), 400
+    try:
+        version, ids = inventario.cambios_desde(since)
+        if ids is None or since > version:
+            # Cambio masivo o base restaurada: la copia local ya no sirve
+            return jsonify({"error": "Resincronizar", "version": version}), 410
+        filas, eliminados = [], []
+        if ids:
+            estado = {p["id"]: (p, activo) for p, activo in inventario.todos(ids)}
+            activos = [estado[pid][0] for pid in ids if pid in estado and estado[pid][1]]
+            eliminados = [pid for pid in ids if pid not in estado or not estado[pid][1]]
+            filas = _filas_catalogo(activos, inventario.alternas([p["id"] for p in activos]))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return _json_compacto({"version": version, "columnas": CATALOGO_COLUMNAS, "filas": filas, "eliminados": eliminados})
+
+LOOKUP_MAX_CODIGOS = 1000
+
+@app.post("/api/productos/lookup")
+def api_productos_lookup():
+    """
+    Resuelve varios códigos de una vez (carritos y pedidos).
+    Recibe {"codigos": [...]} y devuelve {"encontrados": {codigo: producto}, "faltantes": [...]}
+    """
+    data = request.get_json(force=True) or {}
+    codigos = data.get("codigos") or []
+    if not isinstance(codigos, list):
+        return jsonify({"error": "codigos debe ser una lista"}), 400
+    codigos = list(dict.fromkeys(str(c).strip() for c in codigos if c is not None and str(c).strip()))
+    if len(codigos) > LOOKUP_MAX_CODIGOS:
+        return jsonify({"error": f"Máximo {LOOKUP_MAX_CODIGOS} códigos por consulta"}), 400
+    encontrados = {}
+    pendientes = []
+    for codigo in codigos:
+        producto = indice_productos.obtener(codigo)
+        if producto is not None:
+            encontrados[codigo] = producto
+        else:
+            pendientes.append(codigo)
+    if pendientes:
+        try:
+            encontrados.update(inventario.bulk_get(pendientes, solo_activos=True))
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    faltantes = [c for c in codigos if c not in encontrados]
+    return jsonify({"encontrados": encontrados, "faltantes": faltantes})
+
+# Importación de productos desde CSV/XLS/XLSX (importar_productos.html)
+IMPORTACION_MAX_BYTES = 10 * 1024 * 1024
+
+
+def _archivo_importacion():
+    """Archivo subido en el campo 'archivo' o (None, respuesta de error)"""
+    if request.content_length and request.content_length > IMPORTACION_MAX_BYTES + 64 * 1024:
+        return None, (jsonify({"error": "El archivo es muy grande. Máximo 10MB."}), 413)
+    archivo = request.files.get("archivo")
+    if archivo is None or not archivo.filename:
+        return None, (jsonify({"error": "Seleccione un archivo"}), 400)
+    return archivo, None
+
+
+@app.post("/api/productos/validar-importacion")
+def api_validar_importacion():
+    archivo, error = _archivo_importacion()
+    if error:
+        return error
+    try:
+        return jsonify(importacion.validar(archivo.stream, archivo.filename,
+                                           inventario=InventarioExistente.desde_repositorio(inventario)))
+    except importacion.ArchivoInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"No se pudo validar el archivo: {e}"}), 500
+
+@app.post("/api/productos/importar/simular")
+def api_simular_importacion():
+    """
+    Simulación de la importación sin escribir nada: cuántos productos se
+    crearían y cuántos se actualizarían, y los conflictos de códigos y
+    nombres contra el inventario y dentro del archivo
+    """
+    archivo, error = _archivo_importacion()
+    if error:
+        return error
+    try:
+        existentes = InventarioExistente.desde_repositorio(inventario)
+        informe = importacion.validar(archivo.stream, archivo.filename, filas_preview=0, inventario=existentes)
+    except importacion.ArchivoInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"No se pudo simular la importación: {e}"}), 500
+    informe.pop("preview", None)
+    return jsonify(informe)
+
+def _trabajo_importacion(trabajo, ruta: str, nombre: str):
+    def progreso(leidas, estimadas, resultados):
+        trabajo.avanzar(leidas, total=max(estimadas, leidas), errores=resultados["errores"], resultado=resultados)
+
+    try:
+        with open(ruta, "rb") as f:
+            return importacion.importar(f, nombre, inventario, progreso=progreso,
+                                        tamano_lote=int(os.getenv("APP_IMPORTACION_LOTE", "500")))
+    finally:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+@app.post("/api/productos/importar")
+def api_importar_productos():
+    """Encola la importación y responde de inmediato; el progreso se consulta en /api/jobs/<id>"""
+    archivo, error = _archivo_importacion()
+    if error:
+        return error
+    try:
+        importacion.formato_archivo(archivo.filename)
+    except importacion.ArchivoInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    # El archivo subido solo vive durante la petición: el trabajo lee una copia
+    ruta = os.path.join(UPLOAD_FOLDER, f"importacion_{uuid.uuid4().hex}_{secure_filename(archivo.filename)}")
+    try:
+        archivo.save(ruta)
+        job_id = trabajos.enviar("importacion", _trabajo_importacion, ruta, archivo.filename)
+    except Exception as e:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        return jsonify({"error": f"No se pudo iniciar la importación: {e}"}), 500
+    return jsonify({"ok": True, "job_id": job_id, "estado_url": f"/api/jobs/{job_id}"}), 202
+
+@app.get("/api/jobs/<job_id>")
+def api_job_estado(job_id):
+    datos = trabajos.estado(job_id)
+    if datos is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(datos)
+
+@app.post("/api/jobs/<job_id>/cancel")
+def api_job_cancelar(job_id):
+    estado = trabajos.cancelar(job_id)
+    if estado is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if estado not in ("pendiente", "en_curso"):
+        return jsonify({"error": f"El trabajo ya terminó ({estado})", "estado": estado}), 409
+    return jsonify({"ok": True, "estado": estado})
+
+@app.get("/api/productos/plantilla")
+def api_plantilla_importacion():
+    try:
+        contenido = importacion.plantilla_xlsx()
+    except importacion.ArchivoInvalido as e:
+        return jsonify({"error": str(e)}), 503
+    return send_file(io.BytesIO(contenido), as_attachment=True, download_name="plantilla_productos.xlsx",
+                     mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+@app.get("/api/productos/export")
+def api_exportar_productos():
+    """
+    Inventario completo (categoría y todas las barras) como descarga en
+    streaming: ?formato=csv|xlsx y ?estado=todos|activos|inactivos
+    """
+    formato = (request.args.get("formato") or "csv").lower()
+    if formato not in exportacion.FORMATOS:
+        return jsonify({"error": "Formato no válido. Use csv o xlsx."}), 400
+    if formato == "xlsx" and exportacion.openpyxl is None:
+        return jsonify({"error": "Exportación a XLSX no disponible"}), 503
+    estado = request.args.get("estado", "todos")
+    productos = inventario.recorrer(estado=estado if estado in ("activos", "inactivos") else "todos")
+    nombre = f"productos_{datetime.now().strftime('%Y%m%d_%H%M')}.{formato}"
+    res = Response(stream_with_context(exportacion.ESCRITORES[formato](productos)), mimetype=exportacion.FORMATOS[formato])
+    res.headers["Content-Disposition"] = f'attachment; filename="{nombre}"'
+    res.headers["Cache-Control"] = "no-store"
+    return res
 
 @app.post("/api/productos")
 def api_crear_producto():
@@ -2478,117 +2699,16 @@ def api_crear_producto():
     if not nombre or precio <= 0:
         return jsonify({"error":"Nombre y precio son obligatorios"}), 400
 
-    # Preferir MySQL
-    if conectar_mysql is not None:
-        try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            # Validar código de barras único en MySQL
-            if barra:
-                try:
-                    cur.execute("SELECT id FROM inventario WHERE barra = %s", (barra,))
-                    dup = cur.fetchone()
-                    if dup:
-                        connm.close()
-                        return jsonify({"error":"El código de barras ya existe"}), 409
-                except Exception:
-                    pass
-            if barra:
-                try:
-                    cur.execute("SELECT producto_id FROM inventario_barras WHERE barra = %s", (barra,))
-                    r = cur.fetchone()
-                    if r:
-                        connm.close()
-                        return jsonify({"error":"El código de barras ya existe"}), 409
-                except Exception:
-                    pass
-            # ID autogenerado: si tu tabla usa AUTO_INCREMENT, omitimos id
-            if id_categoria is not None:
-                cur.execute(
-                    "INSERT INTO inventario (barra, nombre, precio, id_isv, stock, pesable, id_categoria) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                    (barra, nombre, precio, id_isv, stock, pesable, int(id_categoria))
-                )
-            else:
-                cur.execute(
-                    "INSERT INTO inventario (barra, nombre, precio, id_isv, stock, pesable) VALUES (%s, %s, %s, %s, %s, %s)",
-                    (barra, nombre, precio, id_isv, stock, pesable)
-                )
-            connm.commit()
-            try:
-                cur.execute("SELECT LAST_INSERT_ID()")
-                new_id = cur.fetchone()[0]
-            except Exception:
-                new_id = None
-            try:
-                auto_barra = None
-                if not barra or str(barra).strip() == "":
-                    try:
-                        auto_barra = str(int(new_id or 0)).zfill(6)
-                        cur.execute("UPDATE inventario SET barra = %s WHERE id = %s", (auto_barra, int(new_id or 0)))
-                        connm.commit()
-                    except Exception:
-                        auto_barra = None
-                final_barra = barra if (barra and str(barra).strip() != "") else auto_barra
-                if final_barra:
-                    try:
-                        cur.execute("INSERT INTO inventario_barras (producto_id, barra) VALUES (%s, %s)", (int(new_id or 0), final_barra))
-                        connm.commit()
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            connm.close()
-            return jsonify({"ok": True, "id": new_id})
-        except Exception as e:
-            # Si ya existe barra, reportar conflicto
-            return jsonify({"error": f"No se pudo crear en MySQL: {str(e)}"}), 500
-
-    # Fallback a SQLite
+    datos = {"barra": barra, "nombre": nombre, "precio": precio, "id_isv": id_isv, "stock": stock, "pesable": pesable}
+    if id_categoria is not None:
+        datos["id_categoria"] = int(id_categoria)
     try:
-        # Validar código de barras único en SQLite
-        if barra:
-            r = query_one("SELECT id FROM inventario WHERE barra = ?", (barra,))
-            if r:
-                return jsonify({"error":"El código de barras ya existe"}), 409
-            r2 = query_one("SELECT producto_id FROM inventario_barras WHERE barra = ?", (barra,))
-            if r2:
-                return jsonify({"error":"El código de barras ya existe"}), 409
-        if id_categoria is not None:
-            new_id = execute(
-                "INSERT INTO inventario (barra, nombre, precio, id_isv, stock, pesable, id_categoria) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (barra, nombre, precio, id_isv, stock, pesable, int(id_categoria))
-            )
-        else:
-            new_id = execute(
-                "INSERT INTO inventario (barra, nombre, precio, id_isv, stock, pesable) VALUES (?, ?, ?, ?, ?, ?)",
-                (barra, nombre, precio, id_isv, stock, pesable)
-            )
-        try:
-            auto_barra = None
-            if not barra or str(barra).strip() == "":
-                try:
-                    auto_barra = str(int(new_id or 0)).zfill(6)
-                    execute("UPDATE inventario SET barra = ? WHERE id = ?", (auto_barra, int(new_id or 0)))
-                except Exception:
-                    auto_barra = None
-            final_barra = barra if (barra and str(barra).strip() != "") else auto_barra
-            if final_barra:
-                try:
-                    execute("INSERT INTO inventario_barras (producto_id, barra) VALUES (?, ?)", (int(new_id or 0), final_barra))
-                except Exception:
-                    pass
-        except Exception:
-            pass
+        new_id = inventario.create(datos)
         return jsonify({"ok": True, "id": new_id})
-    except sqlite3.IntegrityError:
+    except CodigoDuplicado:
         return jsonify({"error":"El código de barras ya existe"}), 409
     except Exception as e:
-        return jsonify({"error":"No se pudo crear el producto"}), 500
+        return jsonify({"error": f"No se pudo crear el producto: {str(e)}"}), 500
 
 @app.post("/api/productos/<int:pid>")
 def api_actualizar_producto(pid):
@@ -2612,148 +2732,23 @@ def api_actualizar_producto(pid):
         stock = int(data.get("stock", 100))
     except Exception:
         stock = 100
-    # Preferir MySQL
-    if conectar_mysql is not None:
-        try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            # Validar duplicado de barra en otro producto (MySQL)
-            if barra:
-                try:
-                    cur.execute("SELECT id FROM inventario WHERE barra = %s AND id <> %s", (barra, pid))
-                    dup = cur.fetchone()
-                    if dup:
-                        connm.close()
-                        return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
-                except Exception:
-                    pass
-                try:
-                    cur.execute("SELECT producto_id FROM inventario_barras WHERE barra = %s AND producto_id <> %s", (barra, pid))
-                    dup2 = cur.fetchone()
-                    if dup2:
-                        connm.close()
-                        return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
-                except Exception:
-                    pass
-            if id_categoria is not None:
-                cur.execute(
-                    "UPDATE inventario SET barra=%s, nombre=%s, precio=%s, id_isv=%s, stock=%s, pesable=%s, id_categoria=%s WHERE id=%s",
-                    (barra, nombre, precio, id_isv, stock, pesable, int(id_categoria), pid)
-                )
-            else:
-                cur.execute(
-                    "UPDATE inventario SET barra=%s, nombre=%s, precio=%s, id_isv=%s, stock=%s, pesable=%s WHERE id=%s",
-                    (barra, nombre, precio, id_isv, stock, pesable, pid)
-                )
-            try:
-                if barra:
-                    cur.execute("INSERT INTO inventario_barras (producto_id, barra) VALUES (%s, %s)", (pid, barra))
-            except Exception:
-                pass
-            try:
-                if not barra or str(barra).strip() == "":
-                    auto_barra = str(int(pid)).zfill(6)
-                    try:
-                        cur.execute("UPDATE inventario SET barra = %s WHERE id = %s", (auto_barra, pid))
-                        connm.commit()
-                    except Exception:
-                        pass
-                    try:
-                        cur.execute("INSERT INTO inventario_barras (producto_id, barra) VALUES (%s, %s)", (pid, auto_barra))
-                        connm.commit()
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            connm.commit()
-            connm.close()
-            return jsonify({"ok": True, "id": pid})
-        except Exception as e:
-            return jsonify({"error": f"No se pudo actualizar en MySQL: {str(e)}"}), 500
-    # Fallback SQLite
+    datos = {"barra": barra, "nombre": nombre, "precio": precio, "id_isv": id_isv, "stock": stock, "pesable": pesable}
+    if id_categoria is not None:
+        datos["id_categoria"] = int(id_categoria)
     try:
-        # Validar duplicado de barra en otro producto (SQLite)
-        if barra:
-            r = query_one("SELECT id FROM inventario WHERE barra = ? AND id <> ?", (barra, pid))
-            if r:
-                return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
-            r2 = query_one("SELECT producto_id FROM inventario_barras WHERE barra = ? AND producto_id <> ?", (barra, pid))
-            if r2:
-                return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
-        if id_categoria is not None:
-            execute(
-                "UPDATE inventario SET barra=?, nombre=?, precio=?, id_isv=?, stock=?, pesable=?, id_categoria=? WHERE id=?",
-                (barra, nombre, precio, id_isv, stock, pesable, int(id_categoria), pid)
-            )
-        else:
-            execute(
-                "UPDATE inventario SET barra=?, nombre=?, precio=?, id_isv=?, stock=?, pesable=? WHERE id=?",
-                (barra, nombre, precio, id_isv, stock, pesable, pid)
-            )
-        try:
-            if barra:
-                execute("INSERT INTO inventario_barras (producto_id, barra) VALUES (?, ?)", (pid, barra))
-        except Exception:
-            pass
-        try:
-            if not barra or str(barra).strip() == "":
-                auto_barra = str(int(pid)).zfill(6)
-                try:
-                    execute("UPDATE inventario SET barra = ? WHERE id = ?", (auto_barra, pid))
-                except Exception:
-                    pass
-                try:
-                    execute("INSERT INTO inventario_barras (producto_id, barra) VALUES (?, ?)", (pid, auto_barra))
-                except Exception:
-                    pass
-        except Exception:
-            pass
+        inventario.update(pid, datos)
         return jsonify({"ok": True, "id": pid})
-    except Exception:
-        return jsonify({"error": "No se pudo actualizar producto"}), 500
+    except CodigoDuplicado:
+        return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
+    except Exception as e:
+        return jsonify({"error": f"No se pudo actualizar producto: {str(e)}"}), 500
 
 @app.get("/api/productos/<int:pid>/barras")
 def api_productos_barras_list(pid):
-    barras = []
-    # MySQL
-    if conectar_mysql is not None:
-        try:
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            try:
-                cur.execute("SELECT barra FROM inventario WHERE id = %s", (pid,))
-                r = cur.fetchone()
-                if r and r[0]:
-                    barras.append(str(r[0]))
-            except Exception:
-                pass
-            try:
-                cur.execute("SELECT barra FROM inventario_barras WHERE producto_id = %s", (pid,))
-                for br in cur.fetchall():
-                    if br and br[0]:
-                        barras.append(str(br[0]))
-            except Exception:
-                pass
-            connm.close()
-            return jsonify(sorted(list(set(barras))))
-        except Exception:
-            pass
-    # SQLite
     try:
-        row = query_one("SELECT barra FROM inventario WHERE id = ?", (pid,))
-        if row and row.get("barra"):
-            barras.append(str(row.get("barra")))
-        for r in query_all("SELECT barra FROM inventario_barras WHERE producto_id = ?", (pid,)):
-            if r.get("barra"):
-                barras.append(str(r.get("barra")))
+        return jsonify(inventario.barras(pid))
     except Exception:
-        pass
-    return jsonify(sorted(list(set(barras))))
+        return jsonify([])
 
 @app.post("/api/productos/<int:pid>/barras")
 def api_productos_barras_add(pid):
@@ -2761,131 +2756,32 @@ def api_productos_barras_add(pid):
     barra = (data.get("barra") or "").strip()
     if not barra:
         return jsonify({"error": "Barra requerida"}), 400
-    # MySQL
-    if conectar_mysql is not None:
-        try:
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            try:
-                cur.execute("SELECT id FROM inventario WHERE barra = %s AND id <> %s", (barra, pid))
-                dup = cur.fetchone()
-                if dup:
-                    connm.close()
-                    return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
-            except Exception:
-                pass
-            try:
-                cur.execute("SELECT producto_id FROM inventario_barras WHERE barra = %s AND producto_id <> %s", (barra, pid))
-                dup2 = cur.fetchone()
-                if dup2:
-                    connm.close()
-                    return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
-            except Exception:
-                pass
-            try:
-                cur.execute("INSERT INTO inventario_barras (producto_id, barra) VALUES (%s, %s)", (pid, barra))
-                connm.commit()
-            except Exception as e:
-                connm.close()
-                return jsonify({"error": str(e)}), 500
-            connm.close()
-            return jsonify({"ok": True})
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-    # SQLite
     try:
-        r = query_one("SELECT id FROM inventario WHERE barra = ? AND id <> ?", (barra, pid))
-        if r:
-            return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
-        r2 = query_one("SELECT producto_id FROM inventario_barras WHERE barra = ? AND producto_id <> ?", (barra, pid))
-        if r2:
-            return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
-        execute("INSERT INTO inventario_barras (producto_id, barra) VALUES (?, ?)", (pid, barra))
+        inventario.add_barra(pid, barra)
         return jsonify({"ok": True})
+    except CodigoDuplicado:
+        return jsonify({"error":"El código de barras ya existe en otro producto"}), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.delete("/api/productos/<int:pid>/barras/<barra>")
 def api_productos_barras_delete(pid, barra):
-    # MySQL
-    if conectar_mysql is not None:
-        try:
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            cur.execute("DELETE FROM inventario_barras WHERE producto_id = %s AND barra = %s", (pid, barra))
-            connm.commit()
-            connm.close()
-            return jsonify({"ok": True})
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-    # SQLite
     try:
-        with get_db() as conn:
-            conn.execute("DELETE FROM inventario_barras WHERE producto_id = ? AND barra = ?", (pid, barra))
-            conn.commit()
+        inventario.delete_barra(pid, barra)
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 @app.delete("/api/productos/<int:pid>")
 def api_eliminar_producto(pid):
-    # Preferir MySQL
-    if conectar_mysql is not None:
-        try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            codigo = request.args.get("codigo") or request.args.get("barra")
-            cur.execute("UPDATE inventario SET activo = 0 WHERE id = %s", (pid,))
-            eliminados = cur.rowcount
-            if eliminados == 0 and codigo:
-                try:
-                    cur.execute("UPDATE inventario SET activo = 0 WHERE barra = %s", (codigo,))
-                    eliminados = cur.rowcount
-                except Exception:
-                    pass
-            # No borrar inventario_barras para preservar trazabilidad
-            connm.commit()
-            connm.close()
-            if eliminados > 0:
-                return jsonify({"ok": True})
-            else:
-                return jsonify({"error": "Producto no encontrado"}), 404
-        except Exception as e:
-            return jsonify({"error": f"Error eliminando en MySQL: {str(e)}"}), 500
-
-    # Fallback SQLite
+    # Soft-delete: marcar inactivo; no se borra inventario_barras para preservar trazabilidad
+    codigo = request.args.get("codigo") or request.args.get("barra")
     try:
-        codigo = request.args.get("codigo") or request.args.get("barra")
-        with get_db() as conn:
-            cur = conn.cursor()
-            # Soft-delete: marcar inactivo
-            # Asegurar columna activo existe en SQLite
-            try:
-                cur.execute("PRAGMA table_info(inventario)")
-                cols = [r[1].lower() for r in cur.fetchall()]
-                if 'activo' not in cols:
-                    cur.execute("ALTER TABLE inventario ADD COLUMN activo INTEGER NOT NULL DEFAULT 1")
-            except Exception:
-                pass
-            cur.execute("UPDATE inventario SET activo = 0 WHERE id = ?", (pid,))
-            eliminados = cur.rowcount
-            if eliminados == 0 and codigo:
-                try:
-                    cur.execute("UPDATE inventario SET activo = 0 WHERE barra = ?", (codigo,))
-                    eliminados = cur.rowcount
-                except Exception:
-                    pass
-            # No borrar inventario_barras
-            conn.commit()
-            if eliminados > 0:
-                return jsonify({"ok": True})
-            return jsonify({"error": "Producto no encontrado"}), 404
+        eliminados = inventario.set_activo(pid, False, codigo=codigo)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": f"Error eliminando producto: {str(e)}"}), 500
+    if eliminados > 0:
+        return jsonify({"ok": True})
+    return jsonify({"error": "Producto no encontrado"}), 404
 
 @app.post("/api/registrar-venta")
 def api_registrar_venta():
@@ -2917,17 +2813,11 @@ def api_registrar_venta():
     # Preferir MySQL para registrar venta completa
     if conectar_mysql is not None:
         try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
+            connm = get_mysql()
             curm = connm.cursor()
             numero_factura = None
             cai = None
             try:
-                _asegurar_tablas_cai_separadas_mysql()
                 # Buscar CAI activo del tipo requerido
                 tbl = _tabla_cai(tipo_req)
                 curm.execute(f"""
@@ -3029,20 +2919,25 @@ def api_registrar_venta():
                     numero_factura = None
             except Exception:
                 pass
-            # Validar stock y descontar en inventario (MySQL)
+            # Validar stock y descontar en inventario: una lectura y un UPDATE para toda la venta
+            cantidades = {}
             for it in items:
-                codigo = it["codigo"]
-                cant = int(it["cantidad"])
-                curm.execute("SELECT stock, id FROM inventario WHERE id = %s OR barra = %s", (codigo, codigo))
-                r = curm.fetchone()
-                if not r:
+                codigo = str(it["codigo"]).strip()
+                cantidades[codigo] = cantidades.get(codigo, 0) + int(it["cantidad"])
+            # El carrito puede traer el id del producto como código (de cualquier largo)
+            productos = inventario.bulk_get(cantidades.keys(), bloquear=True, id_cualquier_largo=True, conn=connm)
+            descuentos = {}
+            for codigo, cant in cantidades.items():
+                p = productos.get(codigo)
+                if not p:
                     connm.close()
                     return jsonify({"error": f"Producto {codigo} no existe"}), 400
-                stock, id_real = int(r[0] or 0), int(r[1])
-                if stock < cant:
+                descuentos[p["id"]] = descuentos.get(p["id"], 0) + cant
+                stock = int(p["stock"] or 0)
+                if stock < descuentos[p["id"]]:
                     connm.close()
                     return jsonify({"error": f"Stock insuficiente para {codigo} (disp: {stock})"}), 400
-                curm.execute("UPDATE inventario SET stock = stock - %s WHERE id = %s", (cant, id_real))
+            inventario.bulk_update_stock({pid: -cant for pid, cant in descuentos.items()}, conn=connm)
             connm.commit()
 
             totales = calcular_totales_detalle(items)
@@ -3050,11 +2945,6 @@ def api_registrar_venta():
             cambio = round(efectivo - totales["total"], 2)
 
             # Insertar encabezado de venta en MySQL
-            if asegurar_tabla_ventas_mysql is not None:
-                try:
-                    asegurar_tabla_ventas_mysql()
-                except Exception:
-                    pass
             usuario = ""
             metodo_pago = "Efectivo"
             cliente_nombre = data.get("cliente_nombre") or "CONSUMIDOR FINAL"
@@ -3081,11 +2971,6 @@ def api_registrar_venta():
                 )
                 rid_sar = None
                 if tipo_req != 'E' and insertar_sar_venta_encabezado_mysql is not None:
-                    try:
-                        if asegurar_tabla_sar_ventas_mysql is not None:
-                            asegurar_tabla_sar_ventas_mysql()
-                    except Exception:
-                        pass
                     try:
                         rid_sar = insertar_sar_venta_encabezado_mysql(
                             mesa=None, mesero=None,
@@ -3229,7 +3114,7 @@ def api_ultima_factura():
     # Preferir MySQL si está disponible
     if conectar_mysql is not None:
         try:
-            connm = conectar_mysql()
+            connm = get_mysql()
             curm = connm.cursor()
             try:
                 curm.execute("SELECT id_venta FROM ventas_detalle WHERE id_venta IS NOT NULL ORDER BY id_detalle DESC LIMIT 1")
@@ -3259,7 +3144,7 @@ def factura_imprimir(factura_id):
         cambio = None
         cliente_rtn = ""
         if conectar_mysql is not None:
-            connm = conectar_mysql()
+            connm = get_mysql()
             curm = connm.cursor()
             try:
                 curm.execute("""
@@ -3358,8 +3243,7 @@ def api_cai_info():
     if conectar_mysql is None:
         return jsonify({"available": False}), 503
     try:
-        _asegurar_tablas_cai_separadas_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         tipo_req = (request.args.get("tipo") or "").strip().upper()
         r = None
@@ -3423,20 +3307,16 @@ def api_producto_mysql(codigo):
     if conectar_mysql is None:
         return jsonify({"error": "MySQL no disponible"}), 503
     try:
-        connm = conectar_mysql()
-        cur = connm.cursor()
-        cur.execute("SELECT id, nombre, barra, precio, id_isv FROM inventario WHERE id = %s OR barra = %s", (codigo, codigo))
-        row = cur.fetchone()
-        connm.close()
-        if not row:
+        producto = inventario.get_by_code(codigo, solo_activos=False, id_cualquier_largo=True)
+        if not producto:
             return jsonify({"encontrado": False}), 404
         return jsonify({
             "encontrado": True,
-            "id": int(row[0]),
-            "nombre": row[1],
-            "codigo": str(row[2] or ""),
-            "precio": float(row[3]),
-            "id_isv": int(row[4] or 3)
+            "id": producto["id"],
+            "nombre": producto["nombre"],
+            "codigo": producto["codigo"],
+            "precio": producto["precio"],
+            "id_isv": producto["id_isv"] or 3
         })
     except Exception as e:
         return jsonify({"error": f"{e}"}), 500
@@ -3446,10 +3326,9 @@ def api_apertura_estado():
     if conectar_mysql is None:
         return jsonify({"available": False}), 503
     try:
-        _asegurar_tabla_cierres_caja_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
-        cur.execute("SELECT COUNT(*) FROM cierres_caja WHERE DATE(fecha_inicio)=CURDATE() AND fecha_fin IS NULL")
+        cur.execute("SELECT COUNT(*) FROM cierres_caja WHERE fecha_inicio >= CURDATE() AND fecha_inicio < CURDATE() + INTERVAL 1 DAY AND fecha_fin IS NULL")
         abierta = int(cur.fetchone()[0] or 0) > 0
         connm.close()
         return jsonify({"abierta": abierta})
@@ -3472,10 +3351,9 @@ def api_apertura_abrir():
     u = session.get("usuario") or {}
     usuario = (u.get("usuario") or u.get("nombre") or "").strip()
     try:
-        _asegurar_tabla_cierres_caja_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
-        cur.execute("SELECT COUNT(*) FROM cierres_caja WHERE DATE(fecha_inicio)=CURDATE() AND fecha_fin IS NULL")
+        cur.execute("SELECT COUNT(*) FROM cierres_caja WHERE fecha_inicio >= CURDATE() AND fecha_inicio < CURDATE() + INTERVAL 1 DAY AND fecha_fin IS NULL")
         abierta = int(cur.fetchone()[0] or 0) > 0
         if abierta:
             connm.close()
@@ -3493,187 +3371,50 @@ def api_apertura_abrir():
 
 @app.get("/api/producto-csv/<codigo>")
 def api_producto_csv(codigo):
-    candidates = [
-        os.path.join(PARENT_DIR, "productos.csv"),
-        os.path.join(PARENT_DIR, "productos"),
-    ]
-    encodings = ("utf-8-sig", "cp1252", "latin1")
-    for path in candidates:
-        if not os.path.exists(path):
-            continue
-        for enc in encodings:
-            try:
-                with open(path, "r", encoding=enc, newline="") as f:
-                    sample = f.read(2048)
-                    f.seek(0)
-                    try:
-                        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
-                    except Exception:
-                        class _D: pass
-                        dialect = _D()
-                        setattr(dialect, "delimiter", "\t")
-                    reader = csv.reader(f, dialect)
-                    try:
-                        headers = next(reader)
-                    except Exception:
-                        headers = []
-                    col_codigo = 0
-                    col_nombre = 1
-                    col_precio = None
-                    col_isv = None
-                    col_stock = None
-                    col_pesable = None
-                    if headers:
-                        hclean = [str(h).lower().strip().replace("\ufeff","") for h in headers]
-                        for i, h in enumerate(hclean):
-                            if "codigo" in h or "barra" in h or "ean" in h:
-                                col_codigo = i
-                            if "nombre" in h or "producto" in h:
-                                col_nombre = i
-                            if "precio" in h or "price" in h or "valor" in h:
-                                col_precio = i
-                            if "isv" in h or "iva" in h or "impuesto" in h:
-                                col_isv = i
-                            if "stock" in h or "existencia" in h:
-                                col_stock = i
-                            if "pesable" in h:
-                                col_pesable = i
-                    fila = 1
-                    for row in reader:
-                        fila += 1
-                        if len(row) <= max(col_codigo, col_nombre):
-                            continue
-                        kc = str(row[col_codigo]).strip()
-                        if kc == codigo:
-                            nombre = str(row[col_nombre]).strip()
-                            precio = None
-                            id_isv = None
-                            stock = None
-                            pesable = None
-                            try:
-                                if col_precio is not None and col_precio < len(row):
-                                    precio = float(str(row[col_precio]).replace(",", ".").strip())
-                            except Exception:
-                                precio = None
-                            try:
-                                if col_isv is not None and col_isv < len(row):
-                                    isv_val = str(row[col_isv]).strip().lower()
-                                    if isv_val in ("15","15%","1"):
-                                        id_isv = 1
-                                    elif isv_val in ("18","18%","2"):
-                                        id_isv = 2
-                                    elif isv_val in ("exento","ex","3","0"):
-                                        id_isv = 3
-                            except Exception:
-                                id_isv = None
-                            try:
-                                if col_stock is not None and col_stock < len(row):
-                                    stock = int(str(row[col_stock]).strip())
-                            except Exception:
-                                stock = None
-                            try:
-                                if col_pesable is not None and col_pesable < len(row):
-                                    p = str(row[col_pesable]).strip().lower()
-                                    pesable = 1 if p in ("si","sí","true","1","y","yes") else 0
-                            except Exception:
-                                pesable = None
-                            return jsonify({
-                                "encontrado": True,
-                                "codigo": codigo,
-                                "nombre": nombre,
-                                "precio": precio,
-                                "id_isv": id_isv,
-                                "stock": stock,
-                                "pesable": pesable,
-                                "fila": fila
-                            })
-            except Exception:
-                continue
-    return jsonify({"encontrado": False, "mensaje": "Código no encontrado en CSV"}), 404
+    r = catalogo_csv.por_codigo(codigo)
+    if r is None:
+        return jsonify({"encontrado": False, "mensaje": "Código no encontrado en CSV"}), 404
+    return jsonify(dict(r, encontrado=True, codigo=codigo))
 
 @app.get("/buscar-codigo/<codigo>")
 def redir_buscar_codigo(codigo):
-    # 1) Intentar en MySQL, priorizando barra exacta; 6 dígitos se consideran código único
-    if conectar_mysql is not None:
-        try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
-            cur = connm.cursor()
-            codigo_str = str(codigo).strip()
-            # Buscar por barra exacta
-            cur.execute("SELECT id, nombre, barra, precio, id_isv FROM inventario WHERE (activo IS NULL OR activo = 1) AND barra = %s", (codigo_str,))
-            row = cur.fetchone()
-            if not row:
-                # Fallback: buscar en inventario_barras
-                try:
-                    cur.execute("SELECT producto_id FROM inventario_barras WHERE barra = %s", (codigo_str,))
-                    pidrow = cur.fetchone()
-                    if pidrow:
-                        cur.execute("SELECT id, nombre, barra, precio, id_isv FROM inventario WHERE (activo IS NULL OR activo = 1) AND id = %s", (int(pidrow[0]),))
-                        row = cur.fetchone()
-                except Exception:
-                    row = None
-            # Buscar por id si el código es de 6 dígitos (000123 -> id=123)
-            if not row and codigo_str.isdigit() and len(codigo_str) == 6:
-                try:
-                    cur.execute("SELECT id, nombre, barra, precio, id_isv FROM inventario WHERE (activo IS NULL OR activo = 1) AND id = %s", (int(codigo_str),))
-                    row = cur.fetchone()
-                except Exception:
-                    row = None
-            connm.close()
-            if row:
-                return redirect(f"/productos?codigo={row[2] or codigo_str}&msg=found_mysql")
-        except Exception:
-            pass
+    # 1) Intentar en inventario (barra, barras alternas, id si tiene 6 dígitos)
+    codigo_str = str(codigo).strip()
+    try:
+        producto = indice_productos.obtener(codigo_str) or inventario.get_by_code(codigo_str)
+    except Exception:
+        producto = None
+    if producto:
+        return redirect(f"/productos?codigo={producto['codigo'] or codigo_str}&msg=found_mysql")
     # 2) Intentar en CSV
-    candidates = [
-        os.path.join(PARENT_DIR, "productos.csv"),
-        os.path.join(PARENT_DIR, "productos"),
-    ]
-    encodings = ("utf-8-sig", "cp1252", "latin1")
-    for path in candidates:
-        if not os.path.exists(path):
-            continue
-        for enc in encodings:
-            try:
-                with open(path, "r", encoding=enc, newline="") as f:
-                    sample = f.read(2048)
-                    f.seek(0)
-                    try:
-                        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
-                    except Exception:
-                        class _D: pass
-                        dialect = _D()
-                        setattr(dialect, "delimiter", "\t")
-                    reader = csv.reader(f, dialect)
-                    try:
-                        headers = next(reader)
-                    except Exception:
-                        headers = []
-                    col_codigo = 0
-                    col_nombre = 1
-                    if headers:
-                        hclean = [str(h).lower().strip().replace("\ufeff","") for h in headers]
-                        for i, h in enumerate(hclean):
-                            if "codigo" in h or "barra" in h or "ean" in h:
-                                col_codigo = i
-                            if "nombre" in h or "producto" in h:
-                                col_nombre = i
-                    for row in reader:
-                        if len(row) <= max(col_codigo, col_nombre):
-                            continue
-                        if str(row[col_codigo]).strip() == str(codigo).strip():
-                            nombre = str(row[col_nombre]).strip()
-                            return redirect(f"/agregar-producto?codigo={codigo}&nombre={nombre}&msg=found_csv")
-            except Exception:
-                continue
+    r = catalogo_csv.por_codigo(codigo)
+    if r is not None:
+        return redirect(f"/agregar-producto?codigo={codigo}&nombre={r['nombre']}&msg=found_csv")
     # 3) No encontrado: abrir agregar producto con el código para captura manual
     return redirect(f"/agregar-producto?codigo={codigo}&msg=not_found")
 
+PARECIDOS_MAX = 20
+
+
+def _parametro_k() -> int:
+    """Cuántos candidatos parecidos devolver (?k=, de 1 a PARECIDOS_MAX)"""
+    try:
+        return max(1, min(int(request.args.get("k", 5)), PARECIDOS_MAX))
+    except Exception:
+        return 5
+
+
+def _ficha_por_nombre(producto: dict, puntaje: float) -> dict:
+    return {
+        "id": producto["id"],
+        "nombre": producto["nombre"],
+        "codigo": producto["codigo"],
+        "precio": float(producto["precio"] or 0),
+        "id_isv": int(producto["id_isv"] or 3),
+        "puntaje": puntaje,
+    }
+
+
 @app.get("/api/producto-mysql-por-nombre")
 def api_producto_mysql_por_nombre():
     if conectar_mysql is None:
@@ -3681,8 +3422,31 @@ def api_producto_mysql_por_nombre():
     nombre = request.args.get("nombre", "").strip()
     if not nombre:
         return jsonify({"error": "Parámetro 'nombre' requerido"}), 400
-    try:
-        connm = conectar_mysql()
+    k = _parametro_k()
+    ids = buscador_nombres.buscar(nombre, "todos")
+    if ids is not None:
+        # Con el nombre exacto (sin acentos ni mayúsculas) no se buscan parecidos;
+        # si no, los candidatos son los de mayor similitud de trigramas
+        exacto = buscador_nombres.exacto(nombre)
+        parecidos = [(exacto, 1.0)] if exacto is not None else buscador_nombres.parecidos(nombre, k) or []
+        puntajes = dict(parecidos)
+        # Elegido: el exacto o el mejor de la búsqueda por palabras; un nombre
+        # solo parecido no cuenta como encontrado
+        pid = exacto if exacto is not None else (ids[0] if ids else None)
+        try:
+            productos = {p["id"]: p for p, _ in inventario.todos(set(puntajes) | ({pid} if pid is not None else set()))}
+        except Exception as e:
+            return jsonify({"error": f"{e}"}), 500
+        candidatos = [_ficha_por_nombre(productos[c], p) for c, p in parecidos if c in productos]
+        producto = productos.get(pid) if pid is not None else None
+        if not producto:
+            return jsonify({"encontrado": False, "candidatos": candidatos}), 404
+        puntaje = puntajes.get(pid)
+        if puntaje is None:
+            puntaje = similitud(normalizar(nombre), normalizar(producto["nombre"]))
+        return jsonify(dict(_ficha_por_nombre(producto, puntaje), encontrado=True, candidatos=candidatos))
+    try:
+        connm = get_mysql()
         cur = connm.cursor()
         # Búsqueda exacta (case-insensitive)
         cur.execute(
@@ -3699,15 +3463,13 @@ def api_producto_mysql_por_nombre():
             row = cur.fetchone()
         connm.close()
         if not row:
-            return jsonify({"encontrado": False}), 404
-        return jsonify({
-            "encontrado": True,
-            "id": int(row[0]),
-            "nombre": row[1],
-            "codigo": str(row[2] or ""),
-            "precio": float(row[3]),
-            "id_isv": int(row[4] or 3)
-        })
+            return jsonify({"encontrado": False, "candidatos": []}), 404
+        # Sin índice cargado no hay candidatos aproximados: solo el encontrado por SQL
+        producto = _ficha_por_nombre(
+            {"id": int(row[0]), "nombre": row[1], "codigo": str(row[2] or ""), "precio": row[3], "id_isv": row[4]},
+            similitud(normalizar(nombre), normalizar(row[1] or "")),
+        )
+        return jsonify(dict(producto, encontrado=True, candidatos=[producto]))
     except Exception as e:
         return jsonify({"error": f"{e}"}), 500
 
@@ -3716,151 +3478,19 @@ def api_producto_csv_por_nombre():
     nombre = request.args.get("nombre", "").strip()
     if not nombre:
         return jsonify({"error": "Parámetro 'nombre' requerido"}), 400
-    candidates = [
-        os.path.join(PARENT_DIR, "productos.csv"),
-        os.path.join(PARENT_DIR, "productos"),
-    ]
-    encodings = ("utf-8-sig", "cp1252", "latin1")
-    objetivo = nombre.lower()
-    for path in candidates:
-        if not os.path.exists(path):
-            continue
-        for enc in encodings:
-            try:
-                with open(path, "r", encoding=enc, newline="") as f:
-                    sample = f.read(2048)
-                    f.seek(0)
-                    try:
-                        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
-                    except Exception:
-                        class _D: pass
-                        dialect = _D()
-                        setattr(dialect, "delimiter", "\t")
-                    reader = csv.reader(f, dialect)
-                    try:
-                        headers = next(reader)
-                    except Exception:
-                        headers = []
-                    col_codigo = None
-                    col_nombre = 1
-                    col_precio = None
-                    col_isv = None
-                    col_stock = None
-                    col_pesable = None
-                    if headers:
-                        hclean = [str(h).lower().strip().replace("\ufeff","") for h in headers]
-                        for i, h in enumerate(hclean):
-                            if "codigo" in h or "barra" in h or "ean" in h:
-                                col_codigo = i
-                            if "nombre" in h or "producto" in h:
-                                col_nombre = i
-                            if "precio" in h or "price" in h or "valor" in h:
-                                col_precio = i
-                            if "isv" in h or "iva" in h or "impuesto" in h:
-                                col_isv = i
-                            if "stock" in h or "existencia" in h:
-                                col_stock = i
-                            if "pesable" in h:
-                                col_pesable = i
-                    fila = 1
-                    mejor = None
-                    for row in reader:
-                        fila += 1
-                        if len(row) <= col_nombre:
-                            continue
-                        nombre_csv = str(row[col_nombre]).strip()
-                        nc = nombre_csv.lower()
-                        if nc == objetivo:
-                            precio = None
-                            id_isv = None
-                            stock = None
-                            pesable = None
-                            try:
-                                if col_precio is not None and col_precio < len(row):
-                                    precio = float(str(row[col_precio]).replace(",", ".").strip())
-                            except Exception:
-                                precio = None
-                            try:
-                                if col_isv is not None and col_isv < len(row):
-                                    isv_val = str(row[col_isv]).strip().lower()
-                                    if isv_val in ("15","15%","1"):
-                                        id_isv = 1
-                                    elif isv_val in ("18","18%","2"):
-                                        id_isv = 2
-                                    elif isv_val in ("exento","ex","3","0"):
-                                        id_isv = 3
-                            except Exception:
-                                id_isv = None
-                            try:
-                                if col_stock is not None and col_stock < len(row):
-                                    stock = int(str(row[col_stock]).strip())
-                            except Exception:
-                                stock = None
-                            try:
-                                if col_pesable is not None and col_pesable < len(row):
-                                    p = str(row[col_pesable]).strip().lower()
-                                    pesable = 1 if p in ("si","sí","true","1","y","yes") else 0
-                            except Exception:
-                                pesable = None
-                            return jsonify({
-                                "encontrado": True,
-                                "codigo": (str(row[col_codigo]).strip() if col_codigo is not None and col_codigo < len(row) else ""),
-                                "nombre": nombre_csv,
-                                "precio": precio,
-                                "id_isv": id_isv,
-                                "stock": stock,
-                                "pesable": pesable,
-                                "fila": fila
-                            })
-                        # Guardar primera coincidencia parcial como mejor candidata
-                        if mejor is None and (objetivo in nc):
-                            mejor = (list(row), fila)
-                    if mejor is not None:
-                        row, fila = mejor
-                        precio = None
-                        id_isv = None
-                        stock = None
-                        pesable = None
-                        try:
-                            if col_precio is not None and col_precio < len(row):
-                                precio = float(str(row[col_precio]).replace(",", ".").strip())
-                        except Exception:
-                            precio = None
-                        try:
-                            if col_isv is not None and col_isv < len(row):
-                                isv_val = str(row[col_isv]).strip().lower()
-                                if isv_val in ("15","15%","1"):
-                                    id_isv = 1
-                                elif isv_val in ("18","18%","2"):
-                                    id_isv = 2
-                                elif isv_val in ("exento","ex","3","0"):
-                                    id_isv = 3
-                        except Exception:
-                            id_isv = None
-                        try:
-                            if col_stock is not None and col_stock < len(row):
-                                stock = int(str(row[col_stock]).strip())
-                        except Exception:
-                            stock = None
-                        try:
-                            if col_pesable is not None and col_pesable < len(row):
-                                p = str(row[col_pesable]).strip().lower()
-                                pesable = 1 if p in ("si","sí","true","1","y","yes") else 0
-                        except Exception:
-                            pesable = None
-                        return jsonify({
-                            "encontrado": True,
-                            "codigo": (str(row[col_codigo]).strip() if col_codigo is not None and col_codigo < len(row) else ""),
-                            "nombre": str(row[col_nombre]).strip(),
-                            "precio": precio,
-                            "id_isv": id_isv,
-                            "stock": stock,
-                            "pesable": pesable,
-                            "fila": fila
-                        })
-            except Exception:
-                continue
-    return jsonify({"encontrado": False, "mensaje": "Nombre no encontrado en CSV"}), 404
+    # El nombre exacto o la primera fila que lo contiene; los parecidos solo son
+    # candidatos (None si el nombre es exacto: no hace falta buscarlos)
+    r, parecidos = catalogo_csv.buscar_nombre(nombre, _parametro_k())
+    if r is None:
+        return jsonify({"encontrado": False, "mensaje": "Nombre no encontrado en CSV",
+                        "candidatos": [dict(c, puntaje=p) for c, p in parecidos]}), 404
+    if parecidos is None:
+        return jsonify(dict(r, encontrado=True, puntaje=1.0, candidatos=[dict(r, puntaje=1.0)]))
+    puntaje = next((p for c, p in parecidos if c["fila"] == r["fila"] and c["nombre"] == r["nombre"]), None)
+    if puntaje is None:
+        puntaje = similitud(normalizar(nombre), normalizar(r["nombre"]))
+    return jsonify(dict(r, encontrado=True, puntaje=puntaje,
+                        candidatos=[dict(c, puntaje=p) for c, p in parecidos]))
 
 @app.get("/api/buscar-producto-api/<codigo>")
 def api_buscar_producto_externo(codigo):
@@ -3930,6 +3560,7 @@ def api_quick_add_producto():
                 "INSERT INTO inventario (barra, nombre, precio, id_isv, stock) VALUES (?, ?, ?, ?, ?)",
                 (codigo_barras, nombre, precio, respuesta["id_isv"], respuesta["stock"])
             )
+            inventario.avisar_cambios([new_id])
             respuesta["guardado"] = True
             respuesta["id"] = new_id
         except sqlite3.IntegrityError:
@@ -3951,28 +3582,8 @@ def api_anular_factura():
     # MySQL preferente
     if conectar_mysql is not None:
         try:
-            if asegurar_tablas_mysql is not None:
-                try:
-                    asegurar_tablas_mysql()
-                except Exception:
-                    pass
-            connm = conectar_mysql()
+            connm = get_mysql()
             cur = connm.cursor()
-            # Asegurar tabla de logs
-            try:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS logs_anulaciones (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        id_venta INT,
-                        numero_factura VARCHAR(64),
-                        usuario VARCHAR(255),
-                        fecha_anulacion VARCHAR(19),
-                        motivo TEXT,
-                        datos_json TEXT
-                    )
-                """)
-            except Exception:
-                pass
             # Marcar anulada
             cur.execute("UPDATE ventas SET estado = 'anulada' WHERE numero_factura = %s", (numero,))
             afectadas = cur.rowcount
@@ -3992,24 +3603,6 @@ def api_anular_factura():
             return jsonify({"error": f"{e}"}), 500
     # SQLite fallback
     try:
-        # Asegurar tabla ventas y logs en SQLite
-        try:
-            with get_db() as conn:
-                conn.execute("CREATE TABLE IF NOT EXISTS ventas (id_venta INTEGER PRIMARY KEY AUTOINCREMENT, numero_factura TEXT, estado TEXT, fecha TEXT)")
-                conn.execute("""
-                    CREATE TABLE IF NOT EXISTS logs_anulaciones (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        id_venta INTEGER,
-                        numero_factura TEXT,
-                        usuario TEXT,
-                        fecha_anulacion TEXT,
-                        motivo TEXT,
-                        datos_json TEXT
-                    )
-                """)
-                conn.commit()
-        except Exception:
-            pass
         with get_db() as conn:
             cur = conn.cursor()
             cur.execute("UPDATE ventas SET estado = 'anulada' WHERE numero_factura = ?", (numero,))
@@ -4071,6 +3664,7 @@ def api_escanear_y_crear():
             "INSERT INTO inventario (barra, nombre, precio, id_isv, stock) VALUES (?, ?, ?, ?, ?)",
             (codigo_barras, nombre.strip(), float(precio), id_isv, stock)
         )
+        inventario.avisar_cambios([new_id])
         
         return jsonify({
             "ok": True,
@@ -4105,8 +3699,7 @@ def api_usuarios_list():
     if not _is_admin():
         return jsonify({"error":"No autorizado"}), 403
     try:
-        _asegurar_tabla_usuarios_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("SELECT nombre, usuario, rol, activo FROM usuarios ORDER BY nombre")
         rows = cur.fetchall()
@@ -4133,8 +3726,7 @@ def api_usuarios_create():
     if not usuario or not nombre or not contrasena:
         return jsonify({"error":"Datos requeridos"}), 400
     try:
-        _asegurar_tabla_usuarios_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("SELECT 1 FROM usuarios WHERE usuario = %s", (usuario,))
         if cur.fetchone():
@@ -4162,8 +3754,7 @@ def api_usuarios_update(usuario):
     rol = req.get("rol")
     activo = req.get("activo")
     try:
-        _asegurar_tabla_usuarios_mysql()
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("SELECT nombre, usuario, rol, activo FROM usuarios WHERE usuario = %s", (usuario,))
         if not cur.fetchone():
@@ -4203,7 +3794,7 @@ def api_usuarios_activar(usuario):
     if not _is_admin():
         return jsonify({"error":"No autorizado"}), 403
     try:
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("UPDATE usuarios SET activo = 1 WHERE usuario = %s", (usuario,))
         connm.commit()
@@ -4217,7 +3808,7 @@ def api_usuarios_inactivar(usuario):
     if not _is_admin():
         return jsonify({"error":"No autorizado"}), 403
     try:
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("UPDATE usuarios SET activo = 0 WHERE usuario = %s", (usuario,))
         connm.commit()
@@ -4231,7 +3822,7 @@ def api_usuarios_delete(usuario):
     if not _is_admin():
         return jsonify({"error":"No autorizado"}), 403
     try:
-        connm = conectar_mysql()
+        connm = get_mysql()
         cur = connm.cursor()
         cur.execute("DELETE FROM usuarios WHERE usuario = %s", (usuario,))
         connm.commit()
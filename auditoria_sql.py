@@ -0,0 +1,149 @@
+"""
+Auditoría de consultas con EXPLAIN.
+Extrae las sentencias SQL literales del código, sustituye los parámetros
+por valores de ejemplo y ejecuta EXPLAIN contra el esquema actual para
+señalar recorridos completos de tabla. Las consultas armadas con f-strings
+no se pueden leer del código: el repositorio las entrega de ejemplo con
+consultas_muestra(). Cada sentencia se audita solo en su motor: el de la
+clase que la contiene (atributo `motor`), su sintaxis propia o su estilo
+de parámetros; las del repositorio base valen para los dos y usan `?`
+"""
+import ast
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FUNCIONES_SQL = {"execute", "executemany", "query_one", "query_all", "_ejecutar"}
+_RE_LIMITE = re.compile(r"\b(LIMIT|OFFSET)\s+(%s|\?)", re.IGNORECASE)
+_RE_PARAM = re.compile(r"%s|\?")
+_RE_FILTRO = re.compile(r"\b(WHERE|ORDER\s+BY|JOIN)\b", re.IGNORECASE)
+# Sintaxis que solo entiende un motor
+_RE_SOLO_MYSQL = re.compile(r"^DELETE\s+\w+\s+FROM\b|\bINSERT\s+IGNORE\b|\bON\s+DUPLICATE\s+KEY\b|\bFOR\s+UPDATE\b", re.IGNORECASE)
+_RE_SOLO_SQLITE = re.compile(r"\bINSERT\s+OR\b|\bON\s+CONFLICT\b|\bPRAGMA\b|\bsqlite_master\b", re.IGNORECASE)
+
+
+def _motor_de_clase(clase: ast.ClassDef) -> Optional[str]:
+    """Valor del atributo `motor = "..."` de la clase, si lo declara"""
+    for nodo in clase.body:
+        if (isinstance(nodo, ast.Assign) and isinstance(nodo.value, ast.Constant)
+                and any(getattr(t, "id", "") == "motor" for t in nodo.targets)):
+            return str(nodo.value.value)
+    return None
+
+
+def extraer_sql(ruta: str) -> List[Tuple[int, str, str]]:
+    """
+    (línea, sentencia, motor) de cada SELECT/UPDATE/DELETE literal pasado a
+    execute/query_*; motor "" si vale para los dos
+    """
+    with open(ruta, "r", encoding="utf-8") as f:
+        arbol = ast.parse(f.read(), filename=ruta)
+    por_clase: Dict[int, str] = {}
+    for clase in ast.walk(arbol):
+        if isinstance(clase, ast.ClassDef):
+            motor = _motor_de_clase(clase)
+            if motor is not None:
+                por_clase.update((id(n), motor) for n in ast.walk(clase) if id(n) not in por_clase)
+    sentencias = []
+    for nodo in ast.walk(arbol):
+        if not isinstance(nodo, ast.Call) or not nodo.args:
+            continue
+        func = nodo.func
+        nombre = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", "")
+        if nombre not in FUNCIONES_SQL:
+            continue
+        # _ejecutar(conn, sql, ...) recibe la sentencia como segundo argumento
+        arg = nodo.args[1] if nombre == "_ejecutar" and len(nodo.args) > 1 else nodo.args[0]
+        if not isinstance(arg, ast.Constant) or not isinstance(arg.value, str):
+            continue
+        sql = " ".join(arg.value.split())
+        if sql.split(" ", 1)[0].upper() in ("SELECT", "UPDATE", "DELETE"):
+            sentencias.append((nodo.lineno, sql, _motor_de(sql, por_clase.get(id(nodo)))))
+    return sorted(sentencias)
+
+
+def _motor_de(sql: str, clase: Optional[str] = None) -> str:
+    if _RE_SOLO_MYSQL.search(sql):
+        return "mysql"
+    if _RE_SOLO_SQLITE.search(sql):
+        return "sqlite"
+    if clase is not None:
+        return clase
+    if "%s" in sql:
+        return "mysql"
+    if "?" in sql:
+        return "sqlite"
+    return ""
+
+
+def _con_valores(sql: str) -> str:
+    sql = _RE_LIMITE.sub(r"\1 1", sql)
+    return _RE_PARAM.sub("'1'", sql)
+
+
+def _explicar(conn, motor: str, sql: str, params: Iterable = ()) -> List[str]:
+    """Recorridos completos detectados en el plan de la sentencia"""
+    cur = conn.cursor()
+    params = tuple(params)
+    if motor == "mysql":
+        cur.execute("EXPLAIN " + sql, params or None)
+        nombres = [d[0].lower() for d in cur.description]
+        escaneos = []
+        for fila in cur.fetchall():
+            plan = dict(zip(nombres, fila))
+            # <derivedN>/<unionN> son resultados intermedios, no tablas
+            if str(plan.get("type") or "").upper() == "ALL" and not str(plan.get("table") or "").startswith("<"):
+                escaneos.append(f"type=ALL en {plan.get('table')} (~{plan.get('rows')} filas)")
+        return escaneos
+    cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+    filas = cur.fetchall()
+    tablas = {r[0].lower() for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+    escaneos = []
+    for fila in filas:
+        detalle = str(fila[-1])
+        # "SCAN r" de una subconsulta recorre su resultado, no una tabla
+        partes = detalle.split()
+        if len(partes) > 1 and partes[0] == "SCAN" and partes[1].lower() not in tablas:
+            continue
+        if detalle.startswith("SCAN") and "INDEX" not in detalle:
+            escaneos.append(detalle)
+    return escaneos
+
+
+def _revisar(conn, motor: str, item: Dict, params: Optional[Iterable] = None) -> Dict:
+    try:
+        if params is not None:
+            item["escaneos"] = _explicar(conn, motor, item["sql"], params)
+        elif _RE_FILTRO.search(item["sql"]):
+            item["escaneos"] = _explicar(conn, motor, _con_valores(item["sql"]))
+    except Exception as e:
+        item["error"] = str(e)
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+    return item
+
+
+def auditar(conn, motor: str, rutas: List[str], muestras: Iterable[Tuple[str, str, List]] = ()) -> List[Dict]:
+    """
+    Ejecuta EXPLAIN sobre cada sentencia del motor indicado. Solo se señalan
+    las literales que filtran u ordenan (WHERE/ORDER BY/JOIN); un COUNT(*)
+    sin filtro recorre la tabla por diseño. `muestras` son consultas
+    (nombre, sql, params) ya adaptadas al motor, como las de
+    InventoryRepository.consultas_muestra(); se explican siempre y con sus
+    parámetros. En los resultados su archivo es "muestra" y su línea el nombre
+    """
+    resultados = []
+    for ruta in rutas:
+        for linea, sql, motor_sql in extraer_sql(ruta):
+            if motor_sql not in ("", motor):
+                continue
+            if motor == "mysql":
+                # Mismo cambio que MySQLInventoryRepository._sql
+                sql = sql.replace("?", "%s")
+            item = {"archivo": ruta, "linea": linea, "sql": sql, "escaneos": [], "error": None}
+            resultados.append(_revisar(conn, motor, item))
+    for nombre, sql, params in muestras:
+        item = {"archivo": "muestra", "linea": nombre, "sql": " ".join(sql.split()), "escaneos": [], "error": None}
+        resultados.append(_revisar(conn, motor, item, params))
+    return resultados
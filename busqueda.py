@@ -0,0 +1,405 @@
+"""
+Búsqueda de productos por nombre.
+Índice invertido de tokens y trigramas sobre los nombres normalizados
+(minúsculas, sin acentos ni signos de puntuación). Sustituye al
+`nombre LIKE '%q%'`, que recorre toda la tabla, y ordena por relevancia.
+Se mantiene con los avisos del repositorio de inventario
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_RE_NO_ALNUM = re.compile(r"[^0-9a-z]+")
+
+# Puntos por token de la consulta según cómo aparece en el nombre
+_EXACTO, _PREFIJO, _SUBCADENA = 3, 2, 1
+
+# Niveles del autocompletado, en orden de prioridad
+_POR_BARRA, _POR_NOMBRE, _POR_PALABRA = 0, 1, 2
+
+
+def normalizar(texto) -> str:
+    """'Café Molido (400g)' -> 'cafe molido 400g'"""
+    texto = unicodedata.normalize("NFKD", str(texto or "").lower())
+    if not texto.isascii():
+        texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    return " ".join(_RE_NO_ALNUM.sub(" ", texto).split())
+
+
+def tokens(texto) -> List[str]:
+    return normalizar(texto).split()
+
+
+def trigramas(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def trigramas_nombre(norm: str) -> Set[str]:
+    """Trigramas de cada palabra con relleno ('  w', ' wo', ..., 'rd '), como pg_trgm"""
+    resultado: Set[str] = set()
+    for palabra in norm.split():
+        resultado |= trigramas(f"  {palabra} ")
+    return resultado
+
+
+def similitud(norm_a: str, norm_b: str) -> float:
+    """Jaccard entre los trigramas de dos nombres normalizados, de 0 a 1"""
+    a, b = trigramas_nombre(norm_a), trigramas_nombre(norm_b)
+    if not a or not b:
+        return 0.0
+    comunes = len(a & b)
+    return round(comunes / (len(a) + len(b) - comunes), 4)
+
+
+class ComparadorNombres:
+    """
+    Los k nombres más parecidos a una consulta, con su puntaje (similitud de
+    Jaccard entre trigramas, de 0 a 1). Índice invertido trigrama -> claves.
+    Solo se generan candidatos desde los trigramas más raros de la consulta:
+    un nombre con similitud >= `minimo` comparte al menos ceil(minimo * |Tq|)
+    trigramas con ella, así que tiene que aparecer en alguno de los
+    |Tq| - ceil(minimo * |Tq|) + 1 de menor frecuencia (filtrado por prefijo)
+    """
+
+    def __init__(self):
+        self._trigramas: Dict[object, frozenset] = {}
+        self._por_trigrama: Dict[str, Set[object]] = {}
+
+    def __len__(self):
+        return len(self._trigramas)
+
+    def agregar(self, clave, norm: str):
+        self.quitar(clave)
+        tri = frozenset(trigramas_nombre(norm))
+        if not tri:
+            return
+        self._trigramas[clave] = tri
+        for t in tri:
+            self._por_trigrama.setdefault(t, set()).add(clave)
+
+    def quitar(self, clave):
+        tri = self._trigramas.pop(clave, None)
+        for t in tri or ():
+            claves = self._por_trigrama.get(t)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._por_trigrama[t]
+
+    def mejores(self, norm: str, k: int = 5, minimo: float = 0.2, filtro=None) -> List[Tuple[object, float]]:
+        """[(clave, puntaje)] de mayor a menor; `filtro(clave)` descarta candidatos"""
+        consulta = trigramas_nombre(norm)
+        if not consulta:
+            return []
+        necesarios = max(1, math.ceil(minimo * len(consulta)))
+        raros = sorted(consulta, key=lambda t: len(self._por_trigrama.get(t, ())))
+        candidatos: Set[object] = set()
+        for t in raros[:len(consulta) - necesarios + 1]:
+            candidatos |= self._por_trigrama.get(t, set())
+        puntuados = []
+        for clave in candidatos:
+            if filtro is not None and not filtro(clave):
+                continue
+            tri = self._trigramas[clave]
+            comunes = len(consulta & tri)
+            if comunes < necesarios:
+                continue
+            puntaje = comunes / (len(consulta) + len(tri) - comunes)
+            if puntaje >= minimo:
+                puntuados.append((puntaje, clave))
+        return [(clave, round(p, 4)) for p, clave in heapq.nlargest(k, puntuados, key=lambda x: x[0])]
+
+
+def _claves_prefijo(norm: str, barra: str) -> List[Tuple[int, str]]:
+    """(nivel, clave) de un producto: la barra, el nombre y el nombre desde cada palabra interior"""
+    claves = [(_POR_BARRA, barra.lower())] if barra else []
+    if norm:
+        claves.append((_POR_NOMBRE, norm))
+        claves.extend((_POR_PALABRA, norm[i + 1:]) for i, ch in enumerate(norm) if ch == " ")
+    return claves
+
+
+class _Tablas:
+    """Estructuras del índice; una carga completa construye unas nuevas"""
+
+    def __init__(self):
+        # id -> (nombre normalizado, barra, activo, id_categoria)
+        self.productos: Dict[int, Tuple[str, str, bool, Optional[int]]] = {}
+        self.por_token: Dict[str, Set[int]] = {}
+        self.por_trigrama: Dict[str, Set[str]] = {}
+        self.vocabulario: List[str] = []
+        self.por_barra: Dict[str, int] = {}
+        # Listas ordenadas de (clave, id) por nivel para el autocompletado
+        self.prefijos: Tuple[List[Tuple[str, int]], ...] = ([], [], [])
+        self.similares = ComparadorNombres()
+
+    def agregar(self, pid: int, nombre: str, barra: str, activo: bool, id_categoria, ordenado: bool = True):
+        """
+        Con `ordenado` las listas ordenadas se mantienen con insort (cambios
+        sueltos); en una carga completa se agregan al final y ordenar() las
+        ordena una vez al terminar
+        """
+        norm = normalizar(nombre)
+        self.productos[pid] = (norm, barra, activo, id_categoria)
+        for tok in set(norm.split()):
+            ids = self.por_token.get(tok)
+            if ids is None:
+                ids = self.por_token[tok] = set()
+                if ordenado:
+                    bisect.insort(self.vocabulario, tok)
+                else:
+                    self.vocabulario.append(tok)
+                for tri in trigramas(tok):
+                    self.por_trigrama.setdefault(tri, set()).add(tok)
+            ids.add(pid)
+        if barra:
+            self.por_barra[barra] = pid
+        for nivel, clave in _claves_prefijo(norm, barra):
+            if ordenado:
+                bisect.insort(self.prefijos[nivel], (clave, pid))
+            else:
+                self.prefijos[nivel].append((clave, pid))
+        self.similares.agregar(pid, norm)
+
+    def ordenar(self):
+        self.vocabulario.sort()
+        for lista in self.prefijos:
+            lista.sort()
+
+    def quitar(self, pid: int):
+        previo = self.productos.pop(pid, None)
+        if previo is None:
+            return
+        norm, barra, _, _ = previo
+        self.similares.quitar(pid)
+        for tok in set(norm.split()):
+            ids = self.por_token.get(tok)
+            if ids is None:
+                continue
+            ids.discard(pid)
+            if ids:
+                continue
+            del self.por_token[tok]
+            i = bisect.bisect_left(self.vocabulario, tok)
+            if i < len(self.vocabulario) and self.vocabulario[i] == tok:
+                del self.vocabulario[i]
+            for tri in trigramas(tok):
+                toks = self.por_trigrama.get(tri)
+                if toks is not None:
+                    toks.discard(tok)
+                    if not toks:
+                        del self.por_trigrama[tri]
+        if barra and self.por_barra.get(barra) == pid:
+            del self.por_barra[barra]
+        for nivel, clave in _claves_prefijo(norm, barra):
+            lista = self.prefijos[nivel]
+            i = bisect.bisect_left(lista, (clave, pid))
+            if i < len(lista) and lista[i] == (clave, pid):
+                del lista[i]
+
+
+class IndiceNombres:
+    """
+    Tokens del nombre -> ids y trigramas -> tokens. Cada token de la consulta
+    se busca como subcadena de los tokens del vocabulario (los de menos de
+    tres letras, como prefijo), así que el coste depende del vocabulario que
+    coincide y no del tamaño del catálogo. Todos los tokens de la consulta
+    deben aparecer en el nombre
+    """
+
+    def __init__(self, repositorio, ttl: float = 300.0):
+        self._repo = repositorio
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._t = _Tablas()
+        self._cargado = 0.0
+        self._recargando = False
+        repositorio.suscribir(self._al_cambiar)
+
+    @property
+    def cargado(self) -> bool:
+        return self._cargado > 0
+
+    def cargar(self):
+        """Carga completa; construye estructuras nuevas y las publica de una vez"""
+        tablas = _Tablas()
+        for p, activo in self._repo.todos():
+            tablas.agregar(p["id"], p["nombre"], p["codigo"], activo, p["id_categoria"], ordenado=False)
+        tablas.ordenar()
+        with self._lock:
+            self._t = tablas
+            self._cargado = time.monotonic()
+
+    def _recargar_en_segundo_plano(self):
+        with self._lock:
+            if self._recargando:
+                return
+            self._recargando = True
+
+        def tarea():
+            try:
+                self.cargar()
+            except Exception:
+                pass
+            finally:
+                self._recargando = False
+
+        threading.Thread(target=tarea, name="recarga-indice-nombres", daemon=True).start()
+
+    def refrescar(self, ids: Iterable[int]):
+        """Vuelve a leer los productos indicados"""
+        ids = [int(x) for x in ids]
+        if not ids or not self._cargado:
+            return
+        filas = self._repo.todos(ids)
+        with self._lock:
+            for pid in ids:
+                self._t.quitar(pid)
+            for p, activo in filas:
+                self._t.agregar(p["id"], p["nombre"], p["codigo"], activo, p["id_categoria"])
+
+    def _al_cambiar(self, evento: str, datos):
+        # El stock no afecta a la búsqueda
+        if evento == "productos":
+            self.refrescar(datos)
+        elif evento == "todo" and self._cargado:
+            self.cargar()
+
+    # --- Consulta ---
+    def _coincidencias(self, consulta: str) -> Dict[str, int]:
+        """Tokens del vocabulario que contienen `consulta`, con su puntuación"""
+        t = self._t
+        if len(consulta) < 3:
+            i = bisect.bisect_left(t.vocabulario, consulta)
+            encontrados = {}
+            while i < len(t.vocabulario) and t.vocabulario[i].startswith(consulta):
+                tok = t.vocabulario[i]
+                encontrados[tok] = _EXACTO if tok == consulta else _PREFIJO
+                i += 1
+            return encontrados
+        candidatos = None
+        for tri in sorted(trigramas(consulta), key=lambda x: len(t.por_trigrama.get(x, ()))):
+            toks = t.por_trigrama.get(tri)
+            if not toks:
+                return {}
+            candidatos = set(toks) if candidatos is None else candidatos & toks
+            if not candidatos:
+                return {}
+        encontrados = {}
+        for tok in candidatos:
+            if tok == consulta:
+                encontrados[tok] = _EXACTO
+            elif tok.startswith(consulta):
+                encontrados[tok] = _PREFIJO
+            elif consulta in tok:
+                encontrados[tok] = _SUBCADENA
+        return encontrados
+
+    def buscar(self, q: str, estado: str = "activos", categoria: Optional[int] = None) -> Optional[List[int]]:
+        """
+        Ids que coinciden con q ordenados por relevancia (la barra exacta
+        primero, luego puntuación, nombre que empieza por la consulta y nombre
+        más corto). None si el índice aún no está cargado
+        """
+        if not self._cargado:
+            self._recargar_en_segundo_plano()
+            return None
+        if time.monotonic() - self._cargado > self.ttl:
+            self._recargar_en_segundo_plano()
+        consulta = tokens(q)
+        if not consulta:
+            return []
+        with self._lock:
+            t = self._t
+            puntos: Optional[Dict[int, int]] = None
+            for tok in dict.fromkeys(consulta):
+                por_id: Dict[int, int] = {}
+                for vocablo, valor in self._coincidencias(tok).items():
+                    for pid in t.por_token[vocablo]:
+                        if valor > por_id.get(pid, 0):
+                            por_id[pid] = valor
+                if puntos is None:
+                    puntos = por_id
+                else:
+                    puntos = {pid: v + por_id[pid] for pid, v in puntos.items() if pid in por_id}
+                if not puntos:
+                    break
+            puntos = puntos or {}
+            por_barra = t.por_barra.get(str(q).strip())
+            if por_barra is not None:
+                puntos[por_barra] = puntos.get(por_barra, 0) + 100
+            frase = " ".join(consulta)
+            resultado = []
+            for pid, valor in puntos.items():
+                norm, _, activo, id_categoria = t.productos[pid]
+                if estado == "activos" and not activo or estado == "inactivos" and activo:
+                    continue
+                if categoria is not None and id_categoria != categoria:
+                    continue
+                resultado.append((-valor, not norm.startswith(frase), len(norm), norm, pid))
+        resultado.sort()
+        return [r[-1] for r in resultado]
+
+    def exacto(self, nombre: str) -> Optional[int]:
+        """Id cuyo nombre normalizado coincide exactamente con `nombre`"""
+        norm = normalizar(nombre)
+        for pid in self.buscar(nombre, "todos") or []:
+            producto = self._t.productos.get(pid)
+            if producto and producto[0] == norm:
+                return pid
+        return None
+
+    def parecidos(self, nombre: str, k: int = 5, estado: str = "todos") -> Optional[List[Tuple[int, float]]]:
+        """
+        Los k productos de nombre más parecido, [(id, puntaje)], con el nombre
+        exacto (sin acentos ni mayúsculas) primero y puntaje 1.0. None si el
+        índice aún no está cargado
+        """
+        if not self._cargado:
+            self._recargar_en_segundo_plano()
+            return None
+        norm = normalizar(nombre)
+        with self._lock:
+            t = self._t
+
+            def vale(pid):
+                activo = t.productos[pid][2]
+                return estado == "todos" or (estado == "activos") == activo
+
+            return t.similares.mejores(norm, k, filtro=vale)
+
+    def autocompletar(self, q: str, limite: int = 10) -> Optional[List[int]]:
+        """
+        Hasta `limite` ids de productos activos cuya barra, nombre o alguna
+        palabra del nombre empiezan por q, en ese orden de prioridad. Cada
+        nivel es una búsqueda binaria más un recorrido de `limite` elementos.
+        None si el índice aún no está cargado
+        """
+        if not self._cargado:
+            self._recargar_en_segundo_plano()
+            return None
+        barra = str(q or "").strip().lower()
+        norm = normalizar(q)
+        ids: List[int] = []
+        vistos: Set[int] = set()
+        with self._lock:
+            t = self._t
+            for nivel, prefijo in ((_POR_BARRA, barra), (_POR_NOMBRE, norm), (_POR_PALABRA, norm)):
+                if not prefijo:
+                    continue
+                lista = t.prefijos[nivel]
+                i = bisect.bisect_left(lista, (prefijo,))
+                while i < len(lista) and len(ids) < limite:
+                    clave, pid = lista[i]
+                    if not clave.startswith(prefijo):
+                        break
+                    if pid not in vistos and t.productos[pid][2]:
+                        vistos.add(pid)
+                        ids.append(pid)
+                    i += 1
+        return ids
@@ -0,0 +1,69 @@
+"""
+Versiones de los datos de lectura frecuente y revalidación HTTP con ETag.
+Cada conjunto (productos, categorias, clientes...) lleva un contador que
+suben los handlers que escriben; el ETag se arma con ese contador, así que
+un If-None-Match vigente se responde con 304 sin tocar la base
+"""
+import functools
+import hashlib
+import threading
+import time
+from typing import Callable, Dict
+
+from flask import make_response, request
+
+
+class VersionesDatos:
+    """
+    Contador monótono por conjunto de datos. Los contadores viven en el
+    proceso: el ETag incluye un identificador del arranque y una ventana de
+    `ventana` segundos para que lo escrito por otros procesos (u otra
+    aplicación sobre la misma base) se note como mucho al cerrar la ventana
+    """
+
+    def __init__(self, ventana: float = 60.0):
+        self.ventana = float(ventana)
+        self._lock = threading.Lock()
+        self._versiones: Dict[str, int] = {}
+        self._arranque = format(time.time_ns(), "x")
+
+    def actual(self, nombre: str) -> int:
+        return self._versiones.get(nombre, 0)
+
+    def incrementar(self, *nombres: str):
+        with self._lock:
+            for nombre in nombres:
+                self._versiones[nombre] = self._versiones.get(nombre, 0) + 1
+
+    def etag(self, nombre: str, variante: str = "") -> str:
+        """ETag fuerte del conjunto; `variante` distingue parámetros de la consulta"""
+        partes = [nombre, self._arranque, str(self.actual(nombre))]
+        if self.ventana > 0:
+            partes.append(str(int(time.time() // self.ventana)))
+        if variante:
+            partes.append(hashlib.sha1(variante.encode("utf-8")).hexdigest()[:12])
+        return "-".join(partes)
+
+    def con_etag(self, nombre: str) -> Callable:
+        """
+        Decorador para GET: responde 304 si If-None-Match trae el ETag vigente
+        y, si no, añade ETag a la respuesta 200 de la vista
+        """
+        def decorador(vista):
+            @functools.wraps(vista)
+            def envoltura(*args, **kwargs):
+                # La versión se lee antes de consultar: si alguien escribe
+                # mientras tanto, el cliente revalidará en la próxima petición
+                etag = self.etag(nombre, request.query_string.decode("utf-8", "replace"))
+                # Comparación débil: la versión comprimida lleva el mismo ETag como W/
+                if request.if_none_match.contains_weak(etag):
+                    res = make_response("", 304)
+                else:
+                    res = make_response(vista(*args, **kwargs))
+                    if res.status_code != 200:
+                        return res
+                res.set_etag(etag)
+                res.headers["Cache-Control"] = "no-cache"
+                return res
+            return envoltura
+        return decorador
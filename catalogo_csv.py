@@ -0,0 +1,415 @@
+"""
+Catálogo de proveedor en CSV (PARENT_DIR/productos.csv).
+El archivo se interpreta una sola vez (formato con csv_deteccion) y queda
+indexado por código, por nombre normalizado y por trigramas del nombre
+(búsqueda aproximada): en memoria si es pequeño y,
+a partir de `umbral_sidecar` bytes, en un SQLite junto al CSV
+(productos.csv.idx.sqlite) que se compila en segundo plano. La caché se
+identifica por ruta, mtime y tamaño: si el archivo cambia, la próxima
+consulta lo vuelve a leer
+"""
+import heapq
+import math
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import csv_deteccion
+from busqueda import ComparadorNombres, normalizar, trigramas, trigramas_nombre
+
+SUFIJO_SIDECAR = ".idx.sqlite"
+# Se sube si cambia el esquema del sidecar para que se recompile
+VERSION_SIDECAR = "3"
+_CAMPOS = ("codigo", "nombre", "precio", "id_isv", "stock", "pesable", "fila")
+
+
+def trigramas_subcadena(objetivo: str) -> Set[str]:
+    """
+    Trigramas (con el relleno de trigramas_nombre) que tiene todo nombre que
+    contiene a `objetivo`: la primera palabra puede ser el final de otra y la
+    última el comienzo, así que solo las palabras interiores llevan relleno
+    en los dos lados
+    """
+    palabras = objetivo.split()
+    resultado: Set[str] = set()
+    for i, palabra in enumerate(palabras):
+        texto = ("  " if i > 0 else "") + palabra + (" " if i < len(palabras) - 1 else "")
+        resultado |= trigramas(texto)
+    return resultado
+
+
+def _puntaje(consulta: Set[str], tri: Set[str]) -> float:
+    comunes = len(consulta & tri)
+    return comunes / (len(consulta) + len(tri) - comunes) if comunes else 0.0
+
+
+def _con_parecidos(indice, objetivo: str, k: int, minimo: float):
+    """(coincidencia, parecidos) de un índice; sin parecidos (None) si el nombre es exacto"""
+    r = indice.por_nombre(objetivo)
+    if r is not None and normalizar(r["nombre"]) == objetivo:
+        return r, None
+    return r, indice.parecidos(objetivo, k, minimo)
+
+
+class _IndiceCSV:
+    """Filas de un archivo ya interpretadas, con sus índices en memoria"""
+
+    def __init__(self, ruta: str):
+        self.registros: List[Dict] = []
+        self._por_codigo: Dict[str, Dict] = {}
+        self._por_nombre: Dict[str, Dict] = {}
+        self._nombres: List[Tuple[str, Dict]] = []
+        self._comparador = ComparadorNombres()
+        for r in csv_deteccion.registros(ruta):
+            self.registros.append(r)
+            # Con códigos o nombres repetidos gana la primera fila, como en la lectura secuencial
+            if r["codigo"]:
+                self._por_codigo.setdefault(r["codigo"], r)
+            norm = normalizar(r["nombre"])
+            if norm:
+                self._por_nombre.setdefault(norm, r)
+                self._nombres.append((norm, r))
+                self._comparador.agregar(len(self.registros) - 1, norm)
+
+    def por_codigo(self, codigo: str) -> Optional[Dict]:
+        return self._por_codigo.get(codigo)
+
+    def por_nombre(self, objetivo: str) -> Optional[Dict]:
+        r = self._por_nombre.get(objetivo)
+        if r is not None:
+            return r
+        for norm, r in self._nombres:
+            if objetivo in norm:
+                return r
+        return None
+
+    def parecidos(self, objetivo: str, k: int, minimo: float) -> List[Tuple[Dict, float]]:
+        return [(self.registros[i], p) for i, p in self._comparador.mejores(objetivo, k, minimo)]
+
+    def buscar_nombre(self, objetivo: str, k: int, minimo: float) -> Tuple[Optional[Dict], Optional[List[Tuple[Dict, float]]]]:
+        return _con_parecidos(self, objetivo, k, minimo)
+
+
+class _RecorridoCSV:
+    """Lectura secuencial del archivo; solo mientras se compila su sidecar"""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+
+    def por_codigo(self, codigo: str) -> Optional[Dict]:
+        for r in csv_deteccion.registros(self.ruta):
+            if r["codigo"] == codigo:
+                return r
+        return None
+
+    def por_nombre(self, objetivo: str) -> Optional[Dict]:
+        parcial = None
+        for r in csv_deteccion.registros(self.ruta):
+            norm = normalizar(r["nombre"])
+            if norm == objetivo:
+                return r
+            if parcial is None and objetivo in norm:
+                parcial = r
+        return parcial
+
+    def parecidos(self, objetivo: str, k: int, minimo: float) -> List[Tuple[Dict, float]]:
+        return self._recorrer(objetivo, k, minimo, cortar_en_exacto=False)[1]
+
+    def buscar_nombre(self, objetivo: str, k: int, minimo: float) -> Tuple[Optional[Dict], Optional[List[Tuple[Dict, float]]]]:
+        """
+        Coincidencia por nombre y parecidos en una sola lectura del archivo;
+        el nombre exacto corta la lectura (sin parecidos)
+        """
+        return self._recorrer(objetivo, k, minimo, cortar_en_exacto=True)
+
+    def _recorrer(self, objetivo: str, k: int, minimo: float, cortar_en_exacto: bool):
+        consulta = trigramas_nombre(objetivo)
+        parcial = None
+        puntuados = []
+        for r in csv_deteccion.registros(self.ruta):
+            norm = normalizar(r["nombre"])
+            if cortar_en_exacto and norm == objetivo:
+                return r, None
+            if parcial is None and objetivo in norm:
+                parcial = r
+            if consulta:
+                puntaje = _puntaje(consulta, trigramas_nombre(norm))
+                if puntaje and puntaje >= minimo:
+                    puntuados.append((puntaje, -r["fila"], r))
+        parecidos = [(r, round(p, 4)) for p, _, r in heapq.nlargest(k, puntuados, key=lambda x: x[:2])]
+        return parcial, parecidos
+
+
+def _leer_meta(ruta_sidecar: str) -> Dict[str, str]:
+    conn = sqlite3.connect(f"file:{ruta_sidecar}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute("SELECT clave, valor FROM meta").fetchall())
+    finally:
+        conn.close()
+
+
+def _sidecar_vigente(ruta_sidecar: str, firma: Tuple[int, int]) -> bool:
+    try:
+        meta = _leer_meta(ruta_sidecar)
+    except Exception:
+        return False
+    return meta.get("version") == VERSION_SIDECAR and meta.get("firma") == f"{firma[0]}:{firma[1]}"
+
+
+def compilar_sidecar(ruta: str, firma: Tuple[int, int], ruta_sidecar: str):
+    """Escribe el SQLite indexado en un temporal y lo publica con un rename atómico"""
+    temporal = f"{ruta_sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+    conn = sqlite3.connect(temporal)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("CREATE TABLE meta (clave TEXT PRIMARY KEY, valor TEXT)")
+        conn.execute("""
+            CREATE TABLE productos (
+                fila INTEGER PRIMARY KEY, codigo TEXT, nombre TEXT, nombre_norm TEXT,
+                precio REAL, id_isv INTEGER, stock INTEGER, pesable INTEGER, n_trigramas INTEGER
+            )
+        """)
+        # Índice invertido para la búsqueda aproximada: cada trigrama con sus filas
+        conn.execute("CREATE TABLE trigramas (tri TEXT, fila INTEGER, PRIMARY KEY (tri, fila)) WITHOUT ROWID")
+        for r in csv_deteccion.registros(ruta):
+            norm = normalizar(r["nombre"])
+            tri = trigramas_nombre(norm)
+            conn.execute(
+                "INSERT OR IGNORE INTO productos (fila, codigo, nombre, nombre_norm, precio, id_isv, stock, pesable, n_trigramas) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (r["fila"], r["codigo"], r["nombre"], norm, r["precio"], r["id_isv"], r["stock"], r["pesable"], len(tri))
+            )
+            conn.executemany("INSERT OR IGNORE INTO trigramas (tri, fila) VALUES (?, ?)", ((t, r["fila"]) for t in tri))
+        # (columna, fila): la primera fila de cada código/nombre sale directo del índice
+        conn.execute("CREATE INDEX idx_productos_codigo ON productos (codigo, fila)")
+        conn.execute("CREATE INDEX idx_productos_nombre ON productos (nombre_norm, fila)")
+        # Filas por trigrama: la búsqueda parcial arranca por el más raro
+        conn.execute("CREATE TABLE frecuencias (tri TEXT PRIMARY KEY, n INTEGER) WITHOUT ROWID")
+        conn.execute("INSERT INTO frecuencias (tri, n) SELECT tri, COUNT(*) FROM trigramas GROUP BY tri")
+        conn.executemany("INSERT INTO meta (clave, valor) VALUES (?, ?)",
+                         [("version", VERSION_SIDECAR), ("firma", f"{firma[0]}:{firma[1]}")])
+        conn.commit()
+    finally:
+        conn.close()
+    try:
+        os.replace(temporal, ruta_sidecar)
+    except Exception:
+        os.remove(temporal)
+        raise
+
+
+class _SidecarCSV:
+    """Consultas sobre el SQLite compilado; una conexión de solo lectura por consulta"""
+
+    def __init__(self, ruta_sidecar: str):
+        self.ruta_sidecar = ruta_sidecar
+
+    def _conectar(self):
+        return sqlite3.connect(f"file:{self.ruta_sidecar}?mode=ro", uri=True)
+
+    def _una(self, sql: str, params, conn=None) -> Optional[Dict]:
+        propia = conn is None
+        if propia:
+            conn = self._conectar()
+        try:
+            r = conn.execute(sql, params).fetchone()
+        finally:
+            if propia:
+                conn.close()
+        return dict(zip(_CAMPOS, r)) if r else None
+
+    def por_codigo(self, codigo: str) -> Optional[Dict]:
+        return self._una(f"SELECT {', '.join(_CAMPOS)} FROM productos WHERE codigo = ? ORDER BY fila LIMIT 1", (codigo,))
+
+    def por_nombre(self, objetivo: str) -> Optional[Dict]:
+        conn = self._conectar()
+        try:
+            r = self._una(f"SELECT {', '.join(_CAMPOS)} FROM productos WHERE nombre_norm = ? ORDER BY fila LIMIT 1", (objetivo,), conn)
+            if r is not None:
+                return r
+            # Coincidencia parcial: toda fila que contiene la subcadena tiene sus
+            # trigramas obligatorios, así que basta recorrer (en orden de fila)
+            # las filas del más raro. Sin trigramas (menos de tres letras) queda
+            # el recorrido completo
+            tri = sorted(trigramas_subcadena(objetivo))
+            if not tri:
+                return self._una(f"SELECT {', '.join(_CAMPOS)} FROM productos WHERE instr(nombre_norm, ?) > 0 ORDER BY fila LIMIT 1", (objetivo,), conn)
+            frecuencias = conn.execute(f"SELECT tri, n FROM frecuencias WHERE tri IN ({', '.join('?' * len(tri))})", tri).fetchall()
+            if len(frecuencias) < len(tri):
+                return None
+            raro = min(frecuencias, key=lambda x: x[1])[0]
+            return self._una(f"""
+                SELECT {', '.join('p.' + c for c in _CAMPOS)}
+                FROM trigramas t JOIN productos p ON p.fila = t.fila
+                WHERE t.tri = ? AND instr(p.nombre_norm, ?) > 0
+                ORDER BY t.fila LIMIT 1
+            """, (raro, objetivo), conn)
+        finally:
+            conn.close()
+
+    def parecidos(self, objetivo: str, k: int, minimo: float) -> List[Tuple[Dict, float]]:
+        consulta = sorted(trigramas_nombre(objetivo))
+        if not consulta:
+            return []
+        # Solo se cuentan las filas de los trigramas de la consulta; las que no
+        # alcanzan ceil(minimo * |Tq|) trigramas en común no pueden llegar al mínimo
+        necesarios = max(1, math.ceil(minimo * len(consulta)))
+        marcas = ", ".join("?" * len(consulta))
+        sql = f"""
+            SELECT {', '.join('p.' + c for c in _CAMPOS)},
+                   CAST(t.comunes AS REAL) / (? + p.n_trigramas - t.comunes) AS puntaje
+            FROM (SELECT fila, COUNT(*) AS comunes FROM trigramas WHERE tri IN ({marcas})
+                  GROUP BY fila HAVING COUNT(*) >= ?) t
+            JOIN productos p ON p.fila = t.fila
+            WHERE CAST(t.comunes AS REAL) / (? + p.n_trigramas - t.comunes) >= ?
+            ORDER BY puntaje DESC, p.fila
+            LIMIT ?
+        """
+        conn = self._conectar()
+        try:
+            filas = conn.execute(sql, (len(consulta), *consulta, necesarios, len(consulta), minimo, k)).fetchall()
+        finally:
+            conn.close()
+        return [(dict(zip(_CAMPOS, f[:-1])), round(f[-1], 4)) for f in filas]
+
+    def buscar_nombre(self, objetivo: str, k: int, minimo: float) -> Tuple[Optional[Dict], Optional[List[Tuple[Dict, float]]]]:
+        return _con_parecidos(self, objetivo, k, minimo)
+
+
+class CatalogoCSV:
+    """
+    Consultas sobre los archivos candidatos, en orden: gana el primero que
+    existe y contiene el dato. `firma` (mtime, tamaño) decide si el índice
+    sigue valiendo. Los archivos de `umbral_sidecar` bytes o más se consultan
+    en su sidecar; mientras se compila, con una lectura secuencial
+    """
+
+    def __init__(self, rutas: Sequence[str], umbral_sidecar: int = 5 * 1024 * 1024):
+        self.rutas = list(rutas)
+        self.umbral_sidecar = int(umbral_sidecar)
+        self._lock = threading.Lock()
+        self._indices: Dict[str, Tuple[Tuple[int, int], object]] = {}
+        self._compilando: Dict[str, Tuple[int, int]] = {}
+        self._fallidos: Dict[str, Tuple[int, int]] = {}
+
+    def _compilar_en_segundo_plano(self, ruta: str, firma: Tuple[int, int], ruta_sidecar: str):
+        with self._lock:
+            if self._compilando.get(ruta) == firma:
+                return
+            self._compilando[ruta] = firma
+
+        def tarea():
+            try:
+                compilar_sidecar(ruta, firma, ruta_sidecar)
+            except Exception as e:
+                # Sin permiso de escritura junto al CSV, p. ej.: no se reintenta hasta que cambie
+                self._fallidos[ruta] = firma
+                print(f"No se pudo compilar el índice de {ruta}: {e}", flush=True)
+            finally:
+                with self._lock:
+                    if self._compilando.get(ruta) == firma:
+                        del self._compilando[ruta]
+
+        threading.Thread(target=tarea, name="sidecar-csv", daemon=True).start()
+
+    def _indice(self, ruta: str):
+        firma = csv_deteccion.firma(ruta)
+        if firma is None:
+            self._indices.pop(ruta, None)
+            return None
+        previo = self._indices.get(ruta)
+        if previo and previo[0] == firma:
+            return previo[1]
+        if firma[1] >= self.umbral_sidecar:
+            ruta_sidecar = ruta + SUFIJO_SIDECAR
+            if _sidecar_vigente(ruta_sidecar, firma):
+                indice = _SidecarCSV(ruta_sidecar)
+                self._indices[ruta] = (firma, indice)
+                return indice
+            if self._fallidos.get(ruta) != firma:
+                self._compilar_en_segundo_plano(ruta, firma, ruta_sidecar)
+            return _RecorridoCSV(ruta)
+        with self._lock:
+            previo = self._indices.get(ruta)
+            if previo and previo[0] == firma:
+                return previo[1]
+            indice = _IndiceCSV(ruta)
+            self._indices[ruta] = (firma, indice)
+            return indice
+
+    def _indices_vigentes(self):
+        for ruta in self.rutas:
+            try:
+                indice = self._indice(ruta)
+            except Exception:
+                indice = None
+            if indice is not None:
+                yield indice
+
+    def por_codigo(self, codigo: str) -> Optional[Dict]:
+        codigo = str(codigo).strip()
+        for indice in self._indices_vigentes():
+            try:
+                r = indice.por_codigo(codigo)
+            except Exception:
+                r = None
+            if r is not None:
+                return r
+        return None
+
+    def por_nombre(self, nombre: str) -> Optional[Dict]:
+        """Nombre exacto (sin mayúsculas ni acentos) o, si no, la primera fila que lo contiene"""
+        objetivo = normalizar(nombre)
+        if not objetivo:
+            return None
+        for indice in self._indices_vigentes():
+            try:
+                r = indice.por_nombre(objetivo)
+            except Exception:
+                r = None
+            if r is not None:
+                return r
+        return None
+
+    def parecidos(self, nombre: str, k: int = 5, minimo: float = 0.2) -> List[Tuple[Dict, float]]:
+        """
+        Las k filas de nombre más parecido [(fila, puntaje)], de todos los
+        archivos; el puntaje es la similitud de trigramas (1.0 = mismo nombre)
+        """
+        objetivo = normalizar(nombre)
+        if not objetivo:
+            return []
+        puntuados = []
+        for orden, indice in enumerate(self._indices_vigentes()):
+            try:
+                encontrados = indice.parecidos(objetivo, k, minimo)
+            except Exception:
+                encontrados = []
+            # A igual puntaje gana el archivo anterior y, dentro de él, la fila anterior
+            puntuados.extend((p, -orden, -r["fila"], r) for r, p in encontrados)
+        return [(r, p) for p, _, _, r in heapq.nlargest(k, puntuados, key=lambda x: x[:3])]
+
+    def buscar_nombre(self, nombre: str, k: int = 5, minimo: float = 0.2) -> Tuple[Optional[Dict], Optional[List[Tuple[Dict, float]]]]:
+        """
+        por_nombre() y parecidos() juntos; cada archivo se consulta una vez
+        (mientras se compila un sidecar, una sola lectura del CSV). Si lo
+        elegido es el nombre exacto no se buscan parecidos y vuelve None
+        """
+        objetivo = normalizar(nombre)
+        if not objetivo:
+            return None, []
+        elegido, puntuados = None, []
+        for orden, indice in enumerate(self._indices_vigentes()):
+            try:
+                r, encontrados = indice.buscar_nombre(objetivo, k, minimo)
+            except Exception:
+                r, encontrados = None, []
+            if encontrados is None:
+                if elegido is None:
+                    return r, None
+                encontrados = [(r, 1.0)]
+            if elegido is None:
+                elegido = r
+            puntuados.extend((p, -orden, -c["fila"], c) for c, p in encontrados)
+        return elegido, [(r, p) for p, _, _, r in heapq.nlargest(k, puntuados, key=lambda x: x[:3])]
@@ -0,0 +1,104 @@
+"""
+Compresión de respuestas negociada con Accept-Encoding.
+Brotli si el módulo `brotli` está instalado, si no gzip. Solo se comprimen
+tipos de texto por encima de un tamaño mínimo; las páginas y los archivos
+estáticos se repiten casi idénticos en cada visita, así que su versión
+comprimida se guarda en memoria indexada por el hash del contenido
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+TIPOS_COMPRIMIBLES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "image/x-icon",
+    "image/vnd.microsoft.icon",
+)
+
+
+class CompresorRespuestas:
+    """
+    Se registra con `app.after_request(compresor.comprimir)`. `cachear`
+    decide qué respuestas (por ruta) guardan su versión comprimida; las de
+    la API cambian en cada petición y no vale la pena
+    """
+
+    def __init__(self, minimo: int = 1024, nivel_gzip: int = 6, calidad_brotli: int = 5,
+                 max_cache: int = 256, cachear=None):
+        self.minimo = int(minimo)
+        self.nivel_gzip = nivel_gzip
+        self.calidad_brotli = calidad_brotli
+        self.max_cache = int(max_cache)
+        self._cachear = cachear or (lambda ruta: not ruta.startswith("/api/"))
+        self._cache: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _elegir(self, request) -> Optional[str]:
+        aceptadas = request.accept_encodings
+        if brotli is not None and aceptadas["br"]:
+            return "br"
+        if aceptadas["gzip"]:
+            return "gzip"
+        return None
+
+    def _codificar(self, datos: bytes, codificacion: str) -> bytes:
+        if codificacion == "br":
+            return brotli.compress(datos, quality=self.calidad_brotli)
+        return gzip.compress(datos, compresslevel=self.nivel_gzip)
+
+    def _codificar_cacheado(self, datos: bytes, codificacion: str) -> bytes:
+        clave = (hashlib.sha1(datos).hexdigest(), codificacion)
+        with self._lock:
+            previo = self._cache.get(clave)
+            if previo is not None:
+                self._cache.move_to_end(clave)
+                return previo
+        comprimido = self._codificar(datos, codificacion)
+        with self._lock:
+            self._cache[clave] = comprimido
+            while len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+        return comprimido
+
+    def comprimir(self, response):
+        from flask import request
+
+        if response.status_code != 200 or "Content-Encoding" in response.headers:
+            return response
+        if not (response.mimetype or "").startswith(TIPOS_COMPRIMIBLES):
+            return response
+        if response.is_streamed and not response.direct_passthrough:
+            return response
+        codificacion = self._elegir(request)
+        response.vary.add("Accept-Encoding")
+        if codificacion is None:
+            return response
+        # send_from_directory entrega el archivo sin leer; aquí se necesita el contenido
+        response.direct_passthrough = False
+        datos = response.get_data()
+        if len(datos) < self.minimo:
+            return response
+        if self._cachear(request.path):
+            comprimido = self._codificar_cacheado(datos, codificacion)
+        else:
+            comprimido = self._codificar(datos, codificacion)
+        if len(comprimido) >= len(datos):
+            return response
+        response.set_data(comprimido)
+        response.headers["Content-Encoding"] = codificacion
+        # Otra representación del mismo recurso: el ETag pasa a ser débil
+        etag, debil = response.get_etag()
+        if etag and not debil:
+            response.set_etag(etag, weak=True)
+        return response
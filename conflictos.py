@@ -0,0 +1,110 @@
+"""
+Conflictos de una importación de productos contra el inventario y dentro
+del propio archivo: códigos que ya existen (barra principal o alterna),
+códigos repetidos y nombres casi iguales (misma clave normalizada). Los
+códigos y nombres existentes se cargan una vez en diccionarios y el
+archivo se cruza de una pasada con búsquedas por hash. Los códigos se
+comparan con inventario_repo.normalizar_codigo, igual que en importar_lote,
+así la simulación anticipa lo que hará la importación real
+"""
+from typing import Dict, Iterable, List, Tuple
+
+from busqueda import normalizar
+from inventario_repo import normalizar_codigo
+
+# Elementos por lista en el informe; los totales siempre son completos
+MAX_ITEMS = 200
+
+
+def clave_nombre(nombre) -> str:
+    """Palabras normalizadas sin repetir y en orden: 'Coca-Cola 2L' y '2l coca cola' coinciden"""
+    return " ".join(sorted(set(normalizar(nombre).split())))
+
+
+class InventarioExistente:
+    """
+    Códigos (principales y alternos) y nombres del inventario, cargados una
+    vez: por_codigo {código normalizado: (id, código, "principal"|"alterna")}
+    y por_nombre {clave: (id, nombre, código)}
+    """
+
+    def __init__(self, productos: Iterable[Dict], alternas: Iterable[Tuple[int, str]]):
+        productos = list(productos)
+        self.nombres: Dict[int, str] = {p["id"]: p["nombre"] or "" for p in productos}
+        self.por_codigo: Dict[str, Tuple[int, str, str]] = {}
+        # Mismo orden de prioridad que importar_lote: la barra principal sobre
+        # una alterna equivalente y, entre productos, el de menor id
+        for pid, barra in sorted(alternas, key=lambda x: -x[0]):
+            self.por_codigo[normalizar_codigo(barra)] = (pid, barra, "alterna")
+        for p in sorted(productos, key=lambda p: -p["id"]):
+            if p["codigo"]:
+                self.por_codigo[normalizar_codigo(p["codigo"])] = (p["id"], p["codigo"], "principal")
+        self.por_nombre: Dict[str, Tuple[int, str, str]] = {}
+        for p in productos:
+            clave = clave_nombre(p["nombre"])
+            if clave:
+                self.por_nombre.setdefault(clave, (p["id"], p["nombre"], p["codigo"]))
+
+    @classmethod
+    def desde_repositorio(cls, repositorio) -> "InventarioExistente":
+        """Dos consultas: todos los productos y todas las barras alternas"""
+        return cls((p for p, _ in repositorio.todos()), repositorio.alternas())
+
+
+def _informe(codigos_repetidos: List[Dict], existentes: List[Dict], nombres_repetidos: List[Dict],
+             nombres_existentes: List[Dict], nuevos: int, actualizados: int) -> Dict:
+    def lista(items, orden):
+        items.sort(key=orden)
+        return {"total": len(items), "items": items[:MAX_ITEMS]}
+
+    return {
+        "resumen": {"nuevos": nuevos, "actualizados": actualizados},
+        "codigos_repetidos": lista(codigos_repetidos, lambda x: x["filas"][0]),
+        "codigos_existentes": lista(existentes, lambda x: x["fila"]),
+        "nombres_repetidos": lista(nombres_repetidos, lambda x: x["filas"][0]),
+        "nombres_existentes": lista(nombres_existentes, lambda x: x["fila"]),
+    }
+
+
+def detectar(filas: List[Tuple[int, str, str]], inventario: InventarioExistente) -> Dict:
+    """
+    Informe de conflictos de las filas (número, código, nombre):
+    resumen {nuevos, actualizados} por código distinto, codigos_repetidos,
+    codigos_existentes (con via y mismo_nombre), nombres_repetidos (misma
+    clave con códigos distintos) y nombres_existentes (nombre de otro
+    producto del inventario). Cada lista trae total e items (hasta MAX_ITEMS)
+    """
+    por_codigo: Dict[str, List[Tuple[int, str]]] = {}
+    por_clave: Dict[str, List[Tuple[int, str, str]]] = {}
+    existentes, nombres_existentes = [], []
+    for numero, codigo, nombre in filas:
+        norm, clave = normalizar_codigo(codigo), clave_nombre(nombre)
+        por_codigo.setdefault(norm, []).append((numero, codigo))
+        if clave:
+            por_clave.setdefault(clave, []).append((numero, codigo, norm))
+        actual = inventario.por_codigo.get(norm)
+        if actual is not None:
+            pid, codigo_actual, via = actual
+            nombre_actual = inventario.nombres.get(pid, "")
+            existentes.append({
+                "fila": numero, "codigo": codigo, "id": pid, "codigo_existente": codigo_actual, "via": via,
+                "nombre_nuevo": nombre, "nombre_actual": nombre_actual,
+                "mismo_nombre": clave == clave_nombre(nombre_actual),
+            })
+        parecido = inventario.por_nombre.get(clave) if clave else None
+        if parecido is not None and (actual is None or actual[0] != parecido[0]):
+            nombres_existentes.append({
+                "fila": numero, "nombre": nombre, "codigo": codigo,
+                "id": parecido[0], "nombre_existente": parecido[1], "codigo_existente": parecido[2],
+            })
+    codigos_repetidos = [
+        {"codigo": norm, "filas": [n for n, _ in vistas], "codigos": sorted({c for _, c in vistas})}
+        for norm, vistas in por_codigo.items() if len(vistas) > 1
+    ]
+    nombres_repetidos = [
+        {"nombre": clave, "filas": [n for n, _, _ in vistas], "codigos": sorted({c for _, c, _ in vistas})}
+        for clave, vistas in por_clave.items() if len({norm for _, _, norm in vistas}) > 1
+    ]
+    nuevos = sum(1 for norm in por_codigo if norm not in inventario.por_codigo)
+    return _informe(codigos_repetidos, existentes, nombres_repetidos, nombres_existentes,
+                    nuevos, len(por_codigo) - nuevos)
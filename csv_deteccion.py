@@ -0,0 +1,226 @@
+"""
+Detección de formato de archivos CSV de productos.
+Codificación, dialecto (delimitador, comillas) y columnas (codigo, nombre,
+precio, isv, stock, pesable) se detectan una vez por versión del archivo
+(ruta, mtime, tamaño) y quedan guardados. El archivo se lee con mmap y las
+filas se entregan de forma perezosa, sin cargar todo el texto en memoria.
+Lo usan las consultas al catálogo del proveedor y la importación de productos
+"""
+import codecs
+import csv
+import io
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DELIMITADORES = ",;\t|"
+COLUMNAS = ("codigo", "nombre", "precio", "isv", "stock", "pesable")
+
+# Bytes sin carácter asignado en cp1252: si aparecen, el archivo es latin1
+_CP1252_INDEFINIDOS = (b"\x81", b"\x8d", b"\x8f", b"\x90", b"\x9d")
+_BLOQUE = 1 << 20
+_MUESTRA = 2048
+
+
+class FormatoCSV:
+    """Resultado de la detección de un archivo"""
+
+    def __init__(self, codificacion: str, dialecto, encabezados: List[str], columnas: Dict[str, Optional[int]]):
+        self.codificacion = codificacion
+        self.dialecto = dialecto
+        self.encabezados = encabezados
+        self.columnas = columnas
+
+    @property
+    def minimo(self) -> int:
+        """Una fila con menos celdas que esto no tiene código y nombre"""
+        return max(self.columnas["codigo"], self.columnas["nombre"]) + 1
+
+
+def firma(ruta: str) -> Optional[Tuple[int, int]]:
+    """(mtime, tamaño) del archivo o None si no existe"""
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@contextmanager
+def mapear_archivo(f):
+    """Contenido de un archivo binario ya abierto como mmap (b"" si está vacío)"""
+    if os.fstat(f.fileno()).st_size == 0:
+        yield b""
+        return
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield mm
+    finally:
+        mm.close()
+
+
+@contextmanager
+def _mapear(ruta: str):
+    with open(ruta, "rb") as f, mapear_archivo(f) as buf:
+        yield buf
+
+
+def _codificacion(buf) -> str:
+    """utf-8 (con o sin BOM) si todo el contenido es válido; si no cp1252 o latin1"""
+    decodificador = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for i in range(0, len(buf), _BLOQUE):
+            decodificador.decode(buf[i:i + _BLOQUE])
+        decodificador.decode(b"", final=True)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        pass
+    if any(buf.find(b) != -1 for b in _CP1252_INDEFINIDOS):
+        return "latin1"
+    return "cp1252"
+
+
+def _dialecto(muestra: str):
+    try:
+        return csv.Sniffer().sniff(muestra, delimiters=DELIMITADORES)
+    except Exception:
+        # Sin delimitador reconocible se asume tabulador
+        return csv.excel_tab
+
+
+def detectar_columnas(encabezados: List[str]) -> Dict[str, Optional[int]]:
+    """Posición de cada dato según el texto de los encabezados (la última coincidencia gana)"""
+    cols = {"codigo": 0, "nombre": 1, "precio": None, "isv": None, "stock": None, "pesable": None}
+    for i, h in enumerate(str(h).lower().strip().replace("\ufeff", "") for h in encabezados):
+        if "codigo" in h or "barra" in h or "ean" in h:
+            cols["codigo"] = i
+        if "nombre" in h or "producto" in h:
+            cols["nombre"] = i
+        if "precio" in h or "price" in h or "valor" in h:
+            cols["precio"] = i
+        if "isv" in h or "iva" in h or "impuesto" in h:
+            cols["isv"] = i
+        if "stock" in h or "existencia" in h:
+            cols["stock"] = i
+        if "pesable" in h:
+            cols["pesable"] = i
+    return cols
+
+
+def _lineas(buf, codificacion: str) -> Iterator[str]:
+    lector = io.BytesIO(buf) if isinstance(buf, (bytes, bytearray)) else buf
+    lector.seek(0)
+    for linea in iter(lector.readline, b""):
+        yield linea.decode(codificacion, errors="replace")
+
+
+def formato_de(buf) -> FormatoCSV:
+    """Detecta el formato de un contenido ya en memoria (bytes o mmap)"""
+    codificacion = _codificacion(buf)
+    muestra = bytes(buf[:_MUESTRA]).decode(codificacion, errors="ignore")
+    dialecto = _dialecto(muestra)
+    try:
+        encabezados = next(csv.reader(_lineas(buf, codificacion), dialecto))
+    except StopIteration:
+        encabezados = []
+    return FormatoCSV(codificacion, dialecto, encabezados, detectar_columnas(encabezados))
+
+
+def filas_de(buf, formato: FormatoCSV) -> Iterator[Tuple[int, List[str]]]:
+    """(número de fila, celdas) de cada registro tras el encabezado; la fila 1 es el encabezado"""
+    lector = csv.reader(_lineas(buf, formato.codificacion), formato.dialecto)
+    next(lector, None)
+    for numero, row in enumerate(lector, start=2):
+        yield numero, row
+
+
+_formatos: Dict[str, Tuple[Tuple[int, int], FormatoCSV]] = {}
+_formatos_lock = threading.Lock()
+
+
+def detectar(ruta: str) -> Optional[FormatoCSV]:
+    """Formato del archivo, detectado una vez por versión (mtime, tamaño). None si no existe"""
+    version = firma(ruta)
+    if version is None:
+        _formatos.pop(ruta, None)
+        return None
+    previo = _formatos.get(ruta)
+    if previo and previo[0] == version:
+        return previo[1]
+    with _mapear(ruta) as buf:
+        formato = formato_de(buf)
+    with _formatos_lock:
+        _formatos[ruta] = (version, formato)
+    return formato
+
+
+def filas(ruta: str, formato: Optional[FormatoCSV] = None) -> Iterator[Tuple[int, List[str]]]:
+    """Filas del archivo leídas a demanda a través de mmap"""
+    formato = formato or detectar(ruta)
+    if formato is None:
+        return
+    with _mapear(ruta) as buf:
+        yield from filas_de(buf, formato)
+
+
+# --- Conversión de celdas a datos de producto ---
+def _celda(row: List[str], i: Optional[int]) -> Optional[str]:
+    if i is None or i >= len(row):
+        return None
+    return str(row[i]).strip()
+
+
+def convertir_precio(valor: Optional[str]) -> Optional[float]:
+    try:
+        return float(valor.replace(",", ".")) if valor is not None else None
+    except Exception:
+        return None
+
+
+def convertir_isv(valor: Optional[str]) -> Optional[int]:
+    v = (valor or "").lower()
+    if v in ("15", "15%", "1"):
+        return 1
+    if v in ("18", "18%", "2"):
+        return 2
+    if v in ("exento", "ex", "3", "0"):
+        return 3
+    return None
+
+
+def convertir_stock(valor: Optional[str]) -> Optional[int]:
+    try:
+        return int(valor) if valor is not None else None
+    except Exception:
+        return None
+
+
+def convertir_pesable(valor: Optional[str]) -> Optional[int]:
+    if valor is None:
+        return None
+    return 1 if valor.lower() in ("si", "sí", "true", "1", "y", "yes") else 0
+
+
+def registro(row: List[str], columnas: Dict[str, Optional[int]], fila: int) -> Dict:
+    """Fila como producto: codigo, nombre, precio, id_isv, stock, pesable y número de fila"""
+    return {
+        "codigo": _celda(row, columnas["codigo"]) or "",
+        "nombre": _celda(row, columnas["nombre"]) or "",
+        "precio": convertir_precio(_celda(row, columnas["precio"])),
+        "id_isv": convertir_isv(_celda(row, columnas["isv"])),
+        "stock": convertir_stock(_celda(row, columnas["stock"])),
+        "pesable": convertir_pesable(_celda(row, columnas["pesable"])),
+        "fila": fila,
+    }
+
+
+def registros(ruta: str) -> Iterator[Dict]:
+    """Productos del archivo, a demanda; se omiten las filas sin código y nombre"""
+    formato = detectar(ruta)
+    if formato is None:
+        return
+    for numero, row in filas(ruta, formato):
+        if len(row) >= formato.minimo:
+            yield registro(row, formato.columnas, numero)
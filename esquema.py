@@ -0,0 +1,56 @@
+"""
+Catálogo de esquema compartido por el proceso.
+Introspecciona cada tabla una sola vez (PRAGMA table_info / SHOW COLUMNS)
+y guarda sus columnas; solo se invalida cuando corre una migración
+"""
+import threading
+from typing import Dict, FrozenSet, Optional
+
+
+class CatalogoEsquema:
+    """Columnas memoizadas por tabla para un motor ("mysql" o "sqlite")"""
+
+    def __init__(self, motor: str):
+        if motor not in ("mysql", "sqlite"):
+            raise ValueError(f"Motor no soportado: {motor}")
+        self.motor = motor
+        self._columnas: Dict[str, FrozenSet[str]] = {}
+        self._lock = threading.Lock()
+
+    def _leer_columnas(self, conn, tabla: str) -> FrozenSet[str]:
+        cur = conn.cursor()
+        if self.motor == "mysql":
+            cur.execute(f"SHOW COLUMNS FROM {tabla}")
+            return frozenset(str(r[0]).lower() for r in cur.fetchall() if r)
+        cur.execute(f"PRAGMA table_info({tabla})")
+        return frozenset(str(r[1]).lower() for r in cur.fetchall() if r)
+
+    def columnas(self, conn, tabla: str) -> FrozenSet[str]:
+        """
+        Columnas de la tabla en minúsculas. Solo la primera llamada consulta
+        la base; si la introspección falla no se guarda nada y devuelve vacío
+        """
+        clave = tabla.lower()
+        cols = self._columnas.get(clave)
+        if cols is not None:
+            return cols
+        try:
+            cols = self._leer_columnas(conn, tabla)
+        except Exception:
+            return frozenset()
+        if not cols:
+            return cols
+        with self._lock:
+            self._columnas[clave] = cols
+        return cols
+
+    def tiene(self, conn, tabla: str, columna: str) -> bool:
+        return columna.lower() in self.columnas(conn, tabla)
+
+    def invalidar(self, tabla: Optional[str] = None):
+        """Olvida una tabla o todo el catálogo (tras aplicar migraciones)"""
+        with self._lock:
+            if tabla is None:
+                self._columnas.clear()
+            else:
+                self._columnas.pop(tabla.lower(), None)
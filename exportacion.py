@@ -0,0 +1,96 @@
+"""
+Exportación del inventario a CSV o XLSX en bloques, para entregarla como
+respuesta en streaming. Las filas llegan de un generador del repositorio y
+se escriben a medida que se leen: el CSV sale por trozos desde la primera
+fila; el XLSX se arma con openpyxl en modo write_only (las filas van a un
+temporal en disco) y se envía por trozos al cerrarlo
+"""
+import csv
+import io
+import tempfile
+from typing import Dict, Iterable, Iterator, List
+
+try:
+    import openpyxl
+except Exception:
+    openpyxl = None
+
+FORMATOS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+# Encabezados que la importación reconoce (csv_deteccion.detectar_columnas), así
+# el archivo exportado se puede volver a importar; "Alternas" no debe contener
+# "codigo" ni "barra" para no confundirse con la columna del código
+ENCABEZADOS = ("ID", "Codigo", "Nombre", "Precio", "ISV", "Stock", "Pesable", "Categoria", "Activo", "Alternas")
+# Mismas etiquetas que lee la importación (csv_deteccion.convertir_isv)
+ISV_TEXTO = {1: "15", 2: "18", 3: "exento"}
+SEPARADOR_BARRAS = "|"
+_BLOQUE = 64 * 1024
+
+
+def valores(producto: Dict) -> List:
+    return [
+        producto["id"],
+        producto["codigo"],
+        producto["nombre"],
+        producto["precio"],
+        ISV_TEXTO.get(producto["id_isv"], ""),
+        producto["stock"],
+        "si" if producto["pesable"] else "no",
+        producto.get("categoria") or "",
+        "si" if producto.get("activo", True) else "no",
+        SEPARADOR_BARRAS.join(b for b in producto.get("barras") or [] if b != producto["codigo"]),
+    ]
+
+
+def csv_en_bloques(productos: Iterable[Dict]) -> Iterator[bytes]:
+    """CSV en UTF-8 con BOM (Excel lo abre con acentos) en trozos de ~64 KB"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write("\ufeff")
+    escritor.writerow(ENCABEZADOS)
+    # El encabezado sale enseguida para que la descarga empiece sin esperar a la base
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    for producto in productos:
+        escritor.writerow(valores(producto))
+        if buffer.tell() >= _BLOQUE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def xlsx_en_bloques(productos: Iterable[Dict]) -> Iterator[bytes]:
+    """
+    XLSX con una hoja "Productos". openpyxl solo escribe el ZIP al guardar,
+    así que el primer trozo sale cuando se terminó de leer el inventario
+    """
+    if openpyxl is None:
+        raise RuntimeError("Exportación a XLSX no disponible (falta openpyxl)")
+    from openpyxl.cell import WriteOnlyCell
+
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet("Productos")
+    hoja.append(list(ENCABEZADOS))
+    for producto in productos:
+        fila = valores(producto)
+        # El código como texto: Excel mostraría los EAN en notación científica
+        codigo = WriteOnlyCell(hoja, value=fila[1])
+        codigo.number_format = "@"
+        fila[1] = codigo
+        hoja.append(fila)
+    with tempfile.TemporaryFile() as tmp:
+        libro.save(tmp)
+        tmp.seek(0)
+        while True:
+            bloque = tmp.read(_BLOQUE)
+            if not bloque:
+                break
+            yield bloque
+
+
+ESCRITORES = {"csv": csv_en_bloques, "xlsx": xlsx_en_bloques}
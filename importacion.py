@@ -0,0 +1,357 @@
+"""
+Lectura y validación de archivos de importación de productos (CSV, XLSX, XLS).
+Las filas se recorren una a una sin armar el archivo completo en memoria:
+el CSV se copia a un temporal y se lee por mmap con csv_deteccion, el XLSX
+con openpyxl en modo read_only y el XLS con xlrd (on_demand). Cada fila se
+revisa (formato del código de barras, nombre, precio, ISV, stock y códigos
+repetidos dentro del archivo) y el informe de errores queda acotado. Un
+dígito verificador GTIN que no cuadra es solo advertencia: muchos códigos
+internos numéricos tienen 8, 12, 13 o 14 dígitos y la fila se importa igual. Con el
+inventario existente se agrega el informe de conflictos (conflictos.detectar).
+La importación carga las filas válidas por lotes con importar_lote del repositorio
+"""
+import io
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import conflictos
+import csv_deteccion
+from inventario_repo import limpiar_codigo, normalizar_codigo
+
+try:
+    import openpyxl
+except Exception:
+    openpyxl = None
+try:
+    import xlrd
+except Exception:
+    xlrd = None
+
+FORMATOS = ("csv", "xlsx", "xls")
+MAX_ERRORES = 100
+FILAS_PREVIEW = 5
+TAMANO_LOTE = 500
+ISV_POR_DEFECTO = 3
+
+# Código interno o de barras: letras, dígitos, guion, punto o guion bajo
+_CODIGO_VALIDO = re.compile(r"[0-9A-Za-z][0-9A-Za-z._-]{0,49}")
+# Números que Excel guarda en notación científica: 7.50123E+12
+_NOTACION_CIENTIFICA = re.compile(r"\d+(\.\d+)?[eE][+-]?\d+")
+# Longitudes GTIN (EAN-8, UPC-A, EAN-13, GTIN-14) con dígito verificador
+_LONGITUDES_GTIN = (8, 12, 13, 14)
+
+
+class ArchivoInvalido(ValueError):
+    """El archivo no se puede leer como importación de productos"""
+
+
+class ImportacionInterrumpida(Exception):
+    """Falló un lote; `resultados` cuenta lo ya confirmado en los lotes anteriores"""
+
+    def __init__(self, resultados: Dict, causa: Exception):
+        super().__init__(str(causa))
+        self.resultados = resultados
+
+
+def formato_archivo(nombre: str) -> str:
+    extension = (nombre or "").rsplit(".", 1)[-1].lower() if "." in (nombre or "") else ""
+    if extension not in FORMATOS:
+        raise ArchivoInvalido("Formato no válido. Use CSV, XLS o XLSX.")
+    return extension
+
+
+def _texto(valor) -> str:
+    """Celda de Excel como texto; los números enteros sin el '.0'"""
+    if valor is None:
+        return ""
+    if isinstance(valor, bool):
+        return "1" if valor else "0"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor).strip()
+
+
+def _contar_lineas(buf) -> int:
+    total, pos = 0, buf.find(b"\n")
+    while pos != -1:
+        total += 1
+        pos = buf.find(b"\n", pos + 1)
+    return total
+
+
+# --- Lectura por formato: (encabezados, filas, filas estimadas) con las celdas como texto ---
+@contextmanager
+def _filas_csv(stream):
+    with tempfile.TemporaryFile() as tmp:
+        shutil.copyfileobj(stream, tmp, 1 << 20)
+        tmp.flush()
+        with csv_deteccion.mapear_archivo(tmp) as buf:
+            formato = csv_deteccion.formato_de(buf)
+            # Líneas menos el encabezado; un campo entre comillas con saltos de línea cuenta de más
+            yield formato.encabezados, csv_deteccion.filas_de(buf, formato), max(_contar_lineas(buf), 1) - 1
+
+
+@contextmanager
+def _filas_xlsx(stream):
+    if openpyxl is None:
+        raise ArchivoInvalido("Lectura de XLSX no disponible (falta openpyxl)")
+    try:
+        libro = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise ArchivoInvalido(f"No se pudo leer el XLSX: {e}")
+    try:
+        hoja = libro.active
+        # max_row sale de la dimensión declarada en el archivo (puede faltar)
+        estimadas = (hoja.max_row or 1) - 1
+        filas = hoja.iter_rows(values_only=True)
+        encabezados = [_texto(v) for v in next(filas, ())]
+        yield encabezados, ((numero, [_texto(v) for v in row]) for numero, row in enumerate(filas, start=2)), estimadas
+    finally:
+        libro.close()
+
+
+@contextmanager
+def _filas_xls(stream):
+    if xlrd is None:
+        raise ArchivoInvalido("Lectura de XLS no disponible (falta xlrd)")
+    try:
+        libro = xlrd.open_workbook(file_contents=stream.read(), on_demand=True)
+    except Exception as e:
+        raise ArchivoInvalido(f"No se pudo leer el XLS: {e}")
+    try:
+        hoja = libro.sheet_by_index(0)
+        encabezados = [_texto(v) for v in hoja.row_values(0)] if hoja.nrows else []
+        yield encabezados, ((i + 1, [_texto(v) for v in hoja.row_values(i)]) for i in range(1, hoja.nrows)), max(hoja.nrows - 1, 0)
+    finally:
+        libro.release_resources()
+
+
+_LECTORES = {"csv": _filas_csv, "xlsx": _filas_xlsx, "xls": _filas_xls}
+
+
+@contextmanager
+def abrir(stream, nombre: str):
+    """
+    (columnas detectadas, filas, filas estimadas) del archivo subido; las
+    filas son (número, celdas). La estimación sirve para mostrar progreso
+    """
+    formato = formato_archivo(nombre)
+    with _LECTORES[formato](stream) as (encabezados, filas, estimadas):
+        columnas = csv_deteccion.detectar_columnas(encabezados)
+        if not encabezados:
+            raise ArchivoInvalido("El archivo está vacío")
+        if columnas["precio"] is None:
+            raise ArchivoInvalido("El archivo no tiene columna de precio")
+        yield columnas, filas, estimadas
+
+
+# --- Revisión de filas ---
+def _celda(row: List[str], i: Optional[int]) -> str:
+    if i is None or i >= len(row):
+        return ""
+    return (row[i] or "").strip()
+
+
+def digito_verificador_valido(codigo: str) -> bool:
+    """Dígito verificador GS1 (módulo 10) de un GTIN numérico"""
+    digitos = [int(c) for c in codigo]
+    suma = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(digitos[:-1])))
+    return (10 - suma % 10) % 10 == digitos[-1]
+
+
+def revisar_codigo(codigo: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """(código normalizado, error o None, advertencia o None)"""
+    codigo = limpiar_codigo(codigo)
+    if not codigo:
+        return codigo, "código de barras vacío", None
+    if _NOTACION_CIENTIFICA.fullmatch(codigo):
+        return codigo, f"código '{codigo}' en notación científica (formatee la columna como texto)", None
+    if not _CODIGO_VALIDO.fullmatch(codigo):
+        return codigo, f"código '{codigo}' con caracteres no válidos", None
+    if codigo.isdigit() and len(codigo) in _LONGITUDES_GTIN and not digito_verificador_valido(codigo):
+        return codigo, None, f"código '{codigo}' no tiene dígito verificador GTIN válido (se importa como código interno)"
+    return codigo, None, None
+
+
+def _entero(valor: str) -> Optional[int]:
+    try:
+        numero = float(valor.replace(",", "."))
+    except Exception:
+        return None
+    return int(numero) if numero.is_integer() else None
+
+
+def revisar_fila(row: List[str], columnas: Dict[str, Optional[int]]) -> Tuple[Dict, List[str], List[str]]:
+    """
+    Producto de la fila (codigo, nombre, precio, id_isv, stock, pesable), la
+    lista de errores y la de advertencias (no impiden importar la fila).
+    stock y pesable quedan en None si la celda está vacía
+    """
+    errores = []
+    codigo, error, advertencia = revisar_codigo(_celda(row, columnas["codigo"]))
+    if error:
+        errores.append(error)
+    nombre = _celda(row, columnas["nombre"])
+    if not nombre:
+        errores.append("nombre vacío")
+    texto = _celda(row, columnas["precio"])
+    precio = csv_deteccion.convertir_precio(texto)
+    if precio is None:
+        errores.append(f"precio '{texto}' no válido" if texto else "precio vacío")
+    elif precio <= 0:
+        errores.append("el precio debe ser mayor que 0")
+    texto = _celda(row, columnas["isv"])
+    id_isv = csv_deteccion.convertir_isv(texto) if texto else ISV_POR_DEFECTO
+    if id_isv is None:
+        errores.append(f"ISV '{texto}' no válido (15, 18 o exento)")
+    texto = _celda(row, columnas["stock"])
+    stock = _entero(texto) if texto else None
+    if texto and stock is None:
+        errores.append(f"stock '{texto}' no válido")
+    texto = _celda(row, columnas["pesable"])
+    pesable = csv_deteccion.convertir_pesable(texto) if texto else None
+    datos = {"codigo": codigo, "nombre": nombre, "precio": precio, "id_isv": id_isv, "stock": stock, "pesable": pesable}
+    return datos, errores, [advertencia] if advertencia else []
+
+
+def productos(columnas: Dict[str, Optional[int]], filas) -> Iterator[Tuple[int, Dict, List[str], List[str]]]:
+    """
+    (número de fila, producto, errores, advertencias) de cada fila con datos;
+    las filas en blanco se omiten. Un código ya visto en una fila anterior
+    (con normalizar_codigo, como lo compara la importación) es error
+    """
+    vistos: Dict[str, int] = {}
+    for numero, row in filas:
+        if not any(c.strip() for c in row if c):
+            continue
+        datos, errores, advertencias = revisar_fila(row, columnas)
+        codigo = datos["codigo"]
+        if codigo and not errores:
+            previa = vistos.setdefault(normalizar_codigo(codigo), numero)
+            if previa != numero:
+                errores.append(f"código '{codigo}' repetido (ya está en la fila {previa})")
+        yield numero, datos, errores, advertencias
+
+
+def validar(stream, nombre: str, max_errores: int = MAX_ERRORES, filas_preview: int = FILAS_PREVIEW,
+            inventario: Optional[conflictos.InventarioExistente] = None) -> Dict:
+    """
+    Recorre todo el archivo y devuelve {valido, errores, total_errores,
+    advertencias, total_advertencias, total_filas, preview}. `errores` y
+    `advertencias` traen como mucho `max_errores` textos "Fila N: ...";
+    las advertencias no cuentan para `valido`. `preview` son las primeras
+    filas ya interpretadas. Con
+    `inventario` agrega `conflictos`, calculado sobre las filas válidas
+    (las que se importarían) al terminar de leer el archivo
+    """
+    errores: List[str] = []
+    advertencias: List[str] = []
+    total_errores = 0
+    total_advertencias = 0
+    total_filas = 0
+    preview: List[Dict] = []
+    validas: List[Tuple[int, str, str]] = []
+    with abrir(stream, nombre) as (columnas, filas, _):
+        for numero, datos, problemas, avisos in productos(columnas, filas):
+            total_filas += 1
+            if len(preview) < filas_preview:
+                preview.append(datos)
+            total_advertencias += len(avisos)
+            for aviso in avisos:
+                if len(advertencias) < max_errores:
+                    advertencias.append(f"Fila {numero}: {aviso}")
+            if problemas:
+                total_errores += len(problemas)
+                for problema in problemas:
+                    if len(errores) < max_errores:
+                        errores.append(f"Fila {numero}: {problema}")
+            elif inventario is not None:
+                validas.append((numero, datos["codigo"], datos["nombre"]))
+    if total_filas == 0:
+        raise ArchivoInvalido("El archivo no tiene productos")
+    resultado = {
+        "valido": total_errores == 0,
+        "errores": errores,
+        "total_errores": total_errores,
+        "advertencias": advertencias,
+        "total_advertencias": total_advertencias,
+        "total_filas": total_filas,
+        "preview": preview,
+    }
+    if inventario is not None:
+        resultado["conflictos"] = conflictos.detectar(validas, inventario)
+    return resultado
+
+
+def importar(stream, nombre: str, repositorio, tamano_lote: int = TAMANO_LOTE,
+             max_errores: int = MAX_ERRORES, progreso: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+    """
+    Carga las filas válidas en lotes de `tamano_lote` (una transacción por
+    lote) y omite las que tienen errores. Devuelve {insertados, actualizados,
+    omitidos, errores, advertencias, detalle}: errores y advertencias son el
+    número de problemas (las filas con advertencias se importan) y detalle
+    los primeros `max_errores` textos "Fila N: ..." de los errores.
+    Tras cada lote llama progreso(filas leídas, filas estimadas, resultados);
+    si progreso lanza una excepción la importación se detiene ahí, con los
+    lotes anteriores ya confirmados
+    """
+    resultados = {"insertados": 0, "actualizados": 0, "omitidos": 0, "errores": 0, "advertencias": 0, "detalle": []}
+    lote: List[Dict] = []
+    leidas = 0
+
+    def cargar():
+        try:
+            hecho = repositorio.importar_lote(lote)
+        except Exception as e:
+            raise ImportacionInterrumpida(resultados, e) from e
+        resultados["insertados"] += hecho["insertados"]
+        resultados["actualizados"] += hecho["actualizados"]
+        lote.clear()
+        if progreso is not None:
+            progreso(leidas, estimadas, resultados)
+
+    with abrir(stream, nombre) as (columnas, filas, estimadas):
+        for numero, datos, problemas, avisos in productos(columnas, filas):
+            leidas += 1
+            resultados["advertencias"] += len(avisos)
+            if problemas:
+                resultados["omitidos"] += 1
+                resultados["errores"] += len(problemas)
+                for problema in problemas:
+                    if len(resultados["detalle"]) < max_errores:
+                        resultados["detalle"].append(f"Fila {numero}: {problema}")
+                continue
+            lote.append(datos)
+            if len(lote) >= tamano_lote:
+                cargar()
+        if lote:
+            cargar()
+        elif progreso is not None:
+            progreso(leidas, estimadas, resultados)
+    return resultados
+
+
+PLANTILLA_ENCABEZADOS = ("Codigo", "Nombre", "Precio", "ISV", "Stock", "Pesable")
+PLANTILLA_EJEMPLO = ("7501234567893", "Café Molido 400g", 85.5, "15", 24, "no")
+
+
+def plantilla_xlsx() -> bytes:
+    """Plantilla de importación con una fila de ejemplo; la columna de código va como texto"""
+    if openpyxl is None:
+        raise ArchivoInvalido("Generación de XLSX no disponible (falta openpyxl)")
+    from openpyxl.cell import WriteOnlyCell
+
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet("Productos")
+    hoja.column_dimensions["A"].width = 18
+    hoja.column_dimensions["B"].width = 36
+    hoja.append(list(PLANTILLA_ENCABEZADOS))
+    codigo = WriteOnlyCell(hoja, value=PLANTILLA_EJEMPLO[0])
+    codigo.number_format = "@"
+    hoja.append([codigo, *PLANTILLA_EJEMPLO[1:]])
+    salida = io.BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
@@ -0,0 +1,144 @@
+"""
+Índice en memoria para resolver códigos escaneados.
+Mapea cada barra principal, cada barra alterna (inventario_barras) y el id
+numérico (000123 -> 123) a un registro compacto del producto. Se carga al arrancar y
+se actualiza con los avisos del repositorio de inventario
+"""
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from inventario_repo import codigo_a_id
+
+# Orden de los campos del registro compacto (tupla)
+CAMPOS = ("id", "codigo", "nombre", "precio", "id_isv", "stock", "pesable", "id_categoria")
+_STOCK = CAMPOS.index("stock")
+
+
+class IndiceProductos:
+    """
+    Resolución código -> producto activo sin tocar la base. La prioridad es
+    la misma que en el repositorio: barra principal, barra alterna, id.
+    Tras `ttl` segundos se recarga en segundo plano para recoger cambios de
+    otros procesos; mientras tanto sigue respondiendo con la copia actual
+    """
+
+    def __init__(self, repositorio, ttl: float = 300.0):
+        self._repo = repositorio
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._productos: Dict[int, Tuple] = {}
+        self._activos: Set[int] = set()
+        self._por_barra: Dict[str, int] = {}
+        self._por_alterna: Dict[str, int] = {}
+        self._alternas_de: Dict[int, Set[str]] = {}
+        self._cargado = 0.0
+        self._recargando = False
+        repositorio.suscribir(self._al_cambiar)
+
+    @property
+    def cargado(self) -> bool:
+        return self._cargado > 0
+
+    def cargar(self):
+        """Carga completa; construye estructuras nuevas y las publica de una vez"""
+        productos, activos, por_barra, por_alterna, alternas_de = {}, set(), {}, {}, {}
+        for p, activo in self._repo.todos():
+            pid = p["id"]
+            productos[pid] = tuple(p[c] for c in CAMPOS)
+            if activo:
+                activos.add(pid)
+            barra = p["codigo"]
+            # Con barras repetidas gana la fila activa
+            if barra and (barra not in por_barra or (activo and por_barra[barra] not in activos)):
+                por_barra[barra] = pid
+        for pid, barra in self._repo.alternas():
+            por_alterna.setdefault(barra, pid)
+            alternas_de.setdefault(pid, set()).add(barra)
+        with self._lock:
+            self._productos, self._activos = productos, activos
+            self._por_barra, self._por_alterna, self._alternas_de = por_barra, por_alterna, alternas_de
+            self._cargado = time.monotonic()
+
+    def _recargar_en_segundo_plano(self):
+        with self._lock:
+            if self._recargando:
+                return
+            self._recargando = True
+
+        def tarea():
+            try:
+                self.cargar()
+            except Exception:
+                pass
+            finally:
+                self._recargando = False
+
+        threading.Thread(target=tarea, name="recarga-indice-productos", daemon=True).start()
+
+    def obtener(self, codigo: str) -> Optional[Dict]:
+        """Producto activo para el código o None (None también si el índice aún no se cargó)"""
+        if not self._cargado:
+            self._recargar_en_segundo_plano()
+            return None
+        if time.monotonic() - self._cargado > self.ttl:
+            self._recargar_en_segundo_plano()
+        codigo = str(codigo).strip()
+        for pid in (self._por_barra.get(codigo), self._por_alterna.get(codigo)):
+            if pid is not None and pid in self._activos:
+                return dict(zip(CAMPOS, self._productos[pid]))
+        pid = codigo_a_id(codigo)
+        if pid is not None and pid in self._activos:
+            return dict(zip(CAMPOS, self._productos[pid]))
+        return None
+
+    def ficha(self, pid: int) -> Optional[Dict]:
+        """Producto activo por id, con el stock al día"""
+        producto = self._productos.get(pid)
+        if producto is None or pid not in self._activos:
+            return None
+        return dict(zip(CAMPOS, producto))
+
+    def refrescar(self, ids: Iterable[int]):
+        """Vuelve a leer los productos indicados y sus barras alternas"""
+        ids = [int(x) for x in ids]
+        if not ids or not self._cargado:
+            return
+        filas = self._repo.todos(ids)
+        alternas = self._repo.alternas(ids)
+        with self._lock:
+            for pid in ids:
+                previo = self._productos.pop(pid, None)
+                self._activos.discard(pid)
+                if previo and self._por_barra.get(previo[1]) == pid:
+                    del self._por_barra[previo[1]]
+                for barra in self._alternas_de.pop(pid, set()):
+                    if self._por_alterna.get(barra) == pid:
+                        del self._por_alterna[barra]
+            for p, activo in filas:
+                pid = p["id"]
+                self._productos[pid] = tuple(p[c] for c in CAMPOS)
+                if activo:
+                    self._activos.add(pid)
+                if p["codigo"]:
+                    self._por_barra[p["codigo"]] = pid
+            for pid, barra in alternas:
+                self._por_alterna[barra] = pid
+                self._alternas_de.setdefault(pid, set()).add(barra)
+
+    def _aplicar_stock(self, cambios: Dict[int, float]):
+        with self._lock:
+            for pid, delta in cambios.items():
+                previo = self._productos.get(pid)
+                if previo is None:
+                    continue
+                stock = (previo[_STOCK] or 0) + delta
+                self._productos[pid] = previo[:_STOCK] + (int(stock),) + previo[_STOCK + 1:]
+
+    def _al_cambiar(self, evento: str, datos):
+        if evento == "stock":
+            self._aplicar_stock(datos)
+        elif evento == "productos":
+            self.refrescar(datos)
+        elif evento == "todo" and self._cargado:
+            self.cargar()
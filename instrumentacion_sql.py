@@ -0,0 +1,161 @@
+"""
+Instrumentación de SQL por petición.
+Envuelve los cursores de MySQL (conexiones del pool) y de SQLite para contar
+sentencias, sumar el tiempo en base de datos y guardar las más lentas; las
+que superan el umbral se escriben en un log de consultas lentas
+"""
+import heapq
+import logging
+import sqlite3
+import time
+from typing import Callable, List, Optional, Tuple
+
+
+class EstadisticasPeticion:
+    """Contadores de SQL de una petición"""
+
+    def __init__(self, max_lentas: int = 5):
+        self.consultas = 0
+        self.tiempo_ms = 0.0
+        self._max_lentas = max_lentas
+        self._lentas: List[Tuple[float, int, str]] = []
+
+    def agregar(self, sql: str, ms: float):
+        self.consultas += 1
+        self.tiempo_ms += ms
+        item = (ms, self.consultas, sql)
+        if len(self._lentas) < self._max_lentas:
+            heapq.heappush(self._lentas, item)
+        elif ms > self._lentas[0][0]:
+            heapq.heapreplace(self._lentas, item)
+
+    def lentas(self) -> List[Tuple[float, str]]:
+        """Las sentencias más lentas, de mayor a menor"""
+        return [(ms, sql) for ms, _, sql in sorted(self._lentas, reverse=True)]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.tiempo_ms:.1f};desc="{self.consultas} consultas"'
+
+
+def _compactar(sql) -> str:
+    return " ".join(str(sql).split())
+
+
+class MedidorSQL:
+    """
+    Recibe cada sentencia medida. `actual` devuelve las estadísticas de la
+    petición en curso (o None fuera de una petición) y `contexto` una etiqueta
+    para el log (p. ej. "POST /api/registrar-venta")
+    """
+
+    def __init__(self, actual: Callable[[], Optional[EstadisticasPeticion]], umbral_ms: float = 200.0,
+                 ruta_log: Optional[str] = None, contexto: Optional[Callable[[], str]] = None):
+        self._actual = actual
+        self._contexto = contexto
+        self.umbral_ms = float(umbral_ms)
+        self._log = logging.getLogger("consultas_lentas")
+        if ruta_log and not self._log.handlers:
+            manejador = logging.FileHandler(ruta_log, encoding="utf-8")
+            manejador.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._log.addHandler(manejador)
+            self._log.setLevel(logging.INFO)
+            self._log.propagate = False
+
+    def registrar(self, sql, ms: float):
+        stats = self._actual()
+        if stats is not None:
+            stats.agregar(_compactar(sql), ms)
+        if ms >= self.umbral_ms:
+            try:
+                ctx = self._contexto() if self._contexto else ""
+            except Exception:
+                ctx = ""
+            self._log.info("%.1fms %s %s", ms, ctx or "-", _compactar(sql)[:2000])
+
+    def registrar_peticion(self, stats: EstadisticasPeticion):
+        """Si la petición completa pasó el umbral, deja su resumen y sus sentencias más lentas"""
+        if stats is None or stats.tiempo_ms < self.umbral_ms:
+            return
+        try:
+            ctx = self._contexto() if self._contexto else ""
+        except Exception:
+            ctx = ""
+        detalle = " | ".join(f"{ms:.1f}ms {sql[:300]}" for ms, sql in stats.lentas())
+        self._log.info("peticion %s: %d consultas, %.1fms en BD; mas lentas: %s",
+                       ctx or "-", stats.consultas, stats.tiempo_ms, detalle)
+
+
+class CursorMedido:
+    """Cursor MySQL que mide execute/executemany y delega el resto"""
+
+    def __init__(self, cursor, medidor: MedidorSQL):
+        self._cursor = cursor
+        self._medidor = medidor
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, *args, **kwargs)
+        finally:
+            self._medidor.registrar(sql, (time.perf_counter() - inicio) * 1000.0)
+
+    def executemany(self, sql, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, *args, **kwargs)
+        finally:
+            self._medidor.registrar(sql, (time.perf_counter() - inicio) * 1000.0)
+
+
+class ConexionMedida:
+    """Conexión MySQL cuyos cursores quedan medidos"""
+
+    def __init__(self, conn, medidor: MedidorSQL):
+        self._conn = conn
+        self._medidor = medidor
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+    def cursor(self, *args, **kwargs):
+        return CursorMedido(self._conn.cursor(*args, **kwargs), self._medidor)
+
+
+class CursorSQLiteMedido(sqlite3.Cursor):
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            self.connection.medidor.registrar(sql, (time.perf_counter() - inicio) * 1000.0)
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            self.connection.medidor.registrar(sql, (time.perf_counter() - inicio) * 1000.0)
+
+
+class ConexionSQLiteMedida(sqlite3.Connection):
+    """
+    Usar como sqlite3.connect(..., factory=ConexionSQLiteMedida) y asignar
+    `medidor`. Connection.execute no pasa por cursor(), así que se redefine
+    """
+
+    medidor: MedidorSQL = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or CursorSQLiteMedido)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
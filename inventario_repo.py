@@ -0,0 +1,763 @@
+"""
+Repositorio de inventario con backends intercambiables (MySQL o SQLite).
+Los endpoints de productos hablan con una sola interfaz; el backend se elige
+al arrancar y las operaciones por lote (bulk_get, bulk_update_stock,
+importar_lote) forman parte del contrato para que caché, lotes e
+instrumentación vivan en un solo lugar
+"""
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from mysql_pool import cursor_servidor
+
+# Columnas que devuelve el repositorio, en este orden
+COLUMNAS = ("id", "barra", "nombre", "precio", "id_isv", "stock", "pesable", "id_categoria")
+# Columnas que se pueden escribir al crear/actualizar
+COLUMNAS_ESCRITURA = ("barra", "nombre", "precio", "id_isv", "stock", "pesable", "id_categoria")
+# Columnas que escribe la importación; las de CONSERVAR_SI_VACIO en None
+# conservan el valor actual o, en un producto nuevo, toman el indicado
+COLUMNAS_IMPORTACION = ("nombre", "precio", "id_isv", "stock", "pesable")
+CONSERVAR_SI_VACIO = {"stock": 0, "pesable": 0}
+
+# producto_id de inventario_cambios que obliga a los terminales a resincronizar todo
+CAMBIO_TOTAL = 0
+
+# Números que Excel guarda como flotantes (7501234567890.0) y códigos GTIN
+_ENTERO_FLOTANTE = re.compile(r"(\d+)\.0*")
+_LARGO_GTIN = (8, 14)
+# Códigos por consulta al resolver un lote (cada uno con sus equivalentes)
+_CODIGOS_POR_CONSULTA = 200
+
+FILTROS_ESTADO = {
+    "activos": " AND (activo IS NULL OR activo = 1)",
+    "inactivos": " AND activo = 0",
+}
+
+
+class CodigoDuplicado(Exception):
+    """El código de barras ya pertenece a otro producto"""
+
+
+def _fila(r) -> Dict:
+    return {
+        "id": int(r[0]) if r[0] is not None else None,
+        "codigo": str(r[1] or ""),
+        "nombre": r[2],
+        "precio": float(r[3]) if r[3] is not None else None,
+        "id_isv": int(r[4]) if r[4] is not None else None,
+        "stock": int(r[5]) if r[5] is not None else None,
+        "pesable": int(r[6]) if r[6] is not None else None,
+        "id_categoria": int(r[7]) if r[7] is not None else None,
+    }
+
+
+def codigo_a_id(codigo: str, cualquier_largo: bool = False) -> Optional[int]:
+    """
+    Un código numérico de 6 dígitos también identifica al producto por id
+    (000123 -> 123). Con cualquier_largo vale cualquier número (7 -> 7), para
+    los llamadores que reciben ids y no códigos escaneados
+    """
+    codigo = str(codigo).strip()
+    if codigo.isdigit() and (cualquier_largo or len(codigo) == 6):
+        return int(codigo)
+    return None
+
+
+def limpiar_codigo(codigo) -> str:
+    """Código tal como se guarda: sin espacios y sin el '.0' de las celdas numéricas de Excel"""
+    codigo = str(codigo if codigo is not None else "").strip()
+    m = _ENTERO_FLOTANTE.fullmatch(codigo)
+    return m.group(1) if m else codigo
+
+
+def normalizar_codigo(codigo) -> str:
+    """
+    Clave con la que la importación compara códigos: el código limpio y, si
+    tiene de 8 a 14 dígitos (GTIN), con ceros a la izquierda hasta 14.
+    UPC-A 012345678905 y EAN-13 0012345678905 son el mismo producto
+    """
+    codigo = limpiar_codigo(codigo)
+    if codigo.isdigit() and _LARGO_GTIN[0] <= len(codigo) <= _LARGO_GTIN[1]:
+        return codigo.zfill(_LARGO_GTIN[1])
+    return codigo
+
+
+def codigos_equivalentes(codigo) -> List[str]:
+    """Todas las escrituras con la misma clave que `codigo` (para buscarlas con IN)"""
+    clave = normalizar_codigo(codigo)
+    if not (clave.isdigit() and len(clave) == _LARGO_GTIN[1]):
+        return [clave]
+    minimo = max(_LARGO_GTIN[0], len(clave.lstrip("0")))
+    return [clave[-n:] for n in range(minimo, _LARGO_GTIN[1] + 1)]
+
+
+def _marcas(n: int) -> str:
+    return ", ".join(["?"] * n)
+
+
+class InventoryRepository(ABC):
+    """
+    Interfaz común. Las consultas se escriben con `?` y cada backend las
+    adapta a su estilo de parámetros. Todos los métodos aceptan `conn` para
+    unirse a una transacción abierta por el llamador; sin ella el repositorio
+    abre, confirma y libera su propia conexión. Los métodos abstractos son
+    lo que cada backend debe implementar; si falta alguno el repositorio no
+    se puede crear
+    """
+
+    motor = ""
+
+    # Segundos que vale un total cacheado (recoge escrituras de otros procesos)
+    ttl_conteo = 60.0
+
+    def __init__(self, conectar: Callable, catalogo):
+        self._conectar = conectar
+        self._catalogo = catalogo
+        self._suscriptores: List[Callable] = []
+        # (q, estado, categoria) -> (total, momento); se vacía con cada escritura de productos
+        self._conteos: Dict[Tuple, Tuple[int, float]] = {}
+        self._conteos_lock = threading.Lock()
+
+    def suscribir(self, fn: Callable) -> Callable:
+        """
+        Registra fn(evento, datos) que se llama tras cada escritura (si se pasó
+        `conn`, antes del commit del llamador): ("productos", [ids]) cuando
+        cambian filas o barras, ("stock", {id: delta}) y ("todo", None) cuando
+        no se sabe qué cambió
+        """
+        self._suscriptores.append(fn)
+        return fn
+
+    def _avisar(self, evento: str, datos):
+        if evento in ("productos", "todo"):
+            with self._conteos_lock:
+                self._conteos.clear()
+        for fn in self._suscriptores:
+            try:
+                fn(evento, datos)
+            except Exception:
+                pass
+
+    def avisar_cambios(self, ids: Optional[Iterable[int]] = None):
+        """Para escrituras hechas fuera del repositorio: los ids afectados, o None si pudo cambiar todo"""
+        ids = None if ids is None else [int(x) for x in ids]
+        with self._conexion(escribir=True) as c:
+            self._registrar_cambios(c, [CAMBIO_TOTAL] if ids is None else ids)
+        if ids is None:
+            self._avisar("todo", None)
+        else:
+            self._avisar("productos", ids)
+
+    # --- registro de cambios (sincronización de terminales) ---
+    def _registrar_cambios(self, c, ids: Iterable[int]):
+        """Anota los ids en inventario_cambios dentro de la misma transacción que la escritura"""
+        ids = list(ids)
+        if not ids or not self._catalogo.columnas(c, "inventario_cambios"):
+            return
+        valores = ", ".join(["(?)"] * len(ids))
+        self._ejecutar(c, f"INSERT INTO inventario_cambios (producto_id) VALUES {valores}", ids)
+
+    def version_catalogo(self, conn=None) -> int:
+        """Última versión registrada en inventario_cambios (0 si no hay)"""
+        with self._conexion(conn) as c:
+            return int(self._ejecutar(c, "SELECT MAX(version) FROM inventario_cambios").fetchone()[0] or 0)
+
+    def cambios_desde(self, version: int, conn=None) -> Tuple[int, Optional[List[int]]]:
+        """
+        (versión actual, ids que cambiaron después de `version`). ids es None
+        si entre medias hubo un cambio que obliga a resincronizar todo
+        """
+        with self._conexion(conn) as c:
+            rows = self._ejecutar(
+                c, "SELECT producto_id, MAX(version) FROM inventario_cambios WHERE version > ? GROUP BY producto_id",
+                (int(version),)
+            ).fetchall()
+            actual = int(self._ejecutar(c, "SELECT MAX(version) FROM inventario_cambios").fetchone()[0] or 0)
+        ids = [int(r[0]) for r in rows]
+        if CAMBIO_TOTAL in ids:
+            return actual, None
+        return actual, ids
+
+    @abstractmethod
+    def compactar_cambios(self, conn=None) -> int:
+        """Deja solo el último cambio de cada producto; basta para calcular cualquier delta"""
+
+    # --- plumbing por backend ---
+    def _sql(self, sql: str) -> str:
+        return sql
+
+    @abstractmethod
+    def _conexion(self, conn=None, escribir: bool = False):
+        """
+        Context manager con la conexión: `conn` si la pasó el llamador o una
+        propia que se confirma (con `escribir`) y se libera al salir
+        """
+
+    def _ejecutar(self, conn, sql: str, params: Iterable = ()):
+        cur = conn.cursor()
+        cur.execute(self._sql(sql), tuple(params))
+        return cur
+
+    def _select(self, conn, alias: str = "") -> str:
+        return ", ".join(alias + c for c in COLUMNAS)
+
+    def _columnas_escritura(self, conn, datos: Dict) -> List[str]:
+        return [c for c in COLUMNAS_ESCRITURA if c in datos]
+
+    def _bloqueo(self) -> str:
+        return ""
+
+    def _cursor_recorrido(self, conn):
+        """Cursor para recorrer resultados grandes sin cargarlos completos"""
+        return conn.cursor()
+
+    # --- lecturas ---
+    def get_by_id(self, pid: int, solo_activos: bool = False, conn=None) -> Optional[Dict]:
+        with self._conexion(conn) as c:
+            filtro = FILTROS_ESTADO["activos"] if solo_activos else ""
+            r = self._ejecutar(c, f"SELECT {self._select(c)} FROM inventario WHERE id = ?{filtro}", (int(pid),)).fetchone()
+            return _fila(r) if r else None
+
+    def _consulta_resolver(self, c, codigos: List[str], solo_activos: bool, bloquear: bool = False,
+                           id_cualquier_largo: bool = False) -> Tuple[str, List]:
+        ids = sorted({i for i in (codigo_a_id(x, id_cualquier_largo) for x in codigos) if i is not None})
+        marcas = _marcas(len(codigos))
+        partes = [
+            f"SELECT barra AS codigo, 1 AS prioridad, id FROM inventario WHERE barra IN ({marcas})",
+            f"SELECT barra, 2, producto_id FROM inventario_barras WHERE barra IN ({marcas})",
+        ]
+        params: List = [*codigos, *codigos]
+        if ids:
+            partes.append(f"SELECT NULL, 3, id FROM inventario WHERE id IN ({_marcas(len(ids))})")
+            params.extend(ids)
+        sql = (f"SELECT r.codigo, r.prioridad, {self._select(c, 'i.')}, i.activo "
+               f"FROM ({' UNION ALL '.join(partes)}) r JOIN inventario i ON i.id = r.id")
+        if solo_activos:
+            sql += " WHERE (i.activo IS NULL OR i.activo = 1)"
+        if bloquear:
+            sql += self._bloqueo()
+        return sql, params
+
+    def _resolver(self, c, codigos: List[str], solo_activos: bool, bloquear: bool = False,
+                  id_cualquier_largo: bool = False) -> Dict[str, Tuple[Dict, bool]]:
+        """
+        Resuelve los códigos en una sola consulta con la prioridad: barra
+        principal, barra alterna, id numérico (ver codigo_a_id).
+        Devuelve {codigo: (producto, activo)}
+        """
+        sql, params = self._consulta_resolver(c, codigos, solo_activos, bloquear, id_cualquier_largo)
+        mejor: Dict[str, Tuple[int, Dict, bool]] = {}
+        por_id: Dict[int, Tuple[Dict, bool]] = {}
+        for r in self._ejecutar(c, sql, params).fetchall():
+            r = tuple(r)
+            fila, activo = _fila(r[2:10]), r[10] is None or int(r[10]) == 1
+            if r[0] is None:
+                por_id[fila["id"]] = (fila, activo)
+                continue
+            codigo, prioridad = str(r[0]), int(r[1])
+            if codigo not in mejor or prioridad < mejor[codigo][0]:
+                mejor[codigo] = (prioridad, fila, activo)
+        resultado = {}
+        for codigo in codigos:
+            if codigo in mejor:
+                resultado[codigo] = mejor[codigo][1:]
+            else:
+                pid = codigo_a_id(codigo, id_cualquier_largo)
+                if pid in por_id:
+                    resultado[codigo] = por_id[pid]
+        return resultado
+
+    def get_by_code(self, codigo: str, solo_activos: bool = True, id_cualquier_largo: bool = False,
+                    conn=None) -> Optional[Dict]:
+        """
+        Producto para un código escaneado o tecleado (una sola consulta). Por
+        id solo con 6 dígitos, salvo id_cualquier_largo (ver codigo_a_id)
+        """
+        codigo = str(codigo).strip()
+        if not codigo:
+            return None
+        with self._conexion(conn) as c:
+            encontrado = self._resolver(c, [codigo], solo_activos, id_cualquier_largo=id_cualquier_largo).get(codigo)
+            return encontrado[0] if encontrado else None
+
+    def _filtro_busqueda(self, q: str, estado: str, categoria: Optional[int]) -> Tuple[str, List]:
+        where = " WHERE 1=1" + FILTROS_ESTADO.get(estado, "")
+        params: List = []
+        if q:
+            where += " AND (nombre LIKE ? OR barra = ?)"
+            params.extend([f"%{q}%", q])
+        if categoria is not None:
+            where += " AND id_categoria = ?"
+            params.append(categoria)
+        return where, params
+
+    def _consulta_conteo(self, q: str, estado: str, categoria: Optional[int]) -> Tuple[str, List]:
+        where, params = self._filtro_busqueda(q, estado, categoria)
+        return f"SELECT COUNT(*) FROM inventario{where}", params
+
+    def _consulta_busqueda(self, c, q: str, estado: str, categoria: Optional[int], limit: int, offset: int,
+                           despues_de: Optional[int] = None) -> Tuple[str, List]:
+        where, params = self._filtro_busqueda(q, estado, categoria)
+        if despues_de is not None:
+            where += " AND id > ?"
+            params.append(int(despues_de))
+        return f"SELECT {self._select(c)} FROM inventario{where} ORDER BY id LIMIT ? OFFSET ?", [*params, limit, offset]
+
+    def contar(self, q: str = "", estado: str = "activos", categoria: Optional[int] = None,
+               estimado: bool = False, conn=None) -> int:
+        """
+        Total de coincidencias, cacheado por combinación de filtros. Con
+        estimado=True sirve cualquier valor cacheado aunque haya vencido
+        """
+        clave = (q, estado, categoria)
+        with self._conteos_lock:
+            previo = self._conteos.get(clave)
+        if previo and (estimado or time.monotonic() - previo[1] < self.ttl_conteo):
+            return previo[0]
+        with self._conexion(conn) as c:
+            total = int(self._ejecutar(c, *self._consulta_conteo(q, estado, categoria)).fetchone()[0] or 0)
+        with self._conteos_lock:
+            self._conteos[clave] = (total, time.monotonic())
+        return total
+
+    def search(self, q: str = "", estado: str = "activos", categoria: Optional[int] = None,
+               limit: int = 200, offset: int = 0, despues_de: Optional[int] = None,
+               total: str = "exacto", conn=None) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Página de productos ordenada por id y total de coincidencias. Con
+        despues_de (último id de la página anterior) se pagina por clave y se
+        ignora offset. total: "exacto" (cacheado hasta la próxima escritura),
+        "estimado" (el último conocido) o "no" (devuelve None).
+        Si nada coincide, resuelve q como código
+        """
+        if despues_de is not None:
+            offset = 0
+        with self._conexion(conn) as c:
+            rows = self._ejecutar(c, *self._consulta_busqueda(c, q, estado, categoria, limit, offset, despues_de)).fetchall()
+            if q and not rows and offset == 0 and despues_de is None:
+                encontrado = self._resolver(c, [q], estado == "activos").get(q)
+                if encontrado:
+                    fila, activo = encontrado
+                    if (estado != "inactivos" or not activo) and (categoria is None or fila["id_categoria"] == categoria):
+                        return [fila], 1
+            cuenta = None if total == "no" else self.contar(q, estado, categoria, total == "estimado", conn=c)
+            return [_fila(r) for r in rows], cuenta
+
+    def bulk_get(self, codigos: Iterable[str], solo_activos: bool = False, bloquear: bool = False,
+                 id_cualquier_largo: bool = False, conn=None) -> Dict[str, Dict]:
+        """
+        Resuelve varios códigos en una sola consulta, con la misma prioridad que
+        get_by_code. Devuelve {codigo: producto}. Con bloquear=True (MySQL) las
+        filas quedan bloqueadas hasta el commit
+        """
+        codigos = list(dict.fromkeys(str(x).strip() for x in codigos if str(x).strip()))
+        if not codigos:
+            return {}
+        with self._conexion(conn) as c:
+            resueltos = self._resolver(c, codigos, solo_activos, bloquear, id_cualquier_largo)
+        return {codigo: fila for codigo, (fila, _) in resueltos.items()}
+
+    def todos(self, ids: Optional[Iterable[int]] = None, conn=None) -> List[Tuple[Dict, bool]]:
+        """(producto, activo) de todo el inventario o de los ids indicados"""
+        where, params = "", []
+        if ids is not None:
+            params = [int(x) for x in ids]
+            if not params:
+                return []
+            where = f" WHERE id IN ({_marcas(len(params))})"
+        with self._conexion(conn) as c:
+            rows = self._ejecutar(c, f"SELECT {self._select(c)}, activo FROM inventario{where}", params).fetchall()
+            return [(_fila(r), r[8] is None or int(r[8]) == 1) for r in rows]
+
+    def recorrer(self, estado: str = "todos", lote: int = 1000, conn=None) -> Iterator[Dict]:
+        """
+        Productos ordenados por id con `activo`, el nombre de la categoría y
+        todas sus barras (la principal primero). Las filas se leen de a `lote`
+        con un cursor sin buffer, así la memoria no crece con el catálogo.
+        La conexión queda ocupada hasta terminar de recorrer
+        """
+        with self._conexion(conn) as c:
+            cols = self._catalogo.columnas(c, "inventario")
+            cats = self._catalogo.columnas(c, "categorias")
+            categoria, join = "NULL", ""
+            if cats and (not cols or "id_categoria" in cols):
+                col_id = "cod_categoria" if "cod_categoria" in cats and "id" not in cats else "id"
+                categoria, join = "k.nombre", f" LEFT JOIN categorias k ON k.{col_id} = i.id_categoria"
+            # categorias también puede tener `activo`: el filtro de estado va calificado
+            sql = (f"SELECT {self._select(c, 'i.')}, i.activo, {categoria}, b.barra FROM inventario i{join} "
+                   f"LEFT JOIN inventario_barras b ON b.producto_id = i.id "
+                   f"WHERE 1=1{FILTROS_ESTADO.get(estado, '').replace('activo', 'i.activo')} ORDER BY i.id")
+            cur = self._cursor_recorrido(c)
+            try:
+                cur.execute(self._sql(sql))
+                actual = None
+                while True:
+                    rows = cur.fetchmany(lote)
+                    if not rows:
+                        break
+                    for r in rows:
+                        r = tuple(r)
+                        pid = int(r[0])
+                        if actual is None or actual["id"] != pid:
+                            if actual is not None:
+                                yield actual
+                            actual = dict(_fila(r[:8]), activo=r[8] is None or int(r[8]) == 1, categoria=r[9])
+                            actual["barras"] = [actual["codigo"]] if actual["codigo"] else []
+                        barra = str(r[10] or "")
+                        if barra and barra not in actual["barras"]:
+                            actual["barras"].append(barra)
+                if actual is not None:
+                    yield actual
+            finally:
+                cur.close()
+
+    def alternas(self, ids: Optional[Iterable[int]] = None, conn=None) -> List[Tuple[int, str]]:
+        """(producto_id, barra) de inventario_barras, de todo o de los ids indicados"""
+        where, params = "", []
+        if ids is not None:
+            params = [int(x) for x in ids]
+            if not params:
+                return []
+            where = f" WHERE producto_id IN ({_marcas(len(params))})"
+        with self._conexion(conn) as c:
+            rows = self._ejecutar(c, f"SELECT producto_id, barra FROM inventario_barras{where}", params).fetchall()
+            return [(int(r[0]), str(r[1])) for r in rows if r[1]]
+
+    def barras(self, pid: int, conn=None) -> List[str]:
+        """Barra principal y alternas del producto, sin repetidos"""
+        with self._conexion(conn) as c:
+            barras = set()
+            r = self._ejecutar(c, "SELECT barra FROM inventario WHERE id = ?", (pid,)).fetchone()
+            if r and r[0]:
+                barras.add(str(r[0]))
+            for br in self._ejecutar(c, "SELECT barra FROM inventario_barras WHERE producto_id = ?", (pid,)).fetchall():
+                if br and br[0]:
+                    barras.add(str(br[0]))
+            return sorted(barras)
+
+    def _codigo_en_uso(self, c, barra: str, excluir_id: Optional[int] = None) -> bool:
+        if excluir_id is None:
+            if self._ejecutar(c, "SELECT id FROM inventario WHERE barra = ?", (barra,)).fetchone():
+                return True
+            return bool(self._ejecutar(c, "SELECT producto_id FROM inventario_barras WHERE barra = ?", (barra,)).fetchone())
+        if self._ejecutar(c, "SELECT id FROM inventario WHERE barra = ? AND id <> ?", (barra, excluir_id)).fetchone():
+            return True
+        return bool(self._ejecutar(c, "SELECT producto_id FROM inventario_barras WHERE barra = ? AND producto_id <> ?", (barra, excluir_id)).fetchone())
+
+    @abstractmethod
+    def _agregar_alterna(self, c, pid: int, barra: str):
+        """Registra la barra en inventario_barras; si ya está se ignora"""
+
+    @abstractmethod
+    def _agregar_alternas(self, c, pares: List[Tuple[int, str]]):
+        """Varias (producto_id, barra) en inventario_barras; las que ya están se ignoran"""
+
+    @abstractmethod
+    def _upsert_por_id(self, c, cols: List[str], filas: List[List]):
+        """
+        Filas [id, barra, *cols]: con id None se insertan, con id existente se
+        actualizan sus `cols` (la barra del producto no cambia)
+        """
+
+    @abstractmethod
+    def _consulta_upsert(self, cols: List[str], filas: int) -> str:
+        """Sentencia de _upsert_por_id para `filas` filas [id, barra, *cols]"""
+
+    def _valores_actuales(self, c, ids: Iterable[int], cols: List[str]) -> Dict[int, Dict]:
+        """{id: {columna: valor}} de los productos indicados"""
+        ids = sorted(ids)
+        if not ids or not cols:
+            return {}
+        rows = self._ejecutar(c, f"SELECT id, {', '.join(cols)} FROM inventario WHERE id IN ({_marcas(len(ids))})", ids).fetchall()
+        return {int(r[0]): dict(zip(cols, tuple(r)[1:])) for r in rows}
+
+    def _consulta_ids(self, buscados: List[str]) -> Tuple[str, List]:
+        marcas = _marcas(len(buscados))
+        return (f"SELECT barra, 1, id FROM inventario WHERE barra IN ({marcas}) "
+                f"UNION ALL SELECT barra, 2, producto_id FROM inventario_barras WHERE barra IN ({marcas})",
+                [*buscados, *buscados])
+
+    def _ids_por_codigo(self, c, codigos: List[str]) -> Dict[str, int]:
+        """
+        {normalizar_codigo(codigo): id} por barra principal o, si no, por barra
+        alterna. Se buscan todas las escrituras equivalentes de cada código
+        """
+        rows = []
+        for i in range(0, len(codigos), _CODIGOS_POR_CONSULTA):
+            buscados = sorted({e for codigo in codigos[i:i + _CODIGOS_POR_CONSULTA] for e in codigos_equivalentes(codigo)})
+            rows.extend(tuple(r) for r in self._ejecutar(c, *self._consulta_ids(buscados)).fetchall())
+        ids: Dict[str, int] = {}
+        # Alternas primero para que la barra principal las sobrescriba; entre
+        # barras equivalentes de distintos productos gana el de menor id
+        for barra, prioridad, pid in sorted(rows, key=lambda r: (-int(r[1]), -int(r[2]))):
+            ids[normalizar_codigo(barra)] = int(pid)
+        return ids
+
+    def consultas_muestra(self, conn=None) -> List[Tuple[str, str, List]]:
+        """
+        (nombre, sql, params) de ejemplo de las consultas que se arman en
+        tiempo de ejecución, ya en el estilo de parámetros del backend, para
+        que auditoria_sql pueda pasarlas por EXPLAIN igual que las literales
+        """
+        with self._conexion(conn) as c:
+            cols = self._columnas_escritura(c, dict.fromkeys(COLUMNAS_IMPORTACION))
+            # Bases antiguas sin id_categoria no filtran por categoría
+            categoria = 1 if self._columnas_escritura(c, {"id_categoria": None}) else None
+            muestras = [
+                ("resolver", *self._consulta_resolver(c, ["7501234567890", "123456"], True)),
+                ("busqueda", *self._consulta_busqueda(c, "coca", "activos", categoria, 200, 0)),
+                ("busqueda_por_clave", *self._consulta_busqueda(c, "coca", "activos", None, 200, 0, despues_de=100)),
+                ("conteo", *self._consulta_conteo("coca", "activos", categoria)),
+                ("ids_por_codigo", *self._consulta_ids(codigos_equivalentes("7501234567890"))),
+                ("upsert", self._consulta_upsert(cols, 1), [1, None, *[None] * len(cols)]),
+            ]
+        return [(nombre, self._sql(sql), list(params)) for nombre, sql, params in muestras]
+
+    # --- escrituras ---
+    def create(self, datos: Dict, conn=None) -> int:
+        """
+        Inserta el producto. Sin barra se asigna el id con 6 dígitos; la barra
+        final también queda en inventario_barras. Lanza CodigoDuplicado
+        """
+        barra = datos.get("barra")
+        barra = str(barra).strip() if barra is not None else ""
+        with self._conexion(conn, escribir=True) as c:
+            if barra and self._codigo_en_uso(c, barra):
+                raise CodigoDuplicado(barra)
+            datos = dict(datos, barra=barra or None)
+            cols = self._columnas_escritura(c, datos)
+            cur = self._ejecutar(c, f"INSERT INTO inventario ({', '.join(cols)}) VALUES ({_marcas(len(cols))})",
+                                 [datos[k] for k in cols])
+            nuevo_id = int(cur.lastrowid)
+            if not barra:
+                barra = str(nuevo_id).zfill(6)
+                self._ejecutar(c, "UPDATE inventario SET barra = ? WHERE id = ?", (barra, nuevo_id))
+            self._agregar_alterna(c, nuevo_id, barra)
+            self._registrar_cambios(c, [nuevo_id])
+        self._avisar("productos", [nuevo_id])
+        return nuevo_id
+
+    def update(self, pid: int, datos: Dict, conn=None) -> int:
+        """Actualiza el producto; sin barra vuelve a la del id con 6 dígitos. Lanza CodigoDuplicado"""
+        barra = datos.get("barra")
+        barra = str(barra).strip() if barra is not None else ""
+        with self._conexion(conn, escribir=True) as c:
+            if barra and self._codigo_en_uso(c, barra, excluir_id=pid):
+                raise CodigoDuplicado(barra)
+            datos = dict(datos, barra=barra or str(int(pid)).zfill(6))
+            cols = self._columnas_escritura(c, datos)
+            sets = ", ".join(f"{k}=?" for k in cols)
+            cur = self._ejecutar(c, f"UPDATE inventario SET {sets} WHERE id = ?", [*(datos[k] for k in cols), pid])
+            self._agregar_alterna(c, pid, datos["barra"])
+            afectados = cur.rowcount
+            self._registrar_cambios(c, [pid])
+        self._avisar("productos", [pid])
+        return afectados
+
+    def set_activo(self, pid: int, activo: bool, codigo: Optional[str] = None, conn=None) -> int:
+        """Activa o desactiva (borrado lógico) por id o, si no existe, por barra"""
+        valor = 1 if activo else 0
+        ids = [pid]
+        with self._conexion(conn, escribir=True) as c:
+            afectados = self._ejecutar(c, "UPDATE inventario SET activo = ? WHERE id = ?", (valor, pid)).rowcount
+            if afectados == 0 and codigo:
+                ids = [int(r[0]) for r in self._ejecutar(c, "SELECT id FROM inventario WHERE barra = ?", (codigo,)).fetchall()]
+                if ids:
+                    afectados = self._ejecutar(c, f"UPDATE inventario SET activo = ? WHERE id IN ({_marcas(len(ids))})", (valor, *ids)).rowcount
+            if afectados:
+                self._registrar_cambios(c, ids)
+        if afectados:
+            self._avisar("productos", ids)
+        return afectados
+
+    def bulk_update_stock(self, cambios: Dict[int, float], conn=None) -> int:
+        """Suma a cada id su delta de stock (negativo para descontar) en un solo UPDATE"""
+        cambios = {int(k): v for k, v in cambios.items() if v}
+        if not cambios:
+            return 0
+        casos = " ".join("WHEN ? THEN ?" for _ in cambios)
+        params: List = []
+        for pid, delta in cambios.items():
+            params.extend([pid, delta])
+        params.extend(cambios.keys())
+        with self._conexion(conn, escribir=True) as c:
+            afectados = self._ejecutar(
+                c,
+                f"UPDATE inventario SET stock = stock + (CASE id {casos} ELSE 0 END) WHERE id IN ({_marcas(len(cambios))})",
+                params
+            ).rowcount
+            self._registrar_cambios(c, cambios.keys())
+        self._avisar("stock", cambios)
+        return afectados
+
+    def importar_lote(self, productos: Iterable[Dict], conn=None) -> Dict[str, int]:
+        """
+        Inserta o actualiza un lote de productos (codigo + COLUMNAS_IMPORTACION)
+        en una transacción y un solo upsert. Los códigos se resuelven de una vez
+        contra la barra principal y las alternas: si existen se actualiza ese
+        producto, si no se crea con el código como barra. stock y pesable en
+        None conservan el valor actual (0 al crear). Cada código queda también
+        en inventario_barras. Los códigos se comparan con normalizar_codigo
+        (un GTIN con otros ceros a la izquierda es el mismo producto); con
+        códigos repetidos gana la última fila. Devuelve {insertados, actualizados}
+        """
+        por_clave: Dict[str, Tuple[str, Dict]] = {}
+        for p in productos:
+            codigo = limpiar_codigo(p.get("codigo"))
+            if codigo:
+                por_clave[normalizar_codigo(codigo)] = (codigo, p)
+        if not por_clave:
+            return {"insertados": 0, "actualizados": 0}
+        claves = list(por_clave)
+        with self._conexion(conn, escribir=True) as c:
+            ids = self._ids_por_codigo(c, claves)
+            cols = self._columnas_escritura(c, dict.fromkeys(COLUMNAS_IMPORTACION))
+            actuales = self._valores_actuales(c, set(ids.values()), [k for k in cols if k in CONSERVAR_SI_VACIO])
+            filas = []
+            for clave, (codigo, p) in por_clave.items():
+                pid = ids.get(clave)
+                previos = actuales.get(pid, CONSERVAR_SI_VACIO)
+                valores = [p.get(k) if p.get(k) is not None else previos.get(k) for k in cols]
+                filas.append([pid, None if pid is not None else codigo, *valores])
+            self._upsert_por_id(c, cols, filas)
+            nuevos = [clave for clave in claves if clave not in ids]
+            if nuevos:
+                ids.update(self._ids_por_codigo(c, [por_clave[clave][0] for clave in nuevos]))
+            self._agregar_alternas(c, [(ids[clave], por_clave[clave][0]) for clave in claves if clave in ids])
+            afectados = sorted(set(ids[clave] for clave in claves if clave in ids))
+            self._registrar_cambios(c, afectados)
+        self._avisar("productos", afectados)
+        return {"insertados": len(nuevos), "actualizados": len(claves) - len(nuevos)}
+
+    def add_barra(self, pid: int, barra: str, conn=None):
+        with self._conexion(conn, escribir=True) as c:
+            if self._codigo_en_uso(c, barra, excluir_id=pid):
+                raise CodigoDuplicado(barra)
+            self._ejecutar(c, "INSERT INTO inventario_barras (producto_id, barra) VALUES (?, ?)", (pid, barra))
+            self._registrar_cambios(c, [pid])
+        self._avisar("productos", [pid])
+
+    def delete_barra(self, pid: int, barra: str, conn=None) -> int:
+        with self._conexion(conn, escribir=True) as c:
+            afectados = self._ejecutar(c, "DELETE FROM inventario_barras WHERE producto_id = ? AND barra = ?", (pid, barra)).rowcount
+            self._registrar_cambios(c, [pid])
+        self._avisar("productos", [pid])
+        return afectados
+
+
+class MySQLInventoryRepository(InventoryRepository):
+    """Backend MySQL; `conectar` devuelve una conexión del pool"""
+
+    motor = "mysql"
+
+    def _sql(self, sql: str) -> str:
+        return sql.replace("?", "%s")
+
+    @contextmanager
+    def _conexion(self, conn=None, escribir: bool = False):
+        if conn is not None:
+            yield conn
+            return
+        conn = self._conectar()
+        try:
+            yield conn
+            if escribir:
+                conn.commit()
+        finally:
+            # close() deshace lo no confirmado y devuelve la conexión
+            conn.close()
+
+    def _bloqueo(self) -> str:
+        return " FOR UPDATE"
+
+    def _cursor_recorrido(self, conn):
+        return cursor_servidor(conn)
+
+    def _agregar_alterna(self, c, pid: int, barra: str):
+        self._ejecutar(c, "INSERT IGNORE INTO inventario_barras (producto_id, barra) VALUES (?, ?)", (pid, barra))
+
+    def _agregar_alternas(self, c, pares: List[Tuple[int, str]]):
+        if not pares:
+            return
+        valores = ", ".join(["(?, ?)"] * len(pares))
+        self._ejecutar(c, f"INSERT IGNORE INTO inventario_barras (producto_id, barra) VALUES {valores}",
+                       [x for par in pares for x in par])
+
+    def _consulta_upsert(self, cols: List[str], filas: int) -> str:
+        # Un solo INSERT de varias filas; el id existente dispara la actualización
+        sets = ", ".join(f"{k} = VALUES({k})" for k in cols)
+        valores = ", ".join([f"({_marcas(len(cols) + 2)})"] * filas)
+        return f"INSERT INTO inventario (id, barra, {', '.join(cols)}) VALUES {valores} ON DUPLICATE KEY UPDATE {sets}"
+
+    def _upsert_por_id(self, c, cols: List[str], filas: List[List]):
+        self._ejecutar(c, self._consulta_upsert(cols, len(filas)), [x for fila in filas for x in fila])
+
+    def compactar_cambios(self, conn=None) -> int:
+        with self._conexion(conn, escribir=True) as c:
+            return self._ejecutar(
+                c, "DELETE c1 FROM inventario_cambios c1 JOIN inventario_cambios c2 ON c1.producto_id = c2.producto_id AND c1.version < c2.version"
+            ).rowcount
+
+
+class SQLiteInventoryRepository(InventoryRepository):
+    """
+    Backend SQLite; `conectar` devuelve la conexión del hilo y `transaccion`
+    agrupa las escrituras (se une a una transacción ya abierta)
+    """
+
+    motor = "sqlite"
+
+    def __init__(self, conectar: Callable, catalogo, transaccion: Callable):
+        super().__init__(conectar, catalogo)
+        self._transaccion = transaccion
+
+    @contextmanager
+    def _conexion(self, conn=None, escribir: bool = False):
+        if conn is not None:
+            yield conn
+            return
+        if not escribir:
+            yield self._conectar()
+            return
+        try:
+            with self._transaccion():
+                yield self._conectar()
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE" in str(e).upper():
+                raise CodigoDuplicado(str(e)) from e
+            raise
+
+    def _select(self, conn, alias: str = "") -> str:
+        # Bases antiguas no tienen pesable ni id_categoria
+        cols = self._catalogo.columnas(conn, "inventario")
+        return ", ".join(alias + c if c in cols else f"NULL AS {c}" for c in COLUMNAS)
+
+    def _columnas_escritura(self, conn, datos: Dict) -> List[str]:
+        cols = self._catalogo.columnas(conn, "inventario")
+        return [c for c in COLUMNAS_ESCRITURA if c in datos and c in cols]
+
+    def _agregar_alterna(self, c, pid: int, barra: str):
+        self._ejecutar(c, "INSERT OR IGNORE INTO inventario_barras (producto_id, barra) VALUES (?, ?)", (pid, barra))
+
+    def _agregar_alternas(self, c, pares: List[Tuple[int, str]]):
+        c.executemany("INSERT OR IGNORE INTO inventario_barras (producto_id, barra) VALUES (?, ?)", pares)
+
+    def _consulta_upsert(self, cols: List[str], filas: int) -> str:
+        # Una fila por sentencia: executemany la repite para todo el lote
+        sets = ", ".join(f"{k} = excluded.{k}" for k in cols)
+        return (f"INSERT INTO inventario (id, barra, {', '.join(cols)}) VALUES ({_marcas(len(cols) + 2)}) "
+                f"ON CONFLICT(id) DO UPDATE SET {sets}")
+
+    def _upsert_por_id(self, c, cols: List[str], filas: List[List]):
+        c.executemany(self._consulta_upsert(cols, len(filas)), filas)
+
+    def compactar_cambios(self, conn=None) -> int:
+        with self._conexion(conn, escribir=True) as c:
+            return self._ejecutar(
+                c, "DELETE FROM inventario_cambios WHERE version < (SELECT MAX(version) FROM inventario_cambios c2 WHERE c2.producto_id = inventario_cambios.producto_id)"
+            ).rowcount
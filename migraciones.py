@@ -0,0 +1,147 @@
+"""
+Registro de migraciones de esquema versionadas.
+Cada motor (MySQL o SQLite) tiene su lista ordenada de migraciones; las
+pendientes se aplican una sola vez (al arrancar o con `flask --app app migrar`)
+y quedan anotadas en la tabla schema_version
+"""
+from datetime import datetime
+from typing import Callable, List, Set, Tuple
+
+
+class RegistroMigraciones:
+    """Migraciones ordenadas por versión para un motor ("mysql" o "sqlite")"""
+
+    def __init__(self, motor: str):
+        if motor not in ("mysql", "sqlite"):
+            raise ValueError(f"Motor no soportado: {motor}")
+        self.motor = motor
+        self._migraciones: List[Tuple[int, str, Callable]] = []
+        self._al_aplicar: List[Callable] = []
+
+    @property
+    def _ph(self) -> str:
+        return "%s" if self.motor == "mysql" else "?"
+
+    def migracion(self, version: int, descripcion: str):
+        """
+        Decorador que registra una migración. La función recibe un cursor;
+        el registro confirma al terminar cada una
+        """
+        def decorador(fn: Callable) -> Callable:
+            if any(v == version for v, _, _ in self._migraciones):
+                raise ValueError(f"Versión de migración repetida: {version}")
+            self._migraciones.append((version, descripcion, fn))
+            self._migraciones.sort(key=lambda m: m[0])
+            return fn
+        return decorador
+
+    def al_aplicar(self, fn: Callable) -> Callable:
+        """Registra una función que se llama tras aplicar migraciones (p. ej. invalidar cachés de esquema)"""
+        self._al_aplicar.append(fn)
+        return fn
+
+    def _asegurar_tabla_version(self, cur):
+        if self.motor == "mysql":
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    descripcion VARCHAR(255),
+                    aplicada VARCHAR(19)
+                )
+            """)
+        else:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    descripcion TEXT,
+                    aplicada TEXT
+                )
+            """)
+
+    def aplicadas(self, conn) -> Set[int]:
+        cur = conn.cursor()
+        self._asegurar_tabla_version(cur)
+        conn.commit()
+        cur.execute("SELECT version FROM schema_version")
+        return {int(r[0]) for r in cur.fetchall()}
+
+    def pendientes(self, conn) -> List[Tuple[int, str]]:
+        hechas = self.aplicadas(conn)
+        return [(v, d) for v, d, _ in self._migraciones if v not in hechas]
+
+    def aplicar(self, conn) -> List[Tuple[int, str]]:
+        """Aplica en orden las migraciones pendientes y devuelve las aplicadas"""
+        hechas = self.aplicadas(conn)
+        cur = conn.cursor()
+        aplicadas = []
+        for version, descripcion, fn in self._migraciones:
+            if version in hechas:
+                continue
+            try:
+                fn(cur)
+                cur.execute(
+                    f"INSERT INTO schema_version (version, descripcion, aplicada) VALUES ({self._ph}, {self._ph}, {self._ph})",
+                    (version, descripcion, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                # Otro proceso pudo aplicarla al mismo tiempo
+                if version in self.aplicadas(conn):
+                    continue
+                raise
+            aplicadas.append((version, descripcion))
+        if aplicadas:
+            for fn in self._al_aplicar:
+                fn()
+        return aplicadas
+
+
+def _indices_existentes(conn, motor: str, tabla: str) -> List[Tuple[str, ...]]:
+    """Columnas (en orden) de cada índice de la tabla"""
+    indices = {}
+    cur = conn.cursor()
+    if motor == "mysql":
+        cur.execute(f"SHOW INDEX FROM {tabla}")
+        for r in cur.fetchall():
+            # Key_name, Seq_in_index, Column_name
+            indices.setdefault(r[2], []).append((int(r[3]), str(r[4]).lower()))
+    else:
+        cur.execute(f"PRAGMA index_list({tabla})")
+        for r in cur.fetchall():
+            cur2 = conn.cursor()
+            cur2.execute(f"PRAGMA index_info({r[1]})")
+            indices[r[1]] = [(int(x[0]), str(x[2]).lower()) for x in cur2.fetchall()]
+    return [tuple(c for _, c in sorted(cols)) for cols in indices.values()]
+
+
+def asegurar_indices(conn, motor: str, indices, catalogo) -> List[str]:
+    """
+    Crea los índices definidos (tabla, nombre, columnas) que falten. Se omiten
+    los de tablas o columnas inexistentes y los ya cubiertos por otro índice
+    con las mismas columnas iniciales. Es idempotente y barato: se ejecuta
+    en cada arranque después de las migraciones
+    """
+    creados = []
+    cur = conn.cursor()
+    for tabla, nombre, columnas in indices:
+        cols_tabla = catalogo.columnas(conn, tabla)
+        if not cols_tabla or any(c not in cols_tabla for c in columnas):
+            continue
+        existentes = _indices_existentes(conn, motor, tabla)
+        if any(e[:len(columnas)] == tuple(columnas) for e in existentes):
+            continue
+        try:
+            cur.execute(f"CREATE INDEX {nombre} ON {tabla} ({', '.join(columnas)})")
+            conn.commit()
+            creados.append(nombre)
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            print(f"No se pudo crear el índice {nombre} en {tabla}: {e}", flush=True)
+    return creados
@@ -0,0 +1,245 @@
+"""
+Pool acotado de conexiones MySQL.
+Reutiliza conexiones entre peticiones en lugar de pagar el handshake TCP
+y la autenticación en cada escaneo
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict
+
+
+class PoolAgotado(Exception):
+    """No se liberó ninguna conexión dentro del tiempo de espera"""
+
+
+class ConexionPool:
+    """
+    Conexión prestada por el pool. Delega todo en la conexión real;
+    close() la devuelve al pool en lugar de cerrarla
+    """
+
+    def __init__(self, pool: "PoolMySQL", conn):
+        self._pool = pool
+        self._conn = conn
+        self.creada = time.monotonic()
+        self.ultimo_uso = self.creada
+        self.prestada = False
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+    def close(self):
+        self._pool.liberar(self)
+
+
+class ConexionPeticion:
+    """
+    Conexión asignada a una petición Flask (se guarda en `g`).
+    close() no hace nada: la conexión es compartida por toda la petición y
+    un helper que la "cierra" no debe deshacer lo que el llamador aún no
+    confirmó. Vuelve al pool en el teardown mediante devolver(), que hace
+    rollback de lo pendiente
+    """
+
+    def __init__(self, conexion: ConexionPool):
+        self._conexion = conexion
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion, nombre)
+
+    def close(self):
+        pass
+
+    def devolver(self):
+        self._conexion.close()
+
+
+class PoolMySQL:
+    """
+    Pool con tamaño mínimo/máximo, espera acotada al pedir conexión,
+    validación barata (ping solo si la conexión estuvo inactiva) y
+    reciclaje de conexiones viejas
+    """
+
+    def __init__(self, crear_conexion: Callable, minimo: int = 1, maximo: int = 8,
+                 espera: float = 5.0, reciclar: float = 1800.0, validar_tras: float = 30.0):
+        self._crear = crear_conexion
+        self.minimo = max(0, int(minimo))
+        self.maximo = max(1, int(maximo), self.minimo)
+        self.espera = float(espera)
+        self.reciclar = float(reciclar)
+        self.validar_tras = float(validar_tras)
+        self._libres = deque()
+        self._total = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {
+            "creadas": 0,
+            "recicladas": 0,
+            "descartadas": 0,
+            "prestamos": 0,
+            "esperas": 0,
+            "tiempo_espera_ms": 0.0,
+            "espera_max_ms": 0.0,
+            "agotado": 0,
+        }
+
+    def _nueva(self) -> ConexionPool:
+        conexion = ConexionPool(self, self._crear())
+        with self._cond:
+            self._stats["creadas"] += 1
+        return conexion
+
+    def _descartar(self, conexion: ConexionPool, motivo: str = "descartadas"):
+        try:
+            conexion._conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._total -= 1
+            self._stats[motivo] += 1
+            self._cond.notify()
+
+    def _es_valida(self, conexion: ConexionPool) -> bool:
+        if time.monotonic() - conexion.ultimo_uso < self.validar_tras:
+            return True
+        conn = conexion._conn
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except TypeError:
+            pass
+        except Exception:
+            return False
+        try:
+            return bool(conn.is_connected())
+        except Exception:
+            return False
+
+    def precargar(self):
+        """Abre las conexiones mínimas por adelantado"""
+        while True:
+            with self._cond:
+                if self._total >= self.minimo:
+                    return
+                self._total += 1
+            try:
+                conexion = self._nueva()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                raise
+            with self._cond:
+                self._libres.append(conexion)
+                self._cond.notify()
+
+    def obtener(self) -> ConexionPool:
+        """Presta una conexión; espera hasta `espera` segundos si el pool está lleno"""
+        inicio = None
+        while True:
+            conexion = None
+            crear = False
+            with self._cond:
+                while not self._libres and self._total >= self.maximo:
+                    if inicio is None:
+                        inicio = time.monotonic()
+                        self._stats["esperas"] += 1
+                    restante = self.espera - (time.monotonic() - inicio)
+                    if restante <= 0:
+                        self._stats["agotado"] += 1
+                        raise PoolAgotado(f"Sin conexiones MySQL libres tras {self.espera:.1f}s")
+                    self._cond.wait(restante)
+                if self._libres:
+                    conexion = self._libres.pop()
+                else:
+                    self._total += 1
+                    crear = True
+            if crear:
+                try:
+                    conexion = self._nueva()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            elif time.monotonic() - conexion.creada > self.reciclar:
+                self._descartar(conexion, "recicladas")
+                continue
+            elif not self._es_valida(conexion):
+                self._descartar(conexion)
+                continue
+            with self._cond:
+                if inicio is not None:
+                    espera_ms = (time.monotonic() - inicio) * 1000.0
+                    self._stats["tiempo_espera_ms"] += espera_ms
+                    self._stats["espera_max_ms"] = max(self._stats["espera_max_ms"], espera_ms)
+                self._stats["prestamos"] += 1
+            conexion.prestada = True
+            return conexion
+
+    def liberar(self, conexion: ConexionPool):
+        """Devuelve la conexión; deshace lo no confirmado para no arrastrar transacciones"""
+        with self._cond:
+            if not conexion.prestada:
+                return
+            conexion.prestada = False
+        try:
+            conexion._conn.rollback()
+        except Exception:
+            self._descartar(conexion)
+            return
+        conexion.ultimo_uso = time.monotonic()
+        with self._cond:
+            self._libres.append(conexion)
+            self._cond.notify()
+
+    def estadisticas(self) -> Dict:
+        with self._cond:
+            stats = dict(self._stats)
+            libres = len(self._libres)
+            stats.update({
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "total": self._total,
+                "libres": libres,
+                "en_uso": self._total - libres,
+            })
+        stats["tiempo_espera_ms"] = round(stats["tiempo_espera_ms"], 2)
+        stats["espera_max_ms"] = round(stats["espera_max_ms"], 2)
+        return stats
+
+    def cerrar(self):
+        """Cierra las conexiones libres del pool"""
+        with self._cond:
+            libres = list(self._libres)
+            self._libres.clear()
+        for conexion in libres:
+            self._descartar(conexion)
+
+
+def conexion_real(conn):
+    """La conexión del driver debajo de los envoltorios (pool, petición, instrumentación)"""
+    while True:
+        interna = vars(conn).get("_conn") or vars(conn).get("_conexion")
+        if interna is None:
+            return conn
+        conn = interna
+
+
+def cursor_servidor(conn):
+    """
+    Cursor sin buffer: las filas se traen del servidor a medida que se leen
+    en lugar de cargar el resultado completo en memoria. Mientras no se lea
+    todo, la conexión no admite otras consultas
+    """
+    modulo = type(conexion_real(conn)).__module__.split(".")[0]
+    if modulo == "pymysql":
+        import pymysql.cursors
+        return conn.cursor(pymysql.cursors.SSCursor)
+    if modulo == "MySQLdb":
+        import MySQLdb.cursors
+        return conn.cursor(MySQLdb.cursors.SSCursor)
+    if modulo == "mysql":
+        # mysql.connector
+        return conn.cursor(buffered=False)
+    return conn.cursor()
@@ -0,0 +1,162 @@
+"""
+Trabajos en segundo plano dentro del proceso (importaciones grandes, etc.).
+Cada trabajo corre en un pool de hilos y guarda su estado y progreso en la
+tabla `trabajos` de SQLite, así cualquier worker puede responder la consulta
+de estado y la cancelación llega aunque la pida otro proceso. La cancelación
+es cooperativa: el trabajo llama a `avanzar()` y ahí se detiene
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+CANCELADO = "cancelado"
+INTERRUMPIDO = "interrumpido"
+ACTIVOS = (PENDIENTE, EN_CURSO)
+
+_CAMPOS = ("id", "tipo", "estado", "total", "hechas", "errores", "resultado", "mensaje", "creado", "actualizado")
+
+
+class TrabajoCancelado(Exception):
+    """Se pidió cancelar el trabajo; lo ya confirmado se conserva"""
+
+
+class Trabajo:
+    """Lo que recibe la función del trabajo para informar progreso"""
+
+    def __init__(self, gestor: "GestorTrabajos", tid: str):
+        self._gestor = gestor
+        self.id = tid
+        self._ultimo = 0.0
+        # Último progreso informado; se guarda al terminar aunque no tocara guardarlo
+        self.progreso: Dict = {}
+
+    def avanzar(self, hechas: int, total: Optional[int] = None, errores: Optional[int] = None,
+                resultado: Optional[Dict] = None):
+        """
+        Guarda el progreso (como mucho cada `intervalo` segundos) y lanza
+        TrabajoCancelado si se pidió cancelar, con el progreso ya guardado
+        """
+        self.progreso = {"hechas": hechas, "total": total, "errores": errores, "resultado": resultado}
+        cancelado = self._gestor.cancelacion_pedida(self.id)
+        ahora = time.monotonic()
+        if cancelado or ahora - self._ultimo >= self._gestor.intervalo:
+            self._ultimo = ahora
+            self._gestor._guardar(self.id, **self.progreso)
+        if cancelado:
+            raise TrabajoCancelado()
+
+
+class GestorTrabajos:
+    """
+    `transaccion` es el agrupador de escrituras SQLite de la aplicación (una
+    conexión por hilo). Un trabajo en curso que no guarda nada durante
+    `inactividad` segundos se informa como interrumpido (el proceso murió)
+    """
+
+    def __init__(self, transaccion: Callable, max_hilos: int = 2, intervalo: float = 0.5,
+                 inactividad: float = 600.0):
+        self._transaccion = transaccion
+        self.intervalo = float(intervalo)
+        self.inactividad = float(inactividad)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_hilos)), thread_name_prefix="trabajo")
+        self._cancelados = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ahora() -> str:
+        return datetime.now().isoformat(timespec="seconds")
+
+    def _guardar(self, tid: str, **campos):
+        campos = {k: v for k, v in campos.items() if v is not None}
+        if "resultado" in campos:
+            campos["resultado"] = json.dumps(campos["resultado"], ensure_ascii=False)
+        campos["actualizado"] = self._ahora()
+        sets = ", ".join(f"{k} = ?" for k in campos)
+        with self._transaccion() as conn:
+            conn.execute(f"UPDATE trabajos SET {sets} WHERE id = ?", (*campos.values(), tid))
+
+    def enviar(self, tipo: str, fn: Callable, *args, **kwargs) -> str:
+        """
+        Encola fn(trabajo, *args, **kwargs) y devuelve el id. Lo que devuelve
+        fn queda como resultado del trabajo
+        """
+        tid = uuid.uuid4().hex
+        ahora = self._ahora()
+        with self._transaccion() as conn:
+            conn.execute(
+                "INSERT INTO trabajos (id, tipo, estado, hechas, errores, creado, actualizado) VALUES (?, ?, ?, 0, 0, ?, ?)",
+                (tid, tipo, PENDIENTE, ahora, ahora)
+            )
+        self._pool.submit(self._ejecutar, tid, fn, args, kwargs)
+        return tid
+
+    def _ejecutar(self, tid: str, fn: Callable, args, kwargs):
+        trabajo = Trabajo(self, tid)
+        try:
+            if self.cancelacion_pedida(tid):
+                raise TrabajoCancelado()
+            self._guardar(tid, estado=EN_CURSO)
+            resultado = fn(trabajo, *args, **kwargs)
+            self._guardar(tid, **dict(trabajo.progreso, estado=COMPLETADO, resultado=resultado))
+        except TrabajoCancelado:
+            self._guardar(tid, **dict(trabajo.progreso, estado=CANCELADO, mensaje="Cancelado por el usuario"))
+        except Exception as e:
+            # El trabajo puede dejar en la excepción lo que alcanzó a hacer
+            resultado = getattr(e, "resultados", None) or trabajo.progreso.get("resultado")
+            self._guardar(tid, **dict(trabajo.progreso, estado=FALLIDO, mensaje=str(e), resultado=resultado))
+        finally:
+            with self._lock:
+                self._cancelados.discard(tid)
+
+    def estado(self, tid: str) -> Optional[Dict]:
+        with self._transaccion() as conn:
+            r = conn.execute(f"SELECT {', '.join(_CAMPOS)} FROM trabajos WHERE id = ?", (tid,)).fetchone()
+        if r is None:
+            return None
+        datos = dict(zip(_CAMPOS, tuple(r)))
+        datos["resultado"] = json.loads(datos["resultado"]) if datos["resultado"] else None
+        # Solo un trabajo en curso guarda progreso; uno pendiente puede esperar
+        # turno en el pool todo lo que haga falta
+        if datos["estado"] == EN_CURSO:
+            try:
+                quieto = (datetime.now() - datetime.fromisoformat(datos["actualizado"])).total_seconds()
+            except Exception:
+                quieto = 0
+            if quieto > self.inactividad:
+                datos["estado"] = INTERRUMPIDO
+        total = datos["total"]
+        if datos["estado"] == COMPLETADO:
+            datos["progreso"] = 100
+        else:
+            datos["progreso"] = min(99, int(datos["hechas"] * 100 / total)) if total else 0
+        return datos
+
+    def cancelar(self, tid: str) -> Optional[str]:
+        """Pide cancelar; devuelve el estado del trabajo (None si no existe)"""
+        with self._transaccion() as conn:
+            r = conn.execute("SELECT estado FROM trabajos WHERE id = ?", (tid,)).fetchone()
+            if r is None:
+                return None
+            if r[0] not in ACTIVOS:
+                return r[0]
+            conn.execute("UPDATE trabajos SET cancelar = 1 WHERE id = ?", (tid,))
+        with self._lock:
+            self._cancelados.add(tid)
+        return r[0]
+
+    def cancelacion_pedida(self, tid: str) -> bool:
+        with self._lock:
+            if tid in self._cancelados:
+                return True
+        # La pudo pedir otro proceso
+        with self._transaccion() as conn:
+            r = conn.execute("SELECT cancelar FROM trabajos WHERE id = ?", (tid,)).fetchone()
+        return bool(r and r[0])